@@ -0,0 +1,47 @@
+"""
+Compare the gpxpy object tree GPX export with storage.gpx_writer.
+
+Run from src/:
+    PYTHONPATH=. python ../benchmarks/gpx_writer.py --sizes 10000 100000 1000000
+"""
+import argparse
+import time
+from datetime import datetime, timedelta, timezone
+
+from backtrack.storage.gpx_writer import write_gpx
+from backtrack.storage.models import LogTrack, LogTrackDetails, LogPoint
+
+
+def make_track(n: int) -> LogTrack:
+    start: datetime = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    details: LogTrackDetails = LogTrackDetails(track_id="bench", key="bench", start_time=start)
+    points: list[LogPoint] = [
+        LogPoint(track_id="bench", ts=start + timedelta(seconds=n - i, milliseconds=i % 1000),
+                 lat=45 + i * 1e-5, lon=-121 + i * 1e-5, altitude=100 + i % 50 if i % 7 else None,
+                 speed_kph=i % 90 * 1.5, accuracy=4.0, battery=80.0)
+        for i in range(n)]
+    return LogTrack(details=details, points=points)
+
+
+def timed(fn) -> tuple[float, str]:
+    start: float = time.perf_counter()
+    out: str = fn()
+    return time.perf_counter() - start, out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'points':>10} {'gpxpy s':>10} {'writer s':>10} {'speedup':>8} {'MB':>8}")
+    for n in args.sizes:
+        track: LogTrack = make_track(n)
+        gpxpy_s, expected = timed(lambda: track.get_gpx_track().to_xml())
+        writer_s, actual = timed(lambda: write_gpx(track.details, track.points))
+        assert actual == expected, "gpx_writer output differs from gpxpy"
+        print(f"{n:>10} {gpxpy_s:>10.3f} {writer_s:>10.3f} {gpxpy_s / writer_s:>7.1f}x {len(actual) / 1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
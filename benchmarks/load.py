@@ -0,0 +1,267 @@
+"""
+Ingest and export load test against an in-process app, results are written as JSON.
+
+Runs on a fresh SQLite database in a temporary directory, otherwise with src/resources/config.yaml:
+    python benchmarks/load.py --devices 20 --points 250 --sizes 1000 10000 100000
+    python benchmarks/load.py --batched --compare benchmarks/results/<commit>.json
+
+Ingest replays synthetic GPSLogger streams of many devices concurrently through POST /track, with
+jittered fixes and some points delivered out of order. Export times and measures every TrackFormat
+across track sizes, cold (track cache dropped) and warm, whole and streamed.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from random import Random
+from typing import Iterator, Optional
+
+import numpy as np
+import yaml
+
+SRC: Path = Path(__file__).resolve().parent.parent / "src"
+RESULTS: Path = Path(__file__).resolve().parent / "results"
+START: datetime = datetime(2024, 6, 1, 7, tzinfo=timezone.utc)
+METERS_PER_DEGREE: float = 111320
+
+Fix = tuple[datetime, float, float, float, float, float, float, float, float]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=SRC, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def prepare(workdir: Path, batched: bool) -> None:
+    # create_app reads ./resources/config.yaml relative to the working directory
+    with open(SRC / "resources" / "config.yaml") as conf:
+        conf_vals: dict = yaml.safe_load(conf)
+    conf_vals["general"].update(static_dir=str(SRC / "static"), template_dir=str(SRC / "templates"),
+                                log_level="warning")
+    conf_vals.setdefault("database", {})["url"] = f"sqlite:///{workdir / 'bench.db'}"
+    conf_vals.setdefault("ingest", {})["batched"] = batched
+    (workdir / "resources").mkdir()
+    with open(workdir / "resources" / "config.yaml", "w") as conf:
+        yaml.safe_dump(conf_vals, conf)
+    os.chdir(workdir)
+    sys.path.insert(0, str(SRC))
+
+
+def walk(rand: Random, n: int, interval_s: float, jitter_s: float) -> Iterator[Fix]:
+    """GPSLogger fixes of a device moving at road speeds: (ts, lat, lon, altitude, speed_kph, direction, distance,
+    battery, accuracy), ts jittered by up to jitter_s around every interval_s."""
+    ts: datetime = START + timedelta(seconds=rand.uniform(0, 3600))
+    lat: float = rand.uniform(44, 47)
+    lon: float = rand.uniform(-123, -117)
+    altitude: float = rand.uniform(0, 1500)
+    heading: float = rand.uniform(0, 360)
+    distance: float = 0
+    for i in range(n):
+        step_s: float = interval_s + rand.uniform(-jitter_s, jitter_s)
+        speed: float = max(0.0, rand.gauss(12, 5))
+        heading = (heading + rand.gauss(0, 15)) % 360
+        meters: float = speed * step_s
+        lat += meters * math.cos(math.radians(heading)) / METERS_PER_DEGREE
+        lon += meters * math.sin(math.radians(heading)) / (METERS_PER_DEGREE * math.cos(math.radians(lat)))
+        altitude += rand.gauss(0, 2)
+        distance += meters
+        ts += timedelta(seconds=step_s)
+        yield (ts, lat, lon, altitude, speed * 3.6, heading, distance, max(5.0, 100 - i * 0.01),
+               abs(rand.gauss(6, 3)) + 1)
+
+
+def gpslogger_items(rand: Random, device: int, n: int, interval_s: float, jitter_s: float,
+                    out_of_order: float) -> list[dict]:
+    """POST /track bodies as GPSLogger's custom url profile sends them, in delivery order."""
+    track_id: str = f"device_{device}_{START:%Y%m%d}"
+    items: list[dict] = [
+        {"key": f"bench_{device % 4}", "track_id": track_id, "description": "", "ts": ts.isoformat(), "lat": lat,
+         "lon": lon, "altitude": altitude, "direction": direction, "speed_kph": speed_kph, "distance": distance,
+         "battery": battery, "accuracy": accuracy, "android_id": f"android{device:04d}",
+         "start_time": START.isoformat(), "profile": f"bench_{device % 4}"}
+        for ts, lat, lon, altitude, speed_kph, direction, distance, battery, accuracy
+        in walk(rand, n, interval_s, jitter_s)]
+    # a fix that missed its upload goes out after the next one
+    for i in range(len(items) - 1):
+        if rand.random() < out_of_order:
+            items[i], items[i + 1] = items[i + 1], items[i]
+    return items
+
+
+def latency_stats(seconds: list[float]) -> dict[str, float]:
+    ms: np.ndarray = np.array(seconds) * 1000
+    return {"p50_ms": float(np.percentile(ms, 50)), "p90_ms": float(np.percentile(ms, 90)),
+            "p99_ms": float(np.percentile(ms, 99)), "max_ms": float(ms.max()), "mean_ms": float(ms.mean())}
+
+
+async def stored_points(controller) -> int:
+    from sqlalchemy import func, select
+
+    from backtrack.storage.models import LogPoint
+
+    async with controller.async_engine.connect() as conn:
+        return (await conn.execute(select(func.count()).select_from(LogPoint))).scalar()
+
+
+async def bench_ingest(client, controller, args) -> dict:
+    streams: list[list[dict]] = [gpslogger_items(Random(args.seed + d), d, args.points, args.interval, args.jitter,
+                                                 args.out_of_order) for d in range(args.devices)]
+    total: int = sum(len(s) for s in streams)
+    before: int = await stored_points(controller)
+    latencies: list[float] = []
+
+    async def device(items: list[dict]) -> None:
+        for item in items:
+            start: float = time.perf_counter()
+            response = await client.post("/track", json=item)
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+    start: float = time.perf_counter()
+    await asyncio.gather(*(device(items) for items in streams))
+    posted_s: float = time.perf_counter() - start
+    # batched ingest answers before its group commit, the clock runs until every point is stored
+    while await stored_points(controller) - before < total:
+        if time.perf_counter() - start > posted_s + 60:
+            raise RuntimeError(f"only {await stored_points(controller) - before} of {total} points were stored")
+        await asyncio.sleep(0.01)
+    stored_s: float = time.perf_counter() - start
+    return {"devices": args.devices, "points": total, "posted_s": posted_s, "stored_s": stored_s,
+            "points_per_s": total / stored_s, "latency": latency_stats(latencies)}
+
+
+async def timed_get(client, url: str) -> tuple[float, int]:
+    start: float = time.perf_counter()
+    response = await client.get(url)
+    elapsed: float = time.perf_counter() - start
+    response.raise_for_status()
+    return elapsed, len(response.content)
+
+
+async def bench_export(client, controller, args) -> dict:
+    from backtrack.controllers.TrackFormat import TrackFormat
+    from backtrack.storage.importers import point_row
+
+    results: dict = {}
+    for size in args.sizes:
+        track_id: str = f"export_{size}"
+        await controller.import_points("bench_export", track_id, (
+            point_row(track_id, ts, lat, lon, altitude, speed_kph, direction, distance, battery, accuracy)
+            for ts, lat, lon, altitude, speed_kph, direction, distance, battery, accuracy
+            in walk(Random(args.seed + size), size, args.interval, args.jitter)))
+
+        results[str(size)] = {}
+        for fmt in TrackFormat:
+            for stream in (False, True):
+                url: str = f"/bench_export/track/{track_id}/{fmt.value}" + ("?stream=true" if stream else "")
+                cold: list[float] = []
+                for _ in range(args.repeat):
+                    controller.track_cache.invalidate(track_id)
+                    elapsed, size_bytes = await timed_get(client, url)
+                    cold.append(elapsed)
+                warm: list[float] = [(await timed_get(client, url))[0] for _ in range(args.repeat)]
+
+                # a separate pass, tracemalloc slows allocation heavy code down several times
+                controller.track_cache.invalidate(track_id)
+                tracemalloc.start()
+                await timed_get(client, url)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                # the ASGI test transport buffers the body, so peak memory always includes the response once
+                results[str(size)][fmt.value + ("_stream" if stream else "")] = {
+                    "bytes": size_bytes, "cold": latency_stats(cold), "warm": latency_stats(warm),
+                    "peak_mb": peak / 1e6}
+                print(f"{size:>8} {fmt.value + (' stream' if stream else ''):>15} "
+                      f"{np.median(cold) * 1000:>9.1f} {np.median(warm) * 1000:>9.1f} {peak / 1e6:>8.1f} "
+                      f"{size_bytes / 1e6:>8.2f}")
+    return results
+
+
+async def run(args) -> dict:
+    import httpx
+
+    from backtrack.main import create_app
+
+    app = create_app()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            ingest: dict = await bench_ingest(client, app.state.controller, args)
+            latency: dict = ingest["latency"]
+            print(f"ingest {ingest['points']} points from {ingest['devices']} devices: "
+                  f"{ingest['points_per_s']:.0f} points/s, p50 {latency['p50_ms']:.2f} ms, "
+                  f"p99 {latency['p99_ms']:.2f} ms")
+            print(f"{'points':>8} {'format':>15} {'cold ms':>9} {'warm ms':>9} {'peak MB':>8} {'MB':>8}")
+            export: dict = await bench_export(client, app.state.controller, args)
+    return {"ingest": ingest, "export": export}
+
+
+def flatten(results: dict, prefix: str = "") -> dict[str, float]:
+    flat: dict[str, float] = {}
+    for name, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + name] = value
+    return flat
+
+
+def compare(previous: dict, current: dict) -> None:
+    before: dict[str, float] = flatten({"ingest": previous["ingest"], "export": previous["export"]})
+    after: dict[str, float] = flatten({"ingest": current["ingest"], "export": current["export"]})
+    print(f"\ncompared with {previous['meta']['commit']}")
+    for name in sorted(before.keys() & after.keys()):
+        if before[name]:
+            change: float = (after[name] - before[name]) / before[name] * 100
+            print(f"{name:<50} {before[name]:>12.2f} {after[name]:>12.2f} {change:>+8.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=20)
+    parser.add_argument("--points", type=int, default=250, help="points per device")
+    parser.add_argument("--interval", type=float, default=5, help="seconds between fixes")
+    parser.add_argument("--jitter", type=float, default=2, help="seconds a fix is off its interval")
+    parser.add_argument("--out-of-order", type=float, default=0.02, help="share of fixes delivered late")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--batched", action="store_true", help="ingest through the write-behind queue")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", type=Path, default=None, help="defaults to benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", type=Path, default=None, help="an earlier results file")
+    args = parser.parse_args()
+
+    commit: str = git_commit()
+    out: Path = (args.out or RESULTS / f"{commit}.json").resolve()
+    previous: Optional[dict] = None if args.compare is None else json.loads(args.compare.read_text())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        prepare(Path(tmp), args.batched)
+        results: dict = asyncio.run(run(args))
+
+    results["meta"] = {"commit": commit, "time": datetime.now(tz=timezone.utc).isoformat(),
+                       "python": platform.python_version(), "platform": platform.platform(),
+                       "args": {name: str(value) if isinstance(value, Path) else value
+                                for name, value in vars(args).items()}}
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, indent=2))
+    print(f"results written to {out}")
+    if previous is not None:
+        compare(previous, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Compare Sadel.batch_upsert with the previous one statement per row loop on SQLite.
+
+    PYTHONPATH=src python benchmarks/sadel_batch_upsert.py --rows 10000
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+from typing import ClassVar
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlmodel import Field, SQLModel, select, func
+
+from xcb_sadel import Sadel
+
+
+class BenchRow(Sadel, table=True):
+    _upsert_index_elements: ClassVar[set[str]] = {"id"}
+
+    id: int = Field(primary_key=True)
+    name: str
+    value: float
+
+
+async def per_row_upsert(items: list[BenchRow], session: AsyncSession):
+    # batch_upsert before it built multi-row statements
+    for item in items:
+        await session.execute(BenchRow._get_upsert_statement(item, "sqlite"))
+    await session.commit()
+
+
+async def run(rows: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{Path(tmp) / 'bench.db'}")
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+
+        print(f"{'rows':>8} {'pass':>7} {'per row s':>10} {'batch s':>10} {'speedup':>8}")
+        for run_pass, value in (("insert", 1.0), ("update", 2.0)):
+            items = [BenchRow(id=i, name=f"row {i}", value=value) for i in range(rows)]
+            timings: list[float] = []
+            for upsert in (per_row_upsert, BenchRow.batch_upsert):
+                async with engine.begin() as conn:
+                    await conn.run_sync(SQLModel.metadata.drop_all)
+                    await conn.run_sync(SQLModel.metadata.create_all)
+                if run_pass == "update":
+                    async with AsyncSession(engine) as session:
+                        await BenchRow.batch_upsert(
+                            [BenchRow(id=i, name="old", value=0.0) for i in range(rows)], session)
+                async with AsyncSession(engine) as session:
+                    start = time.perf_counter()
+                    await upsert(items, session)
+                    timings.append(time.perf_counter() - start)
+                    total = (await session.execute(select(func.sum(BenchRow.value)))).scalar()
+                    assert total == value * rows, f"{upsert.__name__} stored {total}"
+            print(f"{rows:>8} {run_pass:>7} {timings[0]:>10.3f} {timings[1]:>10.3f} "
+                  f"{timings[0] / timings[1]:>7.1f}x")
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows))
+
+
+if __name__ == "__main__":
+    main()
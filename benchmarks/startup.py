@@ -0,0 +1,98 @@
+"""
+Cold start budget: import time of backtrack.main, create_app and the lifespan startup, each in a fresh interpreter
+under -X importtime. Exits non-zero when a budget is exceeded or a lazily imported library was loaded at startup.
+
+Runs on a fresh SQLite database in a temporary directory, otherwise with src/resources/config.yaml:
+    python benchmarks/startup.py
+    python benchmarks/startup.py --repeat 10 --import-budget-ms 500 --ready-budget-ms 1500
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from load import SRC, prepare
+
+# only imported by the requests that need them, see create_app
+LAZY: tuple[str, ...] = ("gpxpy", "lxml", "geojson", "ijson", "jinja2")
+
+STARTUP: str = """
+import asyncio, json, sys, time
+
+start = time.perf_counter()
+from backtrack.main import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+
+
+async def ready():
+    async with app.router.lifespan_context(app):
+        return time.perf_counter()
+
+print(json.dumps({"import_s": imported - start, "create_app_s": created - imported,
+                  "ready_s": asyncio.run(ready()) - start, "modules": sorted(sys.modules)}))
+"""
+
+IMPORT_TIME: re.Pattern = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+def run_once() -> tuple[dict, dict[str, int]]:
+    env: dict[str, str] = dict(os.environ, PYTHONPATH=str(SRC))
+    done = subprocess.run([sys.executable, "-X", "importtime", "-c", STARTUP], env=env, capture_output=True,
+                          text=True, check=True)
+    # the cumulative microseconds of the packages imported at the top level
+    packages: dict[str, int] = {}
+    for match in IMPORT_TIME.finditer(done.stderr):
+        if not match.group(3):
+            packages[match.group(4)] = int(match.group(2))
+    return json.loads(done.stdout.splitlines()[-1]), packages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--import-budget-ms", type=float, default=750, help="median time to import backtrack.main")
+    parser.add_argument("--ready-budget-ms", type=float, default=2000,
+                        help="median time until the lifespan startup finished")
+    parser.add_argument("--top", type=int, default=10, help="slowest top level imports to list")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        prepare(Path(tmp), batched=False)
+        runs: list[tuple[dict, dict[str, int]]] = []
+        for _ in range(args.repeat):
+            # every run starts from an empty database, like a fresh container
+            for db in Path(tmp).glob("bench.db*"):
+                db.unlink()
+            runs.append(run_once())
+
+    timings: dict[str, float] = {name: float(np.median([t[name] for t, _ in runs])) * 1000
+                                 for name in ("import_s", "create_app_s", "ready_s")}
+    print(f"import {timings['import_s']:.1f} ms, create_app {timings['create_app_s']:.1f} ms, "
+          f"ready {timings['ready_s']:.1f} ms (median of {args.repeat})")
+    packages: dict[str, float] = {name: float(np.median([p.get(name, 0) for _, p in runs])) / 1000
+                                  for name in runs[0][1]}
+    for name, ms in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{name:<40} {ms:>9.1f} ms")
+
+    failures: list[str] = []
+    if timings["import_s"] > args.import_budget_ms:
+        failures.append(f"import took {timings['import_s']:.1f} ms, the budget is {args.import_budget_ms} ms")
+    if timings["ready_s"] > args.ready_budget_ms:
+        failures.append(f"startup took {timings['ready_s']:.1f} ms, the budget is {args.ready_budget_ms} ms")
+    loaded: set[str] = {module.split(".")[0] for module in runs[0][0]["modules"]}
+    failures.extend(f"{name} is imported at startup" for name in LAZY if name in loaded)
+    for failure in failures:
+        print(failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+#!/usr/bin/env sh
+# With writer.enabled in the config, start the single writer process and WORKERS read only HTTP workers
+# that forward their writes to it. Otherwise one process reads and writes, as before.
+set -e
+
+writer_enabled=$(python -c "from backtrack.config import load_config; print(load_config().writer.enabled)")
+if [ "$writer_enabled" = "True" ]; then
+    python -m backtrack.writer &
+    writer_pid=$!
+    # both in the background so the trap runs on docker stop, the workers stop first so the writer flushes
+    # every point they had acknowledged
+    fastapi run backtrack/main.py --workers "${WORKERS:-4}" &
+    fastapi_pid=$!
+    stop() {
+        trap - INT TERM
+        kill -TERM "$fastapi_pid" 2>/dev/null || true
+        wait "$fastapi_pid" || true
+        kill -TERM "$writer_pid" 2>/dev/null || true
+        wait "$writer_pid" || true
+    }
+    trap 'stop; exit 143' INT TERM
+    # fastapi exiting on its own stops the writer too
+    set +e
+    wait "$fastapi_pid"
+    status=$?
+    stop
+    exit "$status"
+else
+    exec fastapi run backtrack/main.py
+fi
@@ -0,0 +1,5 @@
+#!/usr/bin/env bash
+
+# the app's requirements and pytest on top, for python -m pytest, the Docker image only runs install.sh
+sh "$(dirname "$0")/install.sh"
+pip install pytest
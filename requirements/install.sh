@@ -1,3 +1,3 @@
 #!/usr/bin/env bash
 
-pip install sqids "fastapi[standard]" jinja2 geojson aiosqlite sadel sqlmodel fastapi "uvicorn[standard]" gpxpy lxml
+pip install sqids "fastapi[standard]" jinja2 geojson aiosqlite sadel sqlmodel fastapi "uvicorn[standard]" gpxpy lxml numpy ijson asyncpg prometheus_client brotli
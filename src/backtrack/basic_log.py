@@ -1,14 +1,25 @@
 import logging
 from datetime import datetime, timezone
 
-from config import app_conf
+# the process's level, set from general.log_level by whatever builds the app
+log_level: int = logging.INFO
 
-log_level: int = logging.getLevelName(app_conf.general.log_level.upper())
 
+def set_log_level(level_name: str) -> None:
+    global log_level
+    log_level = logging.getLevelName(level_name.upper())
 
-def log(msg: str, level: int = logging.INFO, source: str = None):
+
+def enabled(level: int) -> bool:
+    # check before building an expensive message
+    return log_level <= level
+
+
+def log(msg: str, level: int = logging.INFO, source: str = None, **fields):
     if log_level <= level:
         before: str = f"{datetime.now(tz=timezone.utc).isoformat()} {logging.getLevelName(level)}"
         if source is not None:
             before = f"{before} {source}"
-        print(f"{before}: {msg}")
+        # structured fields trail the message as key=value pairs
+        after: str = "".join(f" {name}={value!r}" for name, value in fields.items())
+        print(f"{before}: {msg}{after}")
@@ -2,4 +2,8 @@ from pathlib import Path
 
 from backtrack.config.config import AppConfig, init_config
 
-app_conf: AppConfig = init_config(Path("./resources/config.yaml"))
\ No newline at end of file
+CONFIG_PATH: Path = Path("./resources/config.yaml")
+
+
+def load_config(conf_fi: Path = CONFIG_PATH) -> AppConfig:
+    return init_config(conf_fi)
@@ -5,9 +5,19 @@ class TrackFormat(Enum):
     geojson = 'geojson'
     json = 'json'
     gpx = 'gpx'
+    polyline = 'polyline'
+    binary = 'binary'
 
     def content_type(self) -> str:
         if self == TrackFormat.geojson or self == TrackFormat.json:
             return 'application/json'
         elif self == TrackFormat.gpx:
             return 'application/xml'
+        elif self == TrackFormat.polyline:
+            return 'text/plain; charset=us-ascii'
+        elif self == TrackFormat.binary:
+            return 'application/octet-stream'
+
+    def compact(self) -> bool:
+        # written from point arrays in one piece, never streamed
+        return self == TrackFormat.polyline or self == TrackFormat.binary
@@ -1,4 +1,14 @@
-from backtrack.controllers.controller import BacktrackController
-from backtrack.storage import engine, async_engine
+from typing import TYPE_CHECKING
 
-controller: BacktrackController = BacktrackController(engine, async_engine)
\ No newline at end of file
+if TYPE_CHECKING:
+    from backtrack.config.config import AppConfig
+    from backtrack.controllers.controller import BacktrackController
+
+
+def create_controller(app_conf: "AppConfig") -> "BacktrackController":
+    """The engine and the controller around it, importing this package doesn't build either."""
+    from backtrack.controllers.controller import BacktrackController
+    from backtrack.storage import create_engine
+
+    return BacktrackController(create_engine(app_conf.database, app_conf.writer), app_conf.ingest, app_conf.lod,
+                               app_conf.cache, app_conf.archive, app_conf.writer, app_conf.maintenance)
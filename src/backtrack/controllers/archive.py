@@ -0,0 +1,100 @@
+import heapq
+from datetime import datetime, timezone, timedelta
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar, Iterable
+
+from sqlalchemy import delete, func, update
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlmodel import select
+
+from backtrack.storage.archive import PointArrays, pack, unpack
+from backtrack.storage.filters import db_ts
+from backtrack.storage.models import LogPoint, LogPointArchive, LogTrackSummary
+
+T = TypeVar("T")
+
+
+class Archiver:
+    """Moves the points of tracks idle for idle_hours into packed LogPointArchive chunks, run as a maintenance job."""
+
+    def __init__(self, async_engine: AsyncEngine, idle_hours: float, chunk_size: int,
+                 archived: Callable[[str], None]):
+        self.async_engine = async_engine
+        self.idle = timedelta(hours=idle_hours)
+        self.chunk_size = chunk_size
+        self.archived = archived
+
+    async def archive_idle(self, now: Optional[datetime] = None,
+                           pause: Optional[Callable[[], Awaitable[None]]] = None) -> list[str]:
+        cutoff: datetime = db_ts((now or datetime.now(tz=timezone.utc)) - self.idle)
+        async with AsyncSession(self.async_engine) as session:
+            track_ids: list[str] = list((await session.execute(
+                select(LogPoint.track_id).group_by(LogPoint.track_id).having(func.max(LogPoint.ts) < cutoff)
+            )).scalars())
+        for track_id in track_ids:
+            await self.archive_track(track_id)
+            if pause is not None:
+                await pause()
+        return track_ids
+
+    async def archive_track(self, track_id: str) -> int:
+        async with AsyncSession(self.async_engine) as session:
+            points: list[LogPoint] = list((await session.execute(
+                select(LogPoint).where(LogPoint.track_id == track_id).order_by(LogPoint.ts))).scalars())
+            if not points:
+                return 0
+            chunks: list[LogPointArchive] = list((await session.execute(
+                select(LogPointArchive).where(LogPointArchive.track_id == track_id)
+                .order_by(LogPointArchive.chunk))).scalars())
+
+            live: PointArrays = PointArrays.from_points(points)
+            if not chunks or db_ts(chunks[-1].end_ts) < db_ts(points[0].ts):
+                new_chunks: list[LogPointArchive] = pack(track_id, live, self.chunk_size,
+                                                         chunks[-1].chunk + 1 if chunks else 0)
+            else:
+                # points arrived inside the archived range, repack the whole track
+                merged: PointArrays = PointArrays.concat([unpack(c) for c in chunks] + [live]).ordered()
+                new_chunks = pack(track_id, merged.deduplicated(), self.chunk_size)
+                await session.execute(delete(LogPointArchive).where(LogPointArchive.track_id == track_id))
+
+            await session.execute(delete(LogPoint).where(LogPoint.track_id == track_id)
+                                  .where(LogPoint.ts <= points[-1].ts))
+            session.add_all(new_chunks)
+            # archived timestamps are rounded to milliseconds, the track reads back differently
+            await session.execute(update(LogTrackSummary).where(LogTrackSummary.track_id == track_id).values(
+                version=LogTrackSummary.version + 1, changed_at=datetime.now(tz=timezone.utc).replace(tzinfo=None)))
+            await session.commit()
+        self.archived(track_id)
+        return len(points)
+
+
+def newest_first(point: LogPoint) -> timedelta:
+    return datetime.max - db_ts(point.ts)
+
+
+def row_newest_first(row: tuple) -> timedelta:
+    # a (ts, ...) row of naive UTC ts
+    return datetime.max - row[0]
+
+
+async def flatten(partitions: AsyncIterator[list[T]], first: Iterable[T] = ()) -> AsyncIterator[T]:
+    for item in first:
+        yield item
+    async for partition in partitions:
+        for item in partition:
+            yield item
+
+
+async def merge_newest_first(*streams: AsyncIterator[T],
+                             key: Callable[[T], timedelta] = newest_first) -> AsyncIterator[T]:
+    heads: list[tuple[timedelta, int, T]] = []
+    for i, stream in enumerate(streams):
+        point: Optional[T] = await anext(stream, None)
+        if point is not None:
+            heads.append((key(point), i, point))
+    heapq.heapify(heads)
+    while heads:
+        _, i, point = heapq.heappop(heads)
+        yield point
+        point = await anext(streams[i], None)
+        if point is not None:
+            heapq.heappush(heads, (key(point), i, point))
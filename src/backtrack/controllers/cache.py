@@ -0,0 +1,154 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional, Hashable
+
+from backtrack.storage.mvt import tile_ranges, BUFFER, EXTENT
+
+
+@dataclass(frozen=True)
+class TrackVersion:
+    # the newest point's ts, passed back as ?since=
+    latest: datetime
+    # LogTrackSummary.version and changed_at, every write to the track changes them
+    version: int
+    changed: datetime
+
+
+# (key, track_id, format, track version, query variant), the format is e.g. json+gzip for a content-encoded payload
+CacheKey = tuple[str, str, str, Hashable, str]
+
+
+class TrackCache:
+    """LRU of rendered track payloads, bounded by total payload bytes."""
+
+    def __init__(self, max_bytes: int, max_entry_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.entries: OrderedDict[CacheKey, bytes] = OrderedDict()
+        self.by_track: dict[str, set[CacheKey]] = {}
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, cache_key: CacheKey) -> Optional[bytes]:
+        payload: Optional[bytes] = self.entries.get(cache_key)
+        if payload is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(cache_key)
+        return payload
+
+    def put(self, cache_key: CacheKey, payload: bytes) -> None:
+        if len(payload) > min(self.max_entry_bytes, self.max_bytes) or cache_key in self.entries:
+            return
+        self.entries[cache_key] = payload
+        self.by_track.setdefault(cache_key[1], set()).add(cache_key)
+        self.size += len(payload)
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+
+    def invalidate(self, track_id: str) -> None:
+        for cache_key in list(self.by_track.get(track_id, ())):
+            self._remove(cache_key)
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.by_track.clear()
+        self.size = 0
+
+    def _remove(self, cache_key: CacheKey) -> None:
+        self.size -= len(self.entries.pop(cache_key))
+        track_keys: set[CacheKey] = self.by_track[cache_key[1]]
+        track_keys.discard(cache_key)
+        if not track_keys:
+            del self.by_track[cache_key[1]]
+
+
+# (key, z, x, y)
+TileKey = tuple[str, int, int, int]
+
+
+class TileCache:
+    """LRU of encoded vector tiles, dropped when a track they show or a point inside them changes."""
+
+    def __init__(self, max_tiles: int, max_range: int = 256):
+        self.max_tiles = max_tiles
+        self.max_range = max_range
+        self.tiles: OrderedDict[TileKey, bytes] = OrderedDict()
+        self.tile_tracks: dict[TileKey, set[str]] = {}
+        self.track_tiles: dict[str, set[TileKey]] = {}
+        self.keys_at: dict[tuple[int, int, int], set[str]] = {}
+        self.zoom_counts: dict[int, int] = {}
+        self.last_position: dict[str, tuple[float, float]] = {}
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, tile_key: TileKey) -> Optional[bytes]:
+        tile: Optional[bytes] = self.tiles.get(tile_key)
+        if tile is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.tiles.move_to_end(tile_key)
+        return tile
+
+    def put(self, tile_key: TileKey, tile: bytes, track_ids: set[str]) -> None:
+        if self.max_tiles <= 0:
+            return
+        if tile_key in self.tiles:
+            self._remove(tile_key)
+        self.tiles[tile_key] = tile
+        self.tile_tracks[tile_key] = track_ids
+        for track_id in track_ids:
+            self.track_tiles.setdefault(track_id, set()).add(tile_key)
+        self.keys_at.setdefault(tile_key[1:], set()).add(tile_key[0])
+        self.zoom_counts[tile_key[1]] = self.zoom_counts.get(tile_key[1], 0) + 1
+        while len(self.tiles) > self.max_tiles:
+            self._remove(next(iter(self.tiles)))
+
+    def clear(self) -> None:
+        for state in (self.tiles, self.tile_tracks, self.track_tiles, self.keys_at, self.zoom_counts,
+                      self.last_position):
+            state.clear()
+
+    def point_added(self, track_id: str, lon: float, lat: float) -> None:
+        # the new segment can reach tiles the track never touched before
+        prev_lon, prev_lat = self.last_position.get(track_id, (lon, lat))
+        self.last_position[track_id] = (lon, lat)
+        self.track_changed(track_id, (min(lon, prev_lon), min(lat, prev_lat), max(lon, prev_lon), max(lat, prev_lat)))
+
+    def track_changed(self, track_id: str, bounds: tuple[float, float, float, float]) -> None:
+        """Drop the tiles showing the track and every tile overlapping the lon/lat bounds of its changed points."""
+        if not self.tiles:
+            return
+        for tile_key in list(self.track_tiles.get(track_id, ())):
+            self._remove(tile_key)
+        for z in list(self.zoom_counts):
+            xs, ys = tile_ranges(bounds, z, BUFFER / EXTENT)
+            if len(xs) * len(ys) > self.max_range:
+                cells = [tile_key[1:] for tile_key in self.tiles if tile_key[1] == z and
+                         tile_key[2] in xs and tile_key[3] in ys]
+            else:
+                cells = [(z, tx, ty) for tx in xs for ty in ys]
+            for cell in cells:
+                for key in list(self.keys_at.get(cell, ())):
+                    self._remove((key, *cell))
+
+    def _remove(self, tile_key: TileKey) -> None:
+        if tile_key not in self.tiles:
+            return
+        del self.tiles[tile_key]
+        for track_id in self.tile_tracks.pop(tile_key):
+            tiles: set[TileKey] = self.track_tiles[track_id]
+            tiles.discard(tile_key)
+            if not tiles:
+                del self.track_tiles[track_id]
+        keys: set[str] = self.keys_at[tile_key[1:]]
+        keys.discard(tile_key[0])
+        if not keys:
+            del self.keys_at[tile_key[1:]]
+        self.zoom_counts[tile_key[1]] -= 1
+        if not self.zoom_counts[tile_key[1]]:
+            del self.zoom_counts[tile_key[1]]
@@ -1,66 +1,715 @@
-from datetime import datetime, timezone
+import asyncio
+import heapq
+from datetime import datetime, timezone, timedelta
+from itertools import islice
 from random import Random
-from typing import Optional
+from typing import Optional, AsyncIterator, Iterator, Callable, Iterable
 
+import numpy as np
 from sqids import Sqids
-from sqlalchemy import Engine
-from sqlalchemy.dialects.sqlite import insert
-from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
-from sqlmodel import select, Session
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, AsyncResult
+from sqlmodel import select
 
-from backtrack.storage.models import LogTrackDetails, LogPoint, LogTrack
+from backtrack.config.config import (IngestConfig, LodConfig, CacheConfig, ArchiveConfig, WriterConfig,
+                                     MaintenanceConfig)
+from backtrack.controllers.archive import Archiver, merge_newest_first, newest_first, row_newest_first, flatten
+from backtrack.controllers.cache import TrackCache, TileCache, TileKey, TrackVersion
+from backtrack.controllers.ingest import IngestQueue, LogPair, RecentPoints
+from backtrack.controllers.keys import KeyRegistry
+from backtrack.controllers.live import LiveHub
+from backtrack.controllers.lod import LodCache, TrackLod
+from backtrack.controllers.maintenance import Maintenance, Bounds
+from backtrack.controllers.writer import WriterClient, encode_logs
+from backtrack.metrics import POINTS_STORED, POINTS_DUPLICATE
+from backtrack.storage.archive import PointArrays, unpack, to_ms
+from backtrack.storage.dialects import insert_for
+from backtrack.storage.filters import PointFilter, db_ts
+from backtrack.storage.geojson_writer import geojson_feature
+from backtrack.storage.importers import PointRow
+from backtrack.storage.models import LogTrackDetails, LogPoint, LogTrack, LogPointArchive, LogTrackSummary
+from backtrack.storage.mvt import tile_bounds, tile_lines, encode_tile, BUFFER, EXTENT
+from backtrack.storage.simplify import tolerance_for_zoom, simplify_mask
+from backtrack.storage.summary import summarize, appends, extend, insert_late
+
+# rows read per round trip when a whole track is read, other requests run in between
+READ_PARTITION: int = 100
 
 
 class BacktrackController:
-    def __init__(self, engine: Engine, async_engine: AsyncEngine):
+    def __init__(self, async_engine: AsyncEngine, ingest_conf: IngestConfig = IngestConfig(),
+                 lod_conf: LodConfig = LodConfig(), cache_conf: CacheConfig = CacheConfig(),
+                 archive_conf: ArchiveConfig = ArchiveConfig(), writer_conf: WriterConfig = WriterConfig(),
+                 maintenance_conf: MaintenanceConfig = MaintenanceConfig()):
         self.async_engine = async_engine
-        self.engine = engine
+        self.dialect: str = async_engine.dialect.name
+        self.insert = insert_for(self.dialect)
         self.sqids = Sqids(min_length=5)
         self.rand = Random()
+        self.key_registry: KeyRegistry = KeyRegistry(async_engine)
+        self.import_chunk_size: int = ingest_conf.import_chunk_size
+        self.ingest_queue: Optional[IngestQueue] = None
+        if ingest_conf.batched:
+            self.ingest_queue = IngestQueue(self.store_logs, ingest_conf.batch_size, ingest_conf.batch_latency_ms,
+                                            ingest_conf.queue_size)
+        self.recent: RecentPoints = RecentPoints(ingest_conf.recent_points, ingest_conf.recent_tracks)
+        # read from the summaries, dropped by the write hooks below and counted by writes so that a version read
+        # while a write commits isn't kept
+        self.track_versions: dict[str, TrackVersion] = {}
+        self.writes: int = 0
+        self.lod: Optional[LodCache] = LodCache(lod_conf.zooms, lod_conf.max_tracks) if lod_conf.enabled else None
+        self.track_cache: TrackCache = TrackCache(cache_conf.max_bytes if cache_conf.enabled else 0,
+                                                  cache_conf.max_entry_bytes)
+        self.tile_cache: TileCache = TileCache(cache_conf.max_tiles if cache_conf.enabled else 0)
+        self.live_hub: LiveHub = LiveHub()
+        self.archiver: Archiver = Archiver(async_engine, archive_conf.idle_hours, archive_conf.chunk_size,
+                                           self.points_archived)
+        self.maintenance: Maintenance = Maintenance(self, maintenance_conf, archive_conf)
+        # with a writer process, this process only reads and applies the writer's events to its caches
+        self.writer: Optional[WriterClient] = None
+        if writer_conf.enabled:
+            self.writer = WriterClient(writer_conf.socket_path, self.writer_event, writer_conf.connect_timeout_s)
+        # the writer process's subscriptions to the writes below
+        self.write_observers: list[Callable[[dict], None]] = []
+
+    async def start(self) -> None:
+        if self.writer is not None:
+            await self.writer.connect()
+            return
+        await self.key_registry.load()
+        if self.ingest_queue is not None:
+            await self.ingest_queue.start()
+        await self.maintenance.start()
+
+    async def stop(self) -> None:
+        if self.writer is not None:
+            await self.writer.close()
+            return
+        await self.maintenance.stop()
+        if self.ingest_queue is not None:
+            await self.ingest_queue.stop()
+
+    def resent(self, point: LogPoint) -> bool:
+        # a client retrying or catching up, stored recently by this process or seen in the writer's events
+        if self.recent.seen(point.track_id, db_ts(point.ts)):
+            POINTS_DUPLICATE.labels("recent").inc()
+            return True
+        return False
 
     async def store_log(self, track: LogTrackDetails, point: LogPoint) -> None:
-        async with (AsyncSession(self.async_engine) as session):
-            statement = insert(track.__class__).values(**track.model_dump(exclude_unset=True)).on_conflict_do_nothing()
-            await session.execute(statement)
-            # session.add(track)
-            session.add(point)
+        if self.resent(point):
+            return
+        if self.writer is not None:
+            await self.writer.call("log", log=encode_logs([(track, point)])[0])
+            return
+        if self.ingest_queue is not None:
+            await self.key_registry.register(track.key)
+            await self.ingest_queue.put((track, point))
+            return
+        await self.store_logs([(track, point)])
+
+    async def store_logs(self, logs: list[LogPair]) -> int:
+        """Store a batch in one transaction, returns how many of its points were new."""
+        logs = [(track, point) for track, point in logs if not self.resent(point)]
+        if not logs:
+            return 0
+        if self.writer is not None:
+            return await self.writer.call("logs", logs=encode_logs(logs))
+        tracks: dict[tuple[str, str], dict] = {}
+        # the first of a point's copies within the batch, like the insert keeps
+        points: dict[tuple[str, datetime], LogPoint] = {}
+        for track, point in logs:
+            tracks.setdefault((track.key, track.track_id), track.model_dump())
+            points.setdefault((point.track_id, db_ts(point.ts)), point)
+        for key in set(key for key, _ in tracks):
+            await self.key_registry.register(key)
+
+        # one transaction for the whole batch, points already stored are skipped instead of failing the group commit
+        try:
+            async with AsyncSession(self.async_engine) as session:
+                await session.execute(self.insert(LogTrackDetails).on_conflict_do_nothing(), list(tracks.values()))
+                archived: set[tuple[str, datetime]] = await self.archived_points(session, points)
+                inserted: set[tuple[str, datetime]] = set()
+                if len(archived) < len(points):
+                    inserted = {(track_id, db_ts(ts)) for track_id, ts in await session.execute(
+                        self.insert(LogPoint).on_conflict_do_nothing().returning(LogPoint.track_id, LogPoint.ts),
+                        [point.model_dump() for key, point in points.items() if key not in archived])}
+                stored: list[LogPoint] = [point for key, point in points.items() if key in inserted]
+                await self.update_summaries(session, stored)
+                await session.commit()
+        except Exception:
+            # update_summaries already remembered the points, a retry of them has to get through
+            for track_id in set(track_id for track_id, _ in points):
+                self.recent.forget(track_id)
+            raise
+        if len(stored) < len(logs):
+            POINTS_DUPLICATE.labels("database").inc(len(logs) - len(stored))
+        if stored:
+            POINTS_STORED.labels("log").inc(len(stored))
+            self.points_stored(stored)
+        return len(stored)
+
+    async def import_points(self, key: str, track_id: str, rows: Iterator[PointRow]) -> tuple[int, int]:
+        """
+        Insert parsed point rows in transactions of import_chunk_size, skipping points that are already stored.
+        Returns the number of rows parsed and stored.
+        """
+        await self.import_track(key, track_id)
+        parsed: int = 0
+        stored: int = 0
+        bounds: Optional[np.ndarray] = None
+        # parsing is CPU bound, the next chunk is parsed in a thread while the current one is inserted
+        next_chunk = asyncio.create_task(asyncio.to_thread(lambda: list(islice(rows, self.import_chunk_size))))
+        try:
+            while True:
+                chunk: list[PointRow] = await next_chunk
+                if not chunk:
+                    break
+                next_chunk = asyncio.create_task(
+                    asyncio.to_thread(lambda: list(islice(rows, self.import_chunk_size))))
+                parsed += len(chunk)
+                stored += await self.import_chunk(chunk)
+                lonlat: np.ndarray = np.array([(row["lon"], row["lat"]) for row in chunk], dtype=np.float64)
+                chunk_bounds: np.ndarray = np.concatenate([lonlat.min(axis=0), lonlat.max(axis=0)])
+                bounds = chunk_bounds if bounds is None else np.concatenate(
+                    [np.minimum(bounds[:2], chunk_bounds[:2]), np.maximum(bounds[2:], chunk_bounds[2:])])
+        finally:
+            # a failed insert leaves the next chunk's task behind, its result or error is of no use now
+            next_chunk.cancel()
+            await asyncio.gather(next_chunk, return_exceptions=True)
+        if stored:
+            await self.imported(track_id, tuple(bounds.tolist()), stored)
+        return parsed, stored
+
+    async def import_track(self, key: str, track_id: str) -> None:
+        if self.writer is not None:
+            return await self.writer.call("import_track", key=key, track_id=track_id)
+        await self.key_registry.register(key)
+        async with AsyncSession(self.async_engine) as session:
+            await session.execute(
+                self.insert(LogTrackDetails).values(track_id=track_id, key=key).on_conflict_do_nothing())
             await session.commit()
 
-    def get_track(self, key: str, track_id: str) -> Optional[LogTrack]:
-        with Session(self.engine) as session:
-            stmt = select(LogTrackDetails).where(LogTrackDetails.key == key).where(LogTrackDetails.track_id == track_id)
-            track = list(session.exec(stmt))
-            if track is None or len(track) == 0:
+    async def import_chunk(self, chunk: list[PointRow]) -> int:
+        if self.writer is not None:
+            return await self.writer.call("import_chunk", rows=chunk)
+        async with AsyncSession(self.async_engine) as session:
+            archived: set[tuple[str, datetime]] = await self.archived_points(
+                session, [(row["track_id"], db_ts(row["ts"])) for row in chunk])
+            if archived:
+                chunk = [row for row in chunk if (row["track_id"], db_ts(row["ts"])) not in archived]
+            if not chunk:
+                return 0
+            # rowcount of an executemany isn't reported by every driver, the returned keys are
+            inserted: int = len((await session.execute(
+                self.insert(LogPoint).on_conflict_do_nothing().returning(LogPoint.ts), chunk)).all())
+            await session.commit()
+        return inserted
+
+    async def archived_points(self, session: AsyncSession,
+                              points: Iterable[tuple[str, datetime]]) -> set[tuple[str, datetime]]:
+        """
+        Of (track_id, naive UTC ts) pairs, the ones already packed into archive chunks, which the live table's
+        primary key doesn't cover. Archived timestamps are kept to the millisecond and compared at that.
+        """
+        by_track: dict[str, dict[datetime, datetime]] = {}
+        for track_id, ts in points:
+            by_track.setdefault(track_id, {})[ts] = to_ms(ts)
+        if not by_track:
+            return set()
+        stamps: list[datetime] = [ms for track_stamps in by_track.values() for ms in track_stamps.values()]
+        # the chunk ranges are read first, a live track's batch rarely falls inside one and no blob is loaded
+        ranges = (await session.execute(
+            select(LogPointArchive.track_id, LogPointArchive.chunk, LogPointArchive.start_ts, LogPointArchive.end_ts)
+            .where(LogPointArchive.track_id.in_(list(by_track)),
+                   LogPointArchive.start_ts <= max(stamps) + timedelta(milliseconds=1),
+                   LogPointArchive.end_ts >= min(stamps)))).all()
+        found: set[tuple[str, datetime]] = set()
+        for track_id, chunk_no, start_ts, end_ts in ranges:
+            start_ms, end_ms = to_ms(db_ts(start_ts)), to_ms(db_ts(end_ts))
+            inside: dict[datetime, datetime] = {ts: ms for ts, ms in by_track[track_id].items()
+                                                if start_ms <= ms <= end_ms}
+            if not inside:
+                continue
+            chunk: LogPointArchive = await session.get(LogPointArchive, (track_id, chunk_no))
+            chunk_ts: set[datetime] = set(unpack(chunk, extras=False).ts.tolist())
+            found.update((track_id, ts) for ts, ms in inside.items() if ms in chunk_ts)
+        return found
+
+    async def imported(self, track_id: str, bounds: tuple[float, float, float, float], count: int) -> None:
+        if self.writer is not None:
+            return await self.writer.call("imported", track_id=track_id, bounds=bounds, count=count)
+        async with AsyncSession(self.async_engine) as session:
+            await self.rebuild_summary(session, track_id)
+            await session.commit()
+        POINTS_STORED.labels("import").inc(count)
+        self.points_imported(track_id, bounds)
+
+    async def update_summaries(self, session: AsyncSession, points: list[LogPoint]) -> None:
+        """Fold newly stored points into their tracks' LogTrackSummary, in the transaction that stores them."""
+        by_track: dict[str, list[LogPoint]] = {}
+        for point in points:
+            by_track.setdefault(point.track_id, []).append(point)
+        for track_id, track_points in by_track.items():
+            # the row lock keeps concurrent writers of a track from losing each other's points on postgres
+            await session.execute(self.insert(LogTrackSummary).values(track_id=track_id).on_conflict_do_nothing())
+            summary: LogTrackSummary = (await session.execute(
+                select(LogTrackSummary).where(LogTrackSummary.track_id == track_id).with_for_update())).scalars().one()
+            if summary.last_ts is not None and not appends(summary, track_points):
+                # late points go between the neighbours held in self.recent, in order so each sees the ones before
+                last_ts: datetime = db_ts(summary.last_ts)
+                late: list[LogPoint] = sorted((p for p in track_points if db_ts(p.ts) < last_ts),
+                                              key=lambda p: db_ts(p.ts))
+                for point in late:
+                    neighbours = self.recent.neighbours(track_id, db_ts(point.ts))
+                    if neighbours is None:
+                        break
+                    insert_late(summary, point, *neighbours)
+                    self.recent.add(track_id, db_ts(point.ts), point.lat, point.lon)
+                else:
+                    track_points = [p for p in track_points if db_ts(p.ts) > last_ts]
+            if summary.last_ts is not None and appends(summary, track_points):
+                extend(summary, track_points)
+                summary.changed()
+            else:
+                # a new summary of a track stored before summaries existed, or a point older than what's held
+                summary = await self.rebuild_summary(session, track_id)
+            if summary.last_ts is not None:
+                for point in track_points:
+                    self.recent.add(track_id, db_ts(point.ts), point.lat, point.lon)
+                self.recent.seed(track_id, db_ts(summary.last_ts), summary.last_lat, summary.last_lon)
+
+    async def rebuild_summary(self, session: AsyncSession, track_id: str) -> LogTrackSummary:
+        summary: LogTrackSummary = summarize(track_id, await self.read_track_arrays(session, track_id))
+        previous: Optional[LogTrackSummary] = await session.get(LogTrackSummary, track_id)
+        summary.version = 0 if previous is None else previous.version
+        summary.changed()
+        return await session.merge(summary)
+
+    def writer_event(self, event: dict) -> None:
+        if event["event"] == "stored":
+            self.points_stored([LogPoint.model_validate(point) for point in event["points"]])
+        elif event["event"] == "imported":
+            self.points_imported(event["track_id"], tuple(event["bounds"]))
+        elif event["event"] == "archived":
+            self.points_archived(event["track_id"])
+        elif event["event"] == "removed":
+            self.points_removed(event["track_id"], None if event["bounds"] is None else tuple(event["bounds"]))
+        elif event["event"] == "reset":
+            # (re)connected to the writer, anything cached may have missed writes
+            self.writes += 1
+            self.track_versions.clear()
+            self.recent.tracks.clear()
+            self.track_cache.clear()
+            self.tile_cache.clear()
+            if self.lod is not None:
+                self.lod.tracks.clear()
+
+    def notify(self, event: dict) -> None:
+        for observer in self.write_observers:
+            observer(event)
+
+    def points_imported(self, track_id: str, bounds: tuple[float, float, float, float]) -> None:
+        # imported points can land anywhere in the track, reload what depends on its history
+        self.track_changed(track_id)
+        self.recent.forget(track_id)
+        self.track_cache.invalidate(track_id)
+        if self.lod is not None:
+            self.lod.drop(track_id)
+        self.tile_cache.track_changed(track_id, bounds)
+        if self.write_observers:
+            self.notify({"event": "imported", "track_id": track_id, "bounds": bounds})
+
+    def points_stored(self, points: list[LogPoint]) -> None:
+        for point in points:
+            self.recent.add(point.track_id, db_ts(point.ts), point.lat, point.lon)
+            if self.lod is not None:
+                self.lod.append(point.track_id, db_ts(point.ts), point.lon, point.lat)
+            self.tile_cache.point_added(point.track_id, point.lon, point.lat)
+        for track_id in set(point.track_id for point in points):
+            self.track_changed(track_id)
+            self.track_cache.invalidate(track_id)
+        for point in sorted(points, key=lambda p: p.ts_tz()):
+            if self.live_hub.has_subscribers(point.track_id):
+                self.live_hub.publish(point.track_id, geojson_feature(point))
+        if self.write_observers:
+            self.notify({"event": "stored", "points": [point.model_dump(mode="json") for point in points]})
+
+    def points_archived(self, track_id: str) -> None:
+        # archived timestamps are rounded to milliseconds, drop anything keyed on the old ones
+        self.track_changed(track_id)
+        self.track_cache.invalidate(track_id)
+        if self.lod is not None:
+            self.lod.drop(track_id)
+        if self.write_observers:
+            self.notify({"event": "archived", "track_id": track_id})
+
+    def points_removed(self, track_id: str, bounds: Optional[Bounds]) -> None:
+        # decimated or deleted by maintenance, bounds of the removed points when there were any
+        self.track_changed(track_id)
+        self.recent.forget(track_id)
+        self.track_cache.invalidate(track_id)
+        if self.lod is not None:
+            self.lod.drop(track_id)
+        if bounds is not None:
+            self.tile_cache.track_changed(track_id, bounds)
+        if self.write_observers:
+            self.notify({"event": "removed", "track_id": track_id, "bounds": bounds})
+
+    async def run_maintenance(self, jobs: Optional[list[str]] = None) -> dict[str, int]:
+        if self.writer is not None:
+            return await self.writer.call("maintain", jobs=jobs)
+        return await self.maintenance.run(jobs)
+
+    def track_changed(self, track_id: str) -> None:
+        self.writes += 1
+        self.track_versions.pop(track_id, None)
+
+    async def get_track_version(self, track_id: str) -> Optional[TrackVersion]:
+        """The track's latest point and write version, None without points."""
+        version: Optional[TrackVersion] = self.track_versions.get(track_id)
+        if version is not None:
+            return version
+        writes: int = self.writes
+        async with AsyncSession(self.async_engine) as session:
+            summary: Optional[LogTrackSummary] = await session.get(LogTrackSummary, track_id)
+            if summary is not None and summary.last_ts is not None:
+                latest: datetime = db_ts(summary.last_ts).replace(tzinfo=timezone.utc)
+                changed: datetime = latest if summary.changed_at is None else max(
+                    latest, db_ts(summary.changed_at).replace(tzinfo=timezone.utc))
+                version = TrackVersion(latest, summary.version, changed)
+            else:
+                # a track stored before summaries existed, its first write adds one
+                live: Optional[datetime] = (await session.execute(
+                    select(func.max(LogPoint.ts)).where(LogPoint.track_id == track_id))).scalar()
+                archived: Optional[datetime] = (await session.execute(
+                    select(func.max(LogPointArchive.end_ts)).where(LogPointArchive.track_id == track_id))).scalar()
+                found: list[datetime] = [db_ts(ts) for ts in (live, archived) if ts is not None]
+                if not found:
+                    return None
+                latest = max(found).replace(tzinfo=timezone.utc)
+                version = TrackVersion(latest, 0 if summary is None else summary.version, latest)
+        if writes == self.writes:
+            self.track_versions[track_id] = version
+        return version
+
+    @staticmethod
+    def details_query(key: str, track_id: str):
+        return select(LogTrackDetails).where(LogTrackDetails.key == key).where(LogTrackDetails.track_id == track_id)
+
+    def points_query(self, track_id: str, point_filter: PointFilter = PointFilter()):
+        stmt = select(LogPoint).where(LogPoint.track_id == track_id)
+        return point_filter.apply(stmt, self.dialect).order_by(LogPoint.ts.desc())
+
+    @staticmethod
+    def archive_query(track_id: str, point_filter: PointFilter = PointFilter()):
+        stmt = select(LogPointArchive).where(LogPointArchive.track_id == track_id)
+        return point_filter.apply_archive(stmt).order_by(LogPointArchive.chunk)
+
+    async def get_archived(self, session: AsyncSession, track_id: str, point_filter: PointFilter = PointFilter(),
+                           extras: bool = True) -> PointArrays:
+        chunks: list[LogPointArchive] = list(
+            (await session.execute(self.archive_query(track_id, point_filter))).scalars())
+        arrays: PointArrays = PointArrays.concat([unpack(chunk, extras) for chunk in chunks])
+        return arrays if point_filter.empty() else arrays.take(arrays.matching(point_filter))
+
+    async def get_track_arrays(self, track_id: str) -> PointArrays:
+        async with AsyncSession(self.async_engine) as session:
+            return await self.read_track_arrays(session, track_id)
+
+    async def read_track_arrays(self, session: AsyncSession, track_id: str,
+                                point_filter: PointFilter = PointFilter()) -> PointArrays:
+        # ts, lat and lon of live and archived points in ascending order
+        stmt = point_filter.apply(select(LogPoint.ts, LogPoint.lat, LogPoint.lon).where(LogPoint.track_id == track_id),
+                                  self.dialect).order_by(LogPoint.ts)
+        rows = (await session.execute(stmt)).all()
+        archived: PointArrays = await self.get_archived(session, track_id, point_filter, extras=False)
+        live: PointArrays = PointArrays(np.array([r[0] for r in rows], dtype="datetime64[us]"),
+                                        np.array([r[1] for r in rows], dtype=np.float64),
+                                        np.array([r[2] for r in rows], dtype=np.float64))
+        if not len(archived):
+            return live
+        return PointArrays.concat([archived, live]).ordered()
+
+    async def get_track(self, key: str, track_id: str,
+                        point_filter: PointFilter = PointFilter()) -> Optional[LogTrack]:
+        async with AsyncSession(self.async_engine) as session:
+            details: Optional[LogTrackDetails] = (
+                await session.execute(self.details_query(key, track_id))).scalars().first()
+            if details is None:
                 return None
             points: list[LogPoint] = list(
-                session.exec(select(LogPoint).where(LogPoint.track_id == track_id).order_by(LogPoint.ts.desc())))
+                (await session.execute(self.points_query(track_id, point_filter))).scalars())
+            archived: PointArrays = await self.get_archived(session, track_id, point_filter)
 
-        return LogTrack(details=track[0], points=points)
+        if len(archived):
+            points = list(heapq.merge(points, archived.to_points(track_id), key=newest_first))
+        return LogTrack(details=details, points=points)
+
+    async def get_track_coordinates(self, key: str, track_id: str, point_filter: PointFilter = PointFilter()
+                                    ) -> Optional[tuple[LogTrackDetails, list[tuple], Optional[LogPoint]]]:
+        """(lon, lat, altitude) rows newest first and the latest point, without hydrating a LogPoint per row."""
+        async with AsyncSession(self.async_engine) as session:
+            details: Optional[LogTrackDetails] = (
+                await session.execute(self.details_query(key, track_id))).scalars().first()
+            if details is None:
+                return None
+            stmt = point_filter.apply(select(LogPoint.ts, LogPoint.lon, LogPoint.lat, LogPoint.altitude)
+                                      .where(LogPoint.track_id == track_id), self.dialect).order_by(LogPoint.ts.desc())
+            rows: list[tuple] = []
+            async for partition in self.partitions(await session.stream(stmt.execution_options(
+                    yield_per=READ_PARTITION))):
+                rows.extend(partition)
+            latest: Optional[LogPoint] = None if not rows else await session.get(LogPoint, (track_id, rows[0][0]))
+            archived: PointArrays = await self.get_archived(session, track_id, point_filter)
+
+        if len(archived):
+            archived_rows: list[tuple] = archived.coordinate_rows()
+            if latest is None or archived_rows[0][0] > db_ts(latest.ts):
+                latest = archived.take(slice(-1, None)).to_points(track_id)[0]
+            rows = list(heapq.merge(rows, archived_rows, key=lambda r: r[0], reverse=True))
+        return details, [r[1:] for r in rows], latest
+
+    async def get_track_points(self, key: str, track_id: str, point_filter: PointFilter = PointFilter()
+                               ) -> Optional[tuple[LogTrackDetails, PointArrays]]:
+        """ts, lat and lon arrays in ascending order, for the formats that don't need a LogPoint per row."""
+        async with AsyncSession(self.async_engine) as session:
+            details: Optional[LogTrackDetails] = (
+                await session.execute(self.details_query(key, track_id))).scalars().first()
+            if details is None:
+                return None
+            return details, await self.read_track_arrays(session, track_id, point_filter)
+
+    async def get_track_details(self, key: str, track_id: str) -> Optional[LogTrackDetails]:
+        async with AsyncSession(self.async_engine) as session:
+            return (await session.execute(self.details_query(key, track_id))).scalars().first()
+
+    async def stream_points(self, track_id: str, point_filter: PointFilter = PointFilter(),
+                            yield_per: int = READ_PARTITION) -> AsyncIterator[LogPoint]:
+        async for point in merge_newest_first(self.stream_live_points(track_id, point_filter, yield_per),
+                                              self.stream_archived_points(track_id, point_filter)):
+            yield point
+
+    async def stream_live_points(self, track_id: str, point_filter: PointFilter,
+                                 yield_per: int) -> AsyncIterator[LogPoint]:
+        async with AsyncSession(self.async_engine) as session:
+            stmt = self.points_query(track_id, point_filter).execution_options(yield_per=yield_per)
+            async for partition in (await session.stream_scalars(stmt)).partitions():
+                for point in partition:
+                    yield point
+                await asyncio.sleep(0)
+
+    async def stream_archived_points(self, track_id: str, point_filter: PointFilter) -> AsyncIterator[LogPoint]:
+        async for arrays in self.stream_archived_arrays(track_id, point_filter):
+            for point in arrays.to_points(track_id):
+                yield point
+
+    async def stream_archived_arrays(self, track_id: str, point_filter: PointFilter,
+                                     extras: bool = True) -> AsyncIterator[PointArrays]:
+        # one chunk in memory at a time, newest first
+        async with AsyncSession(self.async_engine) as session:
+            stmt = point_filter.apply_archive(select(LogPointArchive.chunk)
+                                              .where(LogPointArchive.track_id == track_id))
+            numbers: list[int] = list((await session.execute(stmt.order_by(LogPointArchive.chunk.desc()))).scalars())
+            for number in numbers:
+                chunk: LogPointArchive = await session.get(LogPointArchive, (track_id, number))
+                arrays: PointArrays = unpack(chunk, extras)
+                session.expunge(chunk)
+                yield arrays.take(arrays.matching(point_filter))
+                await asyncio.sleep(0)
+
+    async def stream_coordinates(self, track_id: str, point_filter: PointFilter = PointFilter(),
+                                 yield_per: int = READ_PARTITION) -> AsyncIterator[list[tuple]]:
+        """
+        (ts, lon, lat, altitude) rows newest first in lists of about yield_per, like get_track_coordinates without
+        holding the track. A LogPoint per row costs several times the row, the streamed GeoJSON doesn't need one.
+        """
+        archived: AsyncIterator[list[tuple]] = (arrays.coordinate_rows() async for arrays in
+                                                self.stream_archived_arrays(track_id, point_filter))
+        first_archived: Optional[list[tuple]] = await anext(archived, None)
+        async with AsyncSession(self.async_engine) as session:
+            stmt = point_filter.apply(select(LogPoint.ts, LogPoint.lon, LogPoint.lat, LogPoint.altitude)
+                                      .where(LogPoint.track_id == track_id), self.dialect).order_by(LogPoint.ts.desc())
+            live: AsyncIterator[list[tuple]] = self.partitions(
+                await session.stream(stmt.execution_options(yield_per=yield_per)))
+            if first_archived is None:
+                # nothing archived, the usual case, the live partitions go out as they're read
+                async for rows in live:
+                    yield rows
+                return
+
+            merged: list[tuple] = []
+            async for row in merge_newest_first(flatten(live), flatten(archived, first_archived),
+                                                key=row_newest_first):
+                merged.append(row)
+                if len(merged) >= yield_per:
+                    yield merged
+                    merged = []
+            if merged:
+                yield merged
+
+    @staticmethod
+    async def partitions(result: AsyncResult) -> AsyncIterator[list[tuple]]:
+        # each partition is fetched and converted in one go, other requests run between them
+        async for partition in result.partitions():
+            yield list(partition)
+            await asyncio.sleep(0)
+
+    async def get_latest_point(self, track_id: str, point_filter: PointFilter = PointFilter()) -> Optional[LogPoint]:
+        """The newest point matching point_filter, stored or archived."""
+        async with AsyncSession(self.async_engine) as session:
+            latest: Optional[LogPoint] = (
+                await session.execute(self.points_query(track_id, point_filter).limit(1))).scalars().first()
+        async for arrays in self.stream_archived_arrays(track_id, point_filter):
+            if len(arrays):
+                newest: LogPoint = arrays.take(slice(-1, None)).to_points(track_id)[0]
+                if latest is None or db_ts(newest.ts) > db_ts(latest.ts):
+                    latest = newest
+                break
+        return latest
+
+    async def get_simplified_track(self, key: str, track_id: str, tolerance: Optional[float] = None,
+                                   zoom: Optional[float] = None,
+                                   point_filter: PointFilter = PointFilter()) -> Optional[LogTrack]:
+        level: Optional[int] = None
+        if self.lod is not None and zoom is not None and tolerance is None and point_filter.empty():
+            level = self.lod.level_for(zoom)
+
+        if level is None:
+            track: Optional[LogTrack] = await self.get_track(key, track_id, point_filter)
+            if track is None:
+                return None
+            return track.simplify(tolerance if tolerance is not None else tolerance_for_zoom(zoom))
+
+        details: Optional[LogTrackDetails] = await self.get_track_details(key, track_id)
+        if details is None:
+            return None
+        lod: TrackLod = await self.get_track_lod(track_id)
+        points: list[LogPoint] = await self.get_points_at(track_id, lod.kept_ts(level))
+        return LogTrack(details=details, points=points)
+
+    async def get_track_lod(self, track_id: str) -> TrackLod:
+        lod: Optional[TrackLod] = self.lod.get(track_id)
+        if lod is not None:
+            return lod
+        build: Optional[asyncio.Task] = self.lod.builds.get(track_id)
+        if build is None:
+            build = asyncio.create_task(self.build_track_lod(track_id))
+            self.lod.builds[track_id] = build
+            build.add_done_callback(lambda _: self.lod.builds.pop(track_id, None))
+        # shielded, a request going away doesn't cancel the build the others wait for
+        return await asyncio.shield(build)
+
+    async def build_track_lod(self, track_id: str) -> TrackLod:
+        self.lod.start_build(track_id)
+        try:
+            arrays: PointArrays = await self.get_track_arrays(track_id)
+            lod: TrackLod = TrackLod(arrays.ts.astype("datetime64[us]"), arrays.lonlat(), self.lod.zooms)
+            self.lod.put(track_id, lod)
+        finally:
+            self.lod.end_build(track_id)
+        return lod
+
+    async def get_points_at(self, track_id: str, ts: np.ndarray, chunk_size: int = 500) -> list[LogPoint]:
+        wanted: list[datetime] = ts.astype(object).tolist()
+        points: list[LogPoint] = []
+        async with AsyncSession(self.async_engine) as session:
+            for i in range(0, len(wanted), chunk_size):
+                stmt = select(LogPoint).where(LogPoint.track_id == track_id).where(
+                    LogPoint.ts.in_(wanted[i:i + chunk_size]))
+                points.extend((await session.execute(stmt)).scalars())
+            archived: PointArrays = await self.get_archived(session, track_id)
+        if len(archived):
+            points.extend(archived.take(np.isin(archived.ts, ts)).to_points(track_id))
+        points.sort(key=lambda p: p.ts, reverse=True)
+        return points
+
+    async def get_tile(self, key: str, z: int, x: int, y: int) -> bytes:
+        tile_key: TileKey = (key, z, x, y)
+        tile: Optional[bytes] = self.tile_cache.get(tile_key)
+        if tile is not None:
+            return tile
+
+        # by the track's bbox rather than its points, a segment crossing the tile has no vertex in it
+        min_lon, min_lat, max_lon, max_lat = tile_bounds(z, x, y, BUFFER / EXTENT)
+        track_ids: list[str] = sorted(
+            summary.track_id for summary in await self.get_track_summaries(key)
+            if summary.point_count and summary.min_lon <= max_lon and summary.max_lon >= min_lon and
+            summary.min_lat <= max_lat and summary.max_lat >= min_lat)
+
+        features: list = []
+        for track_id in track_ids:
+            lines: list[np.ndarray] = tile_lines(await self.get_track_lonlat(track_id, z), z, x, y)
+            if lines:
+                features.append((lines, {"track_id": track_id}))
+        tile = encode_tile({"tracks": features})
+        self.tile_cache.put(tile_key, tile, set(track_ids))
+        return tile
+
+    async def get_track_lonlat(self, track_id: str, zoom: int) -> np.ndarray:
+        level: Optional[int] = None if self.lod is None else self.lod.level_for(zoom)
+        if level is not None:
+            return (await self.get_track_lod(track_id)).kept_xy(level)
+
+        lonlat: np.ndarray = (await self.get_track_arrays(track_id)).lonlat()
+        return lonlat[simplify_mask(lonlat, tolerance_for_zoom(zoom))]
+
+    async def search_points(self, key: str, point_filter: PointFilter, limit: int) -> list[LogPoint]:
+        stmt = (select(LogPoint).join(LogTrackDetails, LogTrackDetails.track_id == LogPoint.track_id)
+                .where(LogTrackDetails.key == key))
+        stmt = point_filter.apply(stmt, self.dialect).order_by(LogPoint.ts.desc()).limit(limit)
+        chunks_stmt = point_filter.apply_archive(
+            select(LogPointArchive.track_id, LogPointArchive.chunk, LogPointArchive.end_ts)
+            .join(LogTrackDetails, LogTrackDetails.track_id == LogPointArchive.track_id)
+            .where(LogTrackDetails.key == key)).order_by(LogPointArchive.end_ts.desc())
+        async with AsyncSession(self.async_engine) as session:
+            points: list[LogPoint] = list((await session.execute(stmt)).scalars())
+            for track_id, number, end_ts in (await session.execute(chunks_stmt)).all():
+                # chunks come newest first, stop once none can beat the current top `limit`
+                if len(points) >= limit and db_ts(end_ts) < db_ts(points[limit - 1].ts):
+                    break
+                chunk: LogPointArchive = await session.get(LogPointArchive, (track_id, number))
+                arrays: PointArrays = unpack(chunk)
+                session.expunge(chunk)
+                points.extend(arrays.take(arrays.matching(point_filter)).to_points(track_id))
+                points.sort(key=newest_first)
+        return points[:limit]
 
     async def get_next_squid(self) -> str:
-        with Session(self.engine) as session:
-            with session.begin():
-                tracks: list[LogTrackDetails] = list(session.exec(select(LogTrackDetails)))
-                keys: set[str] = set([t.key for t in tracks])
-                while True:
-                    new_key: str = self.sqids.encode(
-                        [int(datetime.now(tz=timezone.utc).timestamp()), self.rand.randint(0, 1000)])
-                    if new_key not in keys:
-                        break
+        if self.writer is not None:
+            return await self.writer.call("reserve")
+        return await self.key_registry.reserve(self.new_squid)
 
-        return new_key
+    def new_squid(self) -> str:
+        return self.sqids.encode([int(datetime.now(tz=timezone.utc).timestamp()), self.rand.randint(0, 1000)])
 
     async def get_tracks(self, key) -> list[LogTrackDetails]:
-        with Session(self.engine) as session:
+        async with AsyncSession(self.async_engine) as session:
             tracks: list[LogTrackDetails] = list(
-                session.exec(select(LogTrackDetails).where(LogTrackDetails.key == key)))
+                (await session.execute(select(LogTrackDetails).where(LogTrackDetails.key == key))).scalars())
 
         return tracks
 
+    async def get_track_summaries(self, key: str) -> list[LogTrackSummary]:
+        """Summaries of a key's tracks, without reading any points once every track has one."""
+        async with AsyncSession(self.async_engine, expire_on_commit=False) as session:
+            rows = (await session.execute(
+                select(LogTrackDetails.track_id, LogTrackSummary)
+                .outerjoin(LogTrackSummary, LogTrackSummary.track_id == LogTrackDetails.track_id)
+                .where(LogTrackDetails.key == key))).all()
+            summaries: list[LogTrackSummary] = []
+            for track_id, summary in rows:
+                if summary is None and self.writer is not None:
+                    # read only, the writer stores it with the track's next point
+                    summary = summarize(track_id, await self.read_track_arrays(session, track_id))
+                elif summary is None:
+                    summary = await self.rebuild_summary(session, track_id)
+                summaries.append(summary)
+            await session.commit()
+        return summaries
+
     async def get_user_tracks(self, key: str) -> list[str]:
-        async with Session(self.engine) as session:
-            tracks: list[LogTrackDetails] = list(
-                session.exec(select(LogTrackDetails).where(LogTrackDetails.key == key)))
+        tracks: list[LogTrackDetails] = await self.get_tracks(key)
 
         return [track.track_id for track in tracks]
 
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy.exc import OperationalError, InterfaceError
+
+from backtrack.basic_log import log
+from backtrack.metrics import POINTS_DROPPED
+from backtrack.storage.models import LogTrackDetails, LogPoint
+
+LogPair = tuple[LogTrackDetails, LogPoint]
+# lat, lon
+Fix = tuple[float, float]
+
+
+@dataclass
+class RecentTrack:
+    # ascending
+    ts: list[datetime] = field(default_factory=list)
+    fixes: list[Fix] = field(default_factory=list)
+    # every point stored from here on is held, so a later point's neighbours are known
+    complete_from: Optional[datetime] = None
+
+
+class RecentPoints:
+    """
+    The last per_track points stored to each of the max_tracks most recently written tracks, keyed by naive UTC ts.
+    Resent points are dropped against it before they reach the database, and a point arriving out of order is
+    folded into its summary with the neighbours held here instead of re-reading the track.
+    """
+
+    def __init__(self, per_track: int, max_tracks: int):
+        self.per_track = per_track
+        self.max_tracks = max_tracks
+        self.tracks: dict[str, RecentTrack] = {}
+
+    def seen(self, track_id: str, ts: datetime) -> bool:
+        recent: Optional[RecentTrack] = self.tracks.get(track_id)
+        if recent is None:
+            return False
+        i: int = bisect_left(recent.ts, ts)
+        return i < len(recent.ts) and recent.ts[i] == ts
+
+    def add(self, track_id: str, ts: datetime, lat: float, lon: float) -> None:
+        if self.per_track <= 0:
+            return
+        # most recently written last
+        recent: RecentTrack = self.tracks.pop(track_id, None) or RecentTrack()
+        self.tracks[track_id] = recent
+        i: int = bisect_left(recent.ts, ts)
+        if i == len(recent.ts) or recent.ts[i] != ts:
+            recent.ts.insert(i, ts)
+            recent.fixes.insert(i, (lat, lon))
+        if len(recent.ts) > self.per_track:
+            del recent.ts[0], recent.fixes[0]
+            if recent.complete_from is not None:
+                recent.complete_from = max(recent.complete_from, recent.ts[0])
+        while len(self.tracks) > self.max_tracks:
+            del self.tracks[next(iter(self.tracks))]
+
+    def seed(self, track_id: str, ts: datetime, lat: float, lon: float) -> None:
+        """Add a track's last stored point, nothing is stored after it so the track is complete from there."""
+        self.add(track_id, ts, lat, lon)
+        recent: Optional[RecentTrack] = self.tracks.get(track_id)
+        if recent is not None and recent.complete_from is None:
+            recent.complete_from = ts
+
+    def neighbours(self, track_id: str, ts: datetime) -> Optional[tuple[Fix, Fix]]:
+        """The stored points right before and after a late ts, None when they may not be held here."""
+        recent: Optional[RecentTrack] = self.tracks.get(track_id)
+        if recent is None or recent.complete_from is None or ts <= recent.complete_from:
+            return None
+        i: int = bisect_left(recent.ts, ts)
+        if i == len(recent.ts) or recent.ts[i] == ts:
+            return None
+        return recent.fixes[i - 1], recent.fixes[i]
+
+    def forget(self, track_id: str) -> None:
+        self.tracks.pop(track_id, None)
+
+
+class IngestQueue:
+    """In-process write-behind queue, flushed as group commits of up to batch_size points or every batch_latency_ms."""
+
+    def __init__(self, flush: Callable[[list[LogPair]], Awaitable[object]], batch_size: int, batch_latency_ms: int,
+                 queue_size: int, retry_max_s: float = 5):
+        self.flush = flush
+        self.retry_max_s = retry_max_s
+        self.batch_size = batch_size
+        self.batch_latency = batch_latency_ms / 1000
+        self.queue: asyncio.Queue[Optional[LogPair]] = asyncio.Queue(maxsize=queue_size)
+        self.task: Optional[asyncio.Task] = None
+
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    async def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            await self.queue.put(None)
+            await self.task
+            self.task = None
+
+    async def put(self, log_pair: LogPair) -> None:
+        await self.queue.put(log_pair)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping: bool = False
+        while not stopping:
+            item: Optional[LogPair] = await self.queue.get()
+            if item is None:
+                break
+            batch: list[LogPair] = [item]
+            deadline: float = loop.time() + self.batch_latency
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout: float = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self.flush_batch(batch)
+
+    async def flush_batch(self, batch: list[LogPair]) -> None:
+        """
+        The points were already acknowledged, so nothing is given up while the database is unreachable or locked:
+        the batch is retried with backoff while the queue fills and put() pushes back on new points. A batch the
+        database rejects is flushed point by point, and only the points rejected on their own are dropped.
+        """
+        delay: float = 0.1
+        while True:
+            try:
+                await self.flush(batch)
+                return
+            except (OperationalError, InterfaceError, OSError) as e:
+                log(f"failed to flush {len(batch)} points, retrying in {delay:.1f} s: {e!r}", logging.WARNING,
+                    source="ingest", depth=self.depth())
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.retry_max_s)
+            except Exception as e:
+                if len(batch) > 1:
+                    log(f"failed to flush {len(batch)} points, flushing them one by one: {e!r}", logging.WARNING,
+                        source="ingest")
+                    for log_pair in batch:
+                        await self.flush_batch([log_pair])
+                    return
+                _, point = batch[0]
+                POINTS_DROPPED.inc()
+                log(f"dropped a point the database rejects: {e!r}", logging.ERROR, source="ingest",
+                    track_id=point.track_id, ts=str(point.ts))
+                return
@@ -0,0 +1,62 @@
+import asyncio
+from collections import OrderedDict
+from typing import Callable
+
+from sqlalchemy import true
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlmodel import select
+
+from backtrack.storage.dialects import insert_for
+from backtrack.storage.models import LogKey, LogTrackDetails
+
+# keys handed out but not used yet, kept apart from the next reservations, generated keys only collide within a second
+RECENT_RESERVATIONS: int = 10000
+
+
+class KeyRegistry:
+    """Keys in use, mirrored in memory so membership checks never scan the database."""
+
+    def __init__(self, async_engine: AsyncEngine):
+        self.async_engine = async_engine
+        self.insert = insert_for(async_engine.dialect.name)
+        self.keys: set[str] = set()
+        self.reserved: OrderedDict[str, None] = OrderedDict()
+        self.lock = asyncio.Lock()
+
+    async def load(self) -> None:
+        async with AsyncSession(self.async_engine) as session:
+            # keys stored before the registry existed
+            backfill = self.insert(LogKey).from_select(
+                ["key"], select(LogTrackDetails.key).distinct().where(true())).on_conflict_do_nothing()
+            await session.execute(backfill)
+            await session.commit()
+            self.keys = set((await session.execute(select(LogKey.key))).scalars())
+
+    async def register(self, key: str) -> None:
+        if key in self.keys:
+            return
+        # the first points of a new key arrive together, one of them inserts it
+        async with self.lock:
+            if key in self.keys:
+                return
+            async with AsyncSession(self.async_engine) as session:
+                await session.execute(self.insert(LogKey).values(key=key).on_conflict_do_nothing())
+                await session.commit()
+            self.keys.add(key)
+
+    async def reserve(self, new_key: Callable[[], str]) -> str:
+        """A key nobody uses yet, only stored by register once its first point arrives."""
+        async with self.lock:
+            while True:
+                key: str = new_key()
+                if key in self.keys or key in self.reserved:
+                    continue
+                async with AsyncSession(self.async_engine) as session:
+                    # registered by another process since load
+                    if await session.get(LogKey, key) is not None:
+                        self.keys.add(key)
+                        continue
+                self.reserved[key] = None
+                if len(self.reserved) > RECENT_RESERVATIONS:
+                    self.reserved.popitem(last=False)
+                return key
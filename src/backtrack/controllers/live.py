@@ -0,0 +1,38 @@
+import asyncio
+from typing import Optional
+
+
+class LiveHub:
+    """
+    In-process pub/sub of new track points, one bounded queue per subscriber.
+    A subscriber that falls a full queue behind is dropped and gets None, its stream ends so the client resyncs.
+    """
+
+    def __init__(self, queue_size: int = 256):
+        self.queue_size = queue_size
+        self.subscribers: dict[str, set[asyncio.Queue[Optional[str]]]] = {}
+
+    def has_subscribers(self, track_id: str) -> bool:
+        return track_id in self.subscribers
+
+    def subscribe(self, track_id: str) -> asyncio.Queue[Optional[str]]:
+        queue: asyncio.Queue[Optional[str]] = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.setdefault(track_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, track_id: str, queue: asyncio.Queue[Optional[str]]) -> None:
+        queues: set[asyncio.Queue[Optional[str]]] = self.subscribers.get(track_id, set())
+        queues.discard(queue)
+        if not queues:
+            self.subscribers.pop(track_id, None)
+
+    def publish(self, track_id: str, message: str) -> None:
+        for queue in list(self.subscribers.get(track_id, ())):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # slow follower, it has missed this point, end its stream in place of the points it hasn't read
+                self.unsubscribe(track_id, queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
@@ -0,0 +1,113 @@
+import asyncio
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+from backtrack.storage.simplify import simplify_mask, tolerance_for_zoom
+
+
+class TrackLod:
+    """Douglas-Peucker simplifications of one track at fixed zoom levels, extended incrementally as points arrive."""
+
+    def __init__(self, ts: np.ndarray, xy: np.ndarray, zooms: list[int]):
+        self.ts = ts
+        self.xy = xy
+        self.zooms = zooms
+        self.pending: list[tuple[np.datetime64, float, float]] = []
+        self.levels: dict[int, np.ndarray] = {}
+        self.level_sizes: dict[int, int] = {}
+
+    def last_ts(self) -> Optional[np.datetime64]:
+        if self.pending:
+            return self.pending[-1][0]
+        return self.ts[-1] if len(self.ts) else None
+
+    def append(self, ts: datetime, lon: float, lat: float) -> bool:
+        point_ts: np.datetime64 = np.datetime64(ts, "us")
+        last: Optional[np.datetime64] = self.last_ts()
+        if last is not None and point_ts <= last:
+            # out of order or duplicate, the owner rebuilds from the database
+            return False
+        self.pending.append((point_ts, lon, lat))
+        return True
+
+    def kept_ts(self, zoom: int) -> np.ndarray:
+        # kept() folds in pending points first, index the arrays it leaves behind
+        kept: np.ndarray = self.kept(zoom)
+        return self.ts[kept]
+
+    def kept_xy(self, zoom: int) -> np.ndarray:
+        kept: np.ndarray = self.kept(zoom)
+        return self.xy[kept]
+
+    def kept(self, zoom: int) -> np.ndarray:
+        if self.pending:
+            self.ts = np.concatenate([self.ts, np.array([p[0] for p in self.pending], dtype="datetime64[us]")])
+            self.xy = np.concatenate([self.xy, np.array([(p[1], p[2]) for p in self.pending], dtype=np.float64)])
+            self.pending = []
+
+        n: int = len(self.ts)
+        if self.level_sizes.get(zoom) != n:
+            tolerance: float = tolerance_for_zoom(zoom)
+            kept: Optional[np.ndarray] = self.levels.get(zoom)
+            if kept is None or len(kept) < 2:
+                self.levels[zoom] = np.nonzero(simplify_mask(self.xy, tolerance))[0]
+            else:
+                # the old end point was only kept as an end point, re-simplify from the vertex before it
+                anchor: int = int(kept[-2])
+                suffix: np.ndarray = np.nonzero(simplify_mask(self.xy[anchor:], tolerance))[0] + anchor
+                self.levels[zoom] = np.concatenate([kept[:-2], suffix])
+            self.level_sizes[zoom] = n
+
+        return self.levels[zoom]
+
+
+class LodCache:
+    def __init__(self, zooms: list[int], max_tracks: int):
+        self.zooms = sorted(zooms)
+        self.max_tracks = max_tracks
+        self.tracks: OrderedDict[str, TrackLod] = OrderedDict()
+        # points that arrive while a track is being loaded from the database
+        self.building: dict[str, list[tuple[datetime, float, float]]] = {}
+        # the one load of a track that concurrent requests for it wait on
+        self.builds: dict[str, asyncio.Task] = {}
+
+    def level_for(self, zoom: float) -> Optional[int]:
+        # the coarsest precomputed level that is at least as detailed as the requested zoom
+        for level in self.zooms:
+            if level >= zoom:
+                return level
+        return None
+
+    def get(self, track_id: str) -> Optional[TrackLod]:
+        lod: Optional[TrackLod] = self.tracks.get(track_id)
+        if lod is not None:
+            self.tracks.move_to_end(track_id)
+        return lod
+
+    def start_build(self, track_id: str) -> None:
+        self.building.setdefault(track_id, [])
+
+    def end_build(self, track_id: str) -> None:
+        # put took the points already, unless the build failed
+        self.building.pop(track_id, None)
+
+    def put(self, track_id: str, lod: TrackLod) -> None:
+        for ts, lon, lat in self.building.pop(track_id, []):
+            lod.append(ts, lon, lat)
+        self.tracks[track_id] = lod
+        self.tracks.move_to_end(track_id)
+        while len(self.tracks) > self.max_tracks:
+            self.tracks.popitem(last=False)
+
+    def drop(self, track_id: str) -> None:
+        self.tracks.pop(track_id, None)
+
+    def append(self, track_id: str, ts: datetime, lon: float, lat: float) -> None:
+        if track_id in self.building:
+            self.building[track_id].append((ts, lon, lat))
+        lod: Optional[TrackLod] = self.tracks.get(track_id)
+        if lod is not None and not lod.append(ts, lon, lat):
+            del self.tracks[track_id]
@@ -0,0 +1,341 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Optional, TYPE_CHECKING
+
+import numpy as np
+from sqlalchemy import and_, delete, func, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from backtrack.basic_log import log
+from backtrack.config.config import ArchiveConfig, MaintenanceConfig
+from backtrack.metrics import MAINTENANCE_SECONDS, POINTS_REMOVED
+from backtrack.storage.archive import PointArrays, pack, unpack
+from backtrack.storage.db import rebuild_spatial_index
+from backtrack.storage.decimate import decimate_mask
+from backtrack.storage.filters import db_ts
+from backtrack.storage.models import (LogTrackDetails, LogPoint, LogPointArchive, LogTrackSummary,
+                                      LogTrackMaintenance)
+
+if TYPE_CHECKING:
+    from backtrack.controllers.controller import BacktrackController
+
+Bounds = tuple[float, float, float, float]
+
+# about what a logpoint row, its primary key entry and its rtree entry take in sqlite
+LIVE_POINT_BYTES: int = 200
+# PRAGMA auto_vacuum
+SQLITE_INCREMENTAL_VACUUM: int = 2
+# free pages returned per incremental_vacuum step, the write lock is released between steps
+VACUUM_STEP_PAGES: int = 256
+# rows sampled per index by PRAGMA optimize, keeps its ANALYZE short on large tables
+ANALYSIS_LIMIT: int = 400
+# only run when named, never on a schedule or with every job
+REQUESTED_JOBS: tuple[str, ...] = ("reindex",)
+# vacuumed and analyzed on postgresql, the tables maintenance churns
+COMPACTED_TABLES: tuple[str, ...] = (LogPoint.__tablename__, LogPointArchive.__tablename__,
+                                     LogTrackSummary.__tablename__)
+
+
+class Maintenance:
+    """
+    Retention and compaction jobs of the process that writes, the archiver among them. Jobs run one at a time
+    and work in small transactions with a pause in between, so live ingest always gets its turn.
+    """
+
+    def __init__(self, controller: BacktrackController, maintenance_conf: MaintenanceConfig,
+                 archive_conf: ArchiveConfig):
+        self.controller = controller
+        self.conf = maintenance_conf
+        self.pause_s = maintenance_conf.pause_ms / 1000
+        # every job its settings allow, python -m backtrack.maintenance runs any of them
+        self.jobs: dict[str, Callable[[datetime], Awaitable[int]]] = {"archive": self.archive}
+        if maintenance_conf.decimate_after_days > 0:
+            self.jobs["decimate"] = self.decimate
+        if maintenance_conf.quota_points > 0 or maintenance_conf.quota_bytes > 0:
+            self.jobs["quota"] = self.enforce_quotas
+        if maintenance_conf.abandoned_days > 0:
+            self.jobs["abandoned"] = self.delete_abandoned
+        self.jobs["compact"] = self.compact
+        self.jobs["reindex"] = self.reindex
+        # seconds between the runs of the jobs that are scheduled
+        self.intervals: dict[str, float] = {}
+        if archive_conf.enabled:
+            self.intervals["archive"] = archive_conf.interval_minutes * 60
+        if maintenance_conf.enabled:
+            self.intervals.update({name: maintenance_conf.interval_minutes * 60 for name in self.jobs
+                                   if name not in ("archive", *REQUESTED_JOBS)})
+        self.task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self.task is None and self.intervals:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        due: dict[str, float] = {name: loop.time() for name in self.intervals}
+        while True:
+            for name in [name for name, at in due.items() if at <= loop.time()]:
+                try:
+                    await self.run_job(name)
+                except Exception as e:
+                    log(f"maintenance job {name} failed: {e!r}", logging.ERROR, source="maintenance")
+                due[name] = loop.time() + self.intervals[name]
+            await asyncio.sleep(max(0.0, min(due.values()) - loop.time()))
+
+    async def run(self, names: Optional[list[str]] = None, now: Optional[datetime] = None) -> dict[str, int]:
+        """Run jobs once, every job when no names are given."""
+        unknown: list[str] = [name for name in names or () if name not in self.jobs]
+        if unknown:
+            raise ValueError(f"unknown or unconfigured maintenance jobs {', '.join(unknown)}, "
+                             f"expected some of {', '.join(self.jobs)}")
+        return {name: await self.run_job(name, now)
+                for name in names or [name for name in self.jobs if name not in REQUESTED_JOBS]}
+
+    async def run_job(self, name: str, now: Optional[datetime] = None) -> int:
+        start: float = time.perf_counter()
+        try:
+            count: int = await self.jobs[name](now or datetime.now(tz=timezone.utc))
+        finally:
+            MAINTENANCE_SECONDS.labels(name).observe(time.perf_counter() - start)
+        log(f"maintenance job {name} done", logging.INFO, source="maintenance", count=count,
+            ms=round((time.perf_counter() - start) * 1000))
+        return count
+
+    async def pause(self) -> None:
+        # between batches, live ingest gets the database and a backlog of points is waited out
+        await asyncio.sleep(self.pause_s)
+        queue = self.controller.ingest_queue
+        while queue is not None and queue.depth() > self.conf.max_ingest_depth:
+            await asyncio.sleep(max(self.pause_s, 0.01))
+
+    async def archive(self, now: datetime) -> int:
+        """Tracks moved into the archive."""
+        return len(await self.controller.archiver.archive_idle(now, self.pause))
+
+    async def decimate(self, now: datetime) -> int:
+        """Points removed from tracks by thinning the ones older than decimate_after_days."""
+        cutoff: datetime = db_ts(now - timedelta(days=self.conf.decimate_after_days))
+        async with AsyncSession(self.controller.async_engine) as session:
+            track_ids: list[str] = list((await session.execute(
+                select(LogTrackSummary.track_id)
+                .outerjoin(LogTrackMaintenance, LogTrackMaintenance.track_id == LogTrackSummary.track_id)
+                .where(LogTrackSummary.first_ts < cutoff)
+                .where(or_(LogTrackMaintenance.decimated_until.is_(None),
+                           and_(LogTrackMaintenance.decimated_until < cutoff,
+                                LogTrackMaintenance.decimated_until < LogTrackSummary.last_ts))))).scalars())
+        removed: int = 0
+        for track_id in track_ids:
+            removed += await self.decimate_track(track_id, cutoff)
+            await self.pause()
+        return removed
+
+    async def decimate_track(self, track_id: str, cutoff: datetime) -> int:
+        """Thin the points up to cutoff that weren't yet, live rows are deleted and archive chunks repacked."""
+        async with AsyncSession(self.controller.async_engine) as session:
+            state: Optional[LogTrackMaintenance] = await session.get(LogTrackMaintenance, track_id)
+            since: Optional[datetime] = (None if state is None or state.decimated_until is None
+                                         else db_ts(state.decimated_until))
+            stmt = (select(LogPoint.ts, LogPoint.lat, LogPoint.lon).where(LogPoint.track_id == track_id)
+                    .where(LogPoint.ts <= cutoff))
+            if since is not None:
+                stmt = stmt.where(LogPoint.ts > since)
+            rows: list[tuple] = list((await session.execute(stmt.order_by(LogPoint.ts))).tuples())
+            chunks: list[LogPointArchive] = list((await session.execute(
+                self.controller.archive_query(track_id))).scalars())
+
+        interval_s: float = self.conf.decimate_interval_s
+        distance_m: float = self.conf.decimate_distance_m
+        live: PointArrays = PointArrays(np.array([r[0] for r in rows], dtype="datetime64[us]"),
+                                        np.array([r[1] for r in rows], dtype=np.float64),
+                                        np.array([r[2] for r in rows], dtype=np.float64))
+        # a greedy walk over every point, off the event loop
+        live_keep: np.ndarray = await asyncio.to_thread(decimate_mask, live, interval_s, distance_m)
+
+        archived: PointArrays = PointArrays.concat([unpack(chunk) for chunk in chunks])
+        archived_keep: np.ndarray = np.ones(len(archived), dtype=bool)
+        window: np.ndarray = archived.ts <= np.datetime64(cutoff, "ms")
+        if since is not None:
+            window &= archived.ts > np.datetime64(since, "ms")
+        if window.any():
+            archived_keep[window] = await asyncio.to_thread(decimate_mask, archived.take(window), interval_s,
+                                                            distance_m)
+
+        dropped_ts: list[datetime] = [rows[i][0] for i in np.nonzero(~live_keep)[0]]
+        for start in range(0, len(dropped_ts), self.conf.batch_size):
+            async with AsyncSession(self.controller.async_engine) as session:
+                await session.execute(delete(LogPoint).where(LogPoint.track_id == track_id)
+                                      .where(LogPoint.ts.in_(dropped_ts[start:start + self.conf.batch_size])))
+                await session.commit()
+            await self.pause()
+
+        async with AsyncSession(self.controller.async_engine) as session:
+            if not archived_keep.all():
+                await session.execute(delete(LogPointArchive).where(LogPointArchive.track_id == track_id))
+                session.add_all(pack(track_id, archived.take(archived_keep), self.controller.archiver.chunk_size))
+            await self.controller.rebuild_summary(session, track_id)
+            await session.merge(LogTrackMaintenance(track_id=track_id, decimated_until=cutoff))
+            await session.commit()
+
+        dropped: PointArrays = PointArrays.concat([live.take(~live_keep), archived.take(~archived_keep)])
+        if len(dropped):
+            POINTS_REMOVED.labels("decimate").inc(len(dropped))
+            self.controller.points_removed(track_id, (float(dropped.lon.min()), float(dropped.lat.min()),
+                                                      float(dropped.lon.max()), float(dropped.lat.max())))
+        return len(dropped)
+
+    async def summarize_missing(self) -> None:
+        """Summaries for tracks stored before summaries existed, or whose import failed, quotas work off them."""
+        async with AsyncSession(self.controller.async_engine) as session:
+            track_ids: list[str] = list((await session.execute(
+                select(LogTrackDetails.track_id)
+                .outerjoin(LogTrackSummary, LogTrackSummary.track_id == LogTrackDetails.track_id)
+                .where(LogTrackSummary.track_id.is_(None)))).scalars())
+        for track_id in track_ids:
+            async with AsyncSession(self.controller.async_engine) as session:
+                await self.controller.rebuild_summary(session, track_id)
+                await session.commit()
+            await self.pause()
+
+    async def enforce_quotas(self, now: datetime) -> int:
+        """Points removed by deleting the oldest tracks of keys over quota_points or quota_bytes."""
+        await self.summarize_missing()
+        blob_bytes = sum(func.coalesce(func.length(column), 0) for column in (
+            LogPointArchive.ts, LogPointArchive.lat, LogPointArchive.lon, LogPointArchive.altitude,
+            LogPointArchive.speed_kph, LogPointArchive.direction, LogPointArchive.distance, LogPointArchive.battery,
+            LogPointArchive.accuracy))
+        archived = select(LogPointArchive.track_id, func.sum(LogPointArchive.count).label("count"),
+                          func.sum(blob_bytes).label("bytes")).group_by(LogPointArchive.track_id).subquery()
+        async with AsyncSession(self.controller.async_engine) as session:
+            rows: list[tuple] = list((await session.execute(
+                select(LogTrackDetails.key, LogTrackSummary.track_id, LogTrackSummary.point_count,
+                       LogTrackSummary.last_ts, func.coalesce(archived.c.count, 0),
+                       func.coalesce(archived.c.bytes, 0))
+                .join(LogTrackSummary, LogTrackSummary.track_id == LogTrackDetails.track_id)
+                .outerjoin(archived, archived.c.track_id == LogTrackDetails.track_id))).tuples())
+
+        by_key: dict[str, list[tuple]] = {}
+        for row in rows:
+            by_key.setdefault(row[0], []).append(row)
+        over: list[str] = []
+        for tracks in by_key.values():
+            # newest first, everything past the point where the key runs over its quota goes
+            tracks.sort(key=lambda row: db_ts(row[3]) if row[3] is not None else datetime.min, reverse=True)
+            points: int = 0
+            stored: int = 0
+            for i, (_, track_id, point_count, _, archived_count, archived_bytes) in enumerate(tracks):
+                points += point_count
+                stored += (point_count - archived_count) * LIVE_POINT_BYTES + archived_bytes
+                if i and (0 < self.conf.quota_points < points or 0 < self.conf.quota_bytes < stored):
+                    over.append(track_id)
+
+        removed: int = 0
+        for track_id in over:
+            removed += await self.delete_track(track_id, "quota")
+        return removed
+
+    async def delete_abandoned(self, now: datetime) -> int:
+        """Points removed by deleting tracks of fewer than abandoned_points points idle for abandoned_days."""
+        cutoff: datetime = db_ts(now - timedelta(days=self.conf.abandoned_days))
+        await self.summarize_missing()
+        async with AsyncSession(self.controller.async_engine) as session:
+            rows: list[tuple] = list((await session.execute(
+                select(LogTrackSummary.track_id, LogTrackSummary.last_ts, LogTrackMaintenance.track_id)
+                .outerjoin(LogTrackMaintenance, LogTrackMaintenance.track_id == LogTrackSummary.track_id)
+                .where(LogTrackSummary.point_count < self.conf.abandoned_points)
+                .where(or_(LogTrackSummary.last_ts.is_(None), LogTrackSummary.last_ts < cutoff)))).tuples())
+            # an empty track may be an import that is still running, it goes on the next run if it stays empty
+            for track_id, last_ts, seen in rows:
+                if last_ts is None and seen is None:
+                    session.add(LogTrackMaintenance(track_id=track_id))
+            await session.commit()
+        removed: int = 0
+        for track_id, last_ts, seen in rows:
+            if last_ts is not None or seen is not None:
+                removed += await self.delete_track(track_id, "abandoned")
+        return removed
+
+    async def delete_track(self, track_id: str, job: str) -> int:
+        """Delete a track and all of its points, live points batch_size at a time."""
+        async with AsyncSession(self.controller.async_engine) as session:
+            summary: Optional[LogTrackSummary] = await session.get(LogTrackSummary, track_id)
+            bounds: Optional[Bounds] = (None if summary is None or summary.last_ts is None
+                                        else (summary.min_lon, summary.min_lat, summary.max_lon, summary.max_lat))
+        removed: int = 0
+        while True:
+            async with AsyncSession(self.controller.async_engine) as session:
+                batch: list[datetime] = list((await session.execute(
+                    select(LogPoint.ts).where(LogPoint.track_id == track_id).limit(self.conf.batch_size))).scalars())
+                if not batch:
+                    break
+                await session.execute(delete(LogPoint).where(LogPoint.track_id == track_id)
+                                      .where(LogPoint.ts.in_(batch)))
+                await session.commit()
+            removed += len(batch)
+            await self.pause()
+
+        async with AsyncSession(self.controller.async_engine) as session:
+            removed += (await session.execute(select(func.coalesce(func.sum(LogPointArchive.count), 0))
+                                              .where(LogPointArchive.track_id == track_id))).scalar()
+            # LogPoint again for points that arrived while the batches above were deleted
+            for model in (LogPoint, LogPointArchive, LogTrackSummary, LogTrackMaintenance, LogTrackDetails):
+                await session.execute(delete(model).where(model.track_id == track_id))
+            await session.commit()
+        POINTS_REMOVED.labels(job).inc(removed)
+        self.controller.points_removed(track_id, bounds)
+        return removed
+
+    async def compact(self, now: datetime) -> int:
+        """Free pages returned to the filesystem, on sqlite."""
+        if self.controller.dialect == "sqlite":
+            return await self.compact_sqlite()
+        await self.compact_postgresql()
+        return 0
+
+    async def compact_sqlite(self) -> int:
+        freed: int = 0
+        async with self.controller.async_engine.connect() as conn:
+            # pysqlite steps a pragma only once, which frees a single page, a script runs it to the end
+            script = (await conn.get_raw_connection()).driver_connection.executescript
+            if (await conn.exec_driver_sql("PRAGMA auto_vacuum")).scalar() != SQLITE_INCREMENTAL_VACUUM:
+                log("auto_vacuum isn't incremental, free pages aren't returned to the filesystem", logging.DEBUG,
+                    source="maintenance")
+            else:
+                free: int = (await conn.exec_driver_sql("PRAGMA freelist_count")).scalar()
+                remaining: int = min(free, self.conf.vacuum_pages)
+                while remaining > 0:
+                    await script(f"PRAGMA incremental_vacuum({min(remaining, VACUUM_STEP_PAGES)})")
+                    remaining -= VACUUM_STEP_PAGES
+                    await self.pause()
+                freed = free - (await conn.exec_driver_sql("PRAGMA freelist_count")).scalar()
+            if self.conf.analyze:
+                await script(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}; PRAGMA optimize;")
+        return freed
+
+    async def reindex(self, now: datetime) -> int:
+        """Points put back in sqlite's R*Tree, a VACUUM may have renumbered the rowids it's keyed on."""
+        if self.controller.dialect != "sqlite":
+            return 0
+        async with self.controller.async_engine.begin() as conn:
+            return await conn.run_sync(rebuild_spatial_index)
+
+    async def compact_postgresql(self) -> None:
+        async with self.controller.async_engine.connect() as conn:
+            # VACUUM can't run inside a transaction, it doesn't block reads or writes of the table
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            for table in COMPACTED_TABLES:
+                await conn.exec_driver_sql(f"VACUUM (ANALYZE) {table}" if self.conf.analyze else f"VACUUM {table}")
+                await self.pause()
@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+from itertools import count
+from typing import Any, Callable, Optional, TYPE_CHECKING
+
+from backtrack.basic_log import log
+from backtrack.controllers.ingest import LogPair
+from backtrack.storage.importers import PointRow
+from backtrack.storage.models import LogTrackDetails, LogPoint
+
+if TYPE_CHECKING:
+    from backtrack.controllers.controller import BacktrackController
+
+# newline delimited JSON both ways, an import chunk is a single line
+STREAM_LIMIT: int = 1 << 30
+
+# worker -> writer   {"id": 1, "op": "logs", "logs": [[track, point], ...]}
+# writer -> worker   {"id": 1, "result": ...} or {"id": 1, "error": "..."}
+# writer -> workers  {"event": "stored" | "imported" | "archived" | "removed", ...} after every write, to every worker
+
+
+def json_default(value: Any) -> str:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def encode(message: dict) -> bytes:
+    return json.dumps(message, default=json_default, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def encode_logs(logs: list[LogPair]) -> list[list[dict]]:
+    return [[track.model_dump(mode="json", exclude_unset=True), point.model_dump(mode="json")]
+            for track, point in logs]
+
+
+def decode_logs(logs: list[list[dict]]) -> list[LogPair]:
+    return [(LogTrackDetails.model_validate(track), LogPoint.model_validate(point)) for track, point in logs]
+
+
+def decode_rows(rows: list[PointRow]) -> list[PointRow]:
+    for row in rows:
+        row["ts"] = datetime.fromisoformat(row["ts"])
+    return rows
+
+
+class WriterError(Exception):
+    pass
+
+
+class WriterClient:
+    """An HTTP worker's connection to the writer process, calls are multiplexed and writer events are handed
+    to `events`, starting with a "reset" on every (re)connect since events may have been missed."""
+
+    def __init__(self, socket_path: str, events: Callable[[dict], None], connect_timeout: float):
+        self.socket_path = socket_path
+        self.events = events
+        self.connect_timeout = connect_timeout
+        self.ids = count()
+        self.pending: dict[int, asyncio.Future] = {}
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.task: Optional[asyncio.Task] = None
+        self.lock = asyncio.Lock()
+
+    async def connect(self) -> None:
+        async with self.lock:
+            if self.task is not None and not self.task.done():
+                return
+            loop = asyncio.get_running_loop()
+            deadline: float = loop.time() + self.connect_timeout
+            while True:
+                try:
+                    self.reader, self.writer = await asyncio.open_unix_connection(self.socket_path,
+                                                                                  limit=STREAM_LIMIT)
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    # the writer may still be starting up
+                    if loop.time() > deadline:
+                        raise WriterError(f"no writer listening on {self.socket_path}")
+                    await asyncio.sleep(0.1)
+            self.events({"event": "reset"})
+            self.task = asyncio.create_task(self._read())
+
+    async def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    async def call(self, op: str, **args) -> Any:
+        await self.connect()
+        call_id: int = next(self.ids)
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.pending[call_id] = future
+        self.writer.write(encode({"id": call_id, "op": op, **args}))
+        await self.writer.drain()
+        return await future
+
+    async def _read(self) -> None:
+        try:
+            while line := await self.reader.readline():
+                message: dict = json.loads(line)
+                if "event" in message:
+                    self.events(message)
+                    continue
+                future: Optional[asyncio.Future] = self.pending.pop(message["id"], None)
+                if future is None or future.done():
+                    continue
+                if "error" in message:
+                    future.set_exception(WriterError(message["error"]))
+                else:
+                    future.set_result(message.get("result"))
+        finally:
+            # calls in flight when the writer went away fail, the next call reconnects
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(WriterError("writer connection closed"))
+            self.pending.clear()
+
+
+class WriterServer:
+    """Serves the writes of every HTTP worker from the one process that writes to the database."""
+
+    def __init__(self, controller: BacktrackController, socket_path: str):
+        self.controller = controller
+        self.socket_path = socket_path
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.connections: set[asyncio.StreamWriter] = set()
+        self.tasks: set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        if os.path.exists(self.socket_path):
+            # left behind by a writer that did not shut down cleanly
+            os.unlink(self.socket_path)
+        self.server = await asyncio.start_unix_server(self._serve, self.socket_path, limit=STREAM_LIMIT)
+        self.controller.write_observers.append(self.broadcast)
+
+    async def stop(self) -> None:
+        self.controller.write_observers.remove(self.broadcast)
+        if self.server is not None:
+            self.server.close()
+            for connection in list(self.connections):
+                connection.close()
+            await self.server.wait_closed()
+            self.server = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def broadcast(self, event: dict) -> None:
+        line: bytes = encode(event)
+        for connection in list(self.connections):
+            if connection.is_closing():
+                self.connections.discard(connection)
+            else:
+                connection.write(line)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections.add(writer)
+        try:
+            while line := await reader.readline():
+                # calls run concurrently, so single points from many workers meet in one group commit
+                task: asyncio.Task = asyncio.create_task(self._call(json.loads(line), writer))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+        except ConnectionError:
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    async def _call(self, request: dict, writer: asyncio.StreamWriter) -> None:
+        try:
+            reply: dict = {"id": request["id"], "result": await self.dispatch(request)}
+        except Exception as e:
+            log(f"writer call {request.get('op')} failed: {e!r}", logging.ERROR, source="writer")
+            reply = {"id": request["id"], "error": repr(e)}
+        if not writer.is_closing():
+            writer.write(encode(reply))
+
+    async def dispatch(self, request: dict) -> Any:
+        op: str = request["op"]
+        if op == "log":
+            track, point = decode_logs([request["log"]])[0]
+            return await self.controller.store_log(track, point)
+        if op == "logs":
+            return await self.controller.store_logs(decode_logs(request["logs"]))
+        if op == "import_track":
+            return await self.controller.import_track(request["key"], request["track_id"])
+        if op == "import_chunk":
+            return await self.controller.import_chunk(decode_rows(request["rows"]))
+        if op == "imported":
+            return await self.controller.imported(request["track_id"], tuple(request["bounds"]), request["count"])
+        if op == "reserve":
+            return await self.controller.get_next_squid()
+        if op == "maintain":
+            return await self.controller.run_maintenance(request["jobs"])
+        raise ValueError(f"unknown writer op {op}")
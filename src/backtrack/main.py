@@ -1,35 +1,84 @@
 from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Optional
 
 from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 
-from backtrack.config import app_conf
-from backtrack.routes.keys import keys_router
-from backtrack.routes.pages import pages_router
-from backtrack.routes.tracks import tracks_router
-from backtrack.storage.db import create_db_and_tables
+from backtrack.config import CONFIG_PATH, load_config
+from backtrack.config.config import AppConfig
 
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Load the ML model
-    create_db_and_tables()
-    yield
+def create_app(conf_fi: Path = CONFIG_PATH, app_conf: Optional[AppConfig] = None) -> FastAPI:
+    """
+    Reads the config, or takes one already read, and builds the engine, controller and routes from it. Each app
+    gets its own engine and controller in app.state, nothing is shared with an app built before.
+        uvicorn backtrack.main:create_app --factory
+    """
+    if app_conf is None:
+        app_conf = load_config(conf_fi)
 
+    from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.staticfiles import StaticFiles
 
-backtrack_app = FastAPI(lifespan=lifespan)
+    from backtrack.basic_log import set_log_level
+    from backtrack.controllers import create_controller
+    from backtrack.controllers.controller import BacktrackController
+    from backtrack.metrics import RequestMetrics, ControllerCollector, registry
+    from backtrack.routes.keys import keys_router
+    from backtrack.routes.metrics import metrics_router
+    from backtrack.routes.pages import pages_router
+    from backtrack.routes.tracks import tracks_router
+    from backtrack.storage.db import create_db_and_tables
 
-backtrack_app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"]
-)
+    set_log_level(app_conf.general.log_level)
+    controller: BacktrackController = create_controller(app_conf)
 
-backtrack_app.mount("/static", StaticFiles(directory=app_conf.general.static_dir), name="static")
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        if not app_conf.writer.enabled:
+            # otherwise the writer process owns the schema
+            await create_db_and_tables(controller.async_engine)
+        collector: ControllerCollector = ControllerCollector(controller)
+        registry.register(collector)
+        await controller.start()
+        try:
+            yield
+        finally:
+            await controller.stop()
+            registry.unregister(collector)
+            await controller.async_engine.dispose()
 
-backtrack_app.include_router(tracks_router)
-backtrack_app.include_router(pages_router)
-backtrack_app.include_router(keys_router)
\ No newline at end of file
+    app = FastAPI(lifespan=lifespan)
+    app.state.app_conf = app_conf
+    app.state.controller = controller
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"]
+    )
+    app.add_middleware(RequestMetrics)
+
+    app.mount("/static", StaticFiles(directory=app_conf.general.static_dir), name="static")
+
+    app.include_router(tracks_router)
+    app.include_router(pages_router)
+    app.include_router(keys_router)
+    app.include_router(metrics_router)
+    return app
+
+
+def __getattr__(name: str):
+    # fastapi run backtrack/main.py, built from ./resources/config.yaml when first looked up
+    if name == "backtrack_app":
+        app: FastAPI = create_app()
+        globals()["backtrack_app"] = app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> list[str]:
+    # fastapi run finds the app by looking through the module's attributes
+    return sorted(set(globals()) | {"backtrack_app"})
@@ -0,0 +1,43 @@
+"""
+Runs maintenance jobs once, from src/:
+    python -m backtrack.maintenance                    every job the config allows
+    python -m backtrack.maintenance decimate compact
+    python -m backtrack.maintenance reindex            after any VACUUM of a sqlite database, never run otherwise
+With writer.enabled the writer process runs them and tells the HTTP workers what was removed. Otherwise they run
+here, next to a stopped app or with maintenance.enabled off, since a running app's caches don't hear about them.
+"""
+import argparse
+import asyncio
+
+from backtrack.basic_log import set_log_level
+from backtrack.config import load_config
+from backtrack.config.config import AppConfig
+from backtrack.controllers import create_controller
+from backtrack.controllers.controller import BacktrackController
+from backtrack.controllers.writer import WriterError
+from backtrack.storage.db import create_db_and_tables
+
+
+async def run(app_conf: AppConfig, jobs: list[str]) -> dict[str, int]:
+    set_log_level(app_conf.general.log_level)
+    controller: BacktrackController = create_controller(app_conf)
+    try:
+        if controller.writer is None:
+            await create_db_and_tables(controller.async_engine)
+        return await controller.run_maintenance(jobs or None)
+    finally:
+        if controller.writer is not None:
+            await controller.writer.close()
+        await controller.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m backtrack.maintenance")
+    parser.add_argument("jobs", nargs="*", help="of archive, decimate, quota, abandoned, compact and reindex")
+    args = parser.parse_args()
+    try:
+        results: dict[str, int] = asyncio.run(run(load_config(), args.jobs))
+    except (ValueError, WriterError) as e:
+        parser.error(str(e))
+    for job, count in results.items():
+        print(f"{job}: {count}")
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import logging
+import time
+from typing import Callable, Iterator, TypeVar, TYPE_CHECKING
+
+from prometheus_client import CollectorRegistry, Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+from prometheus_client.registry import Collector
+from sqlalchemy import Engine, event
+
+from backtrack.basic_log import log, enabled
+
+if TYPE_CHECKING:
+    from backtrack.controllers.controller import BacktrackController
+
+T = TypeVar("T")
+
+# served by /metrics, kept apart from prometheus_client's default process collectors
+registry: CollectorRegistry = CollectorRegistry()
+
+REQUEST_SECONDS: Histogram = Histogram("backtrack_request_seconds", "HTTP request latency by route template",
+                                       ["method", "route", "status"], registry=registry)
+QUERY_SECONDS: Histogram = Histogram("backtrack_db_query_seconds", "Database statement execution time",
+                                     ["operation"], registry=registry,
+                                     buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 10))
+SERIALIZE_SECONDS: Histogram = Histogram("backtrack_serialize_seconds", "Time to render a whole track",
+                                         ["format"], registry=registry)
+POINTS_STORED: Counter = Counter("backtrack_points_stored", "Points written, rate() gives points per second",
+                                 ["source"], registry=registry)
+POINTS_DROPPED: Counter = Counter("backtrack_points_dropped", "Queued points the database rejected",
+                                  registry=registry)
+POINTS_DUPLICATE: Counter = Counter("backtrack_points_duplicate", "Resent points dropped, by where they were caught",
+                                    ["source"], registry=registry)
+POINTS_REMOVED: Counter = Counter("backtrack_points_removed", "Points decimated or deleted by maintenance jobs",
+                                  ["job"], registry=registry)
+MAINTENANCE_SECONDS: Histogram = Histogram("backtrack_maintenance_seconds", "Run time of a maintenance job", ["job"],
+                                           registry=registry, buckets=(.1, .5, 1, 5, 10, 30, 60, 300, 900, 3600))
+
+
+def timed(histogram: Histogram, fn: Callable[..., T], *args) -> T:
+    start: float = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        histogram.observe(time.perf_counter() - start)
+
+
+class RequestMetrics:
+    """ASGI middleware observing REQUEST_SECONDS, labelled with the matched route's path template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start: float = time.perf_counter()
+        status: list[int] = [500]
+
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            # streamed responses are observed once their last chunk is sent
+            route = scope.get("route")
+            REQUEST_SECONDS.labels(scope["method"], getattr(route, "path", "unmatched"),
+                                   str(status[0])).observe(time.perf_counter() - start)
+
+
+def instrument_engine(engine: Engine, slow_query_ms: float) -> None:
+    """Time every statement into QUERY_SECONDS, statements are logged at debug or as warnings past slow_query_ms."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed: float = time.perf_counter() - conn.info["query_start"].pop()
+        operation: str = statement.split(None, 1)[0].upper() if statement else ""
+        QUERY_SECONDS.labels(operation).observe(elapsed)
+        level: int = logging.WARNING if elapsed * 1000 >= slow_query_ms else logging.DEBUG
+        if enabled(level):
+            log("query", level, source="db", operation=operation, ms=round(elapsed * 1000, 3),
+                executemany=executemany, statement=" ".join(statement.split()))
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        starts: list[float] = context.connection.info.get("query_start", []) if context.connection else []
+        if starts:
+            starts.pop()
+
+
+class ControllerCollector(Collector):
+    """Gauges and counters the controller already keeps, read when /metrics is scraped."""
+
+    def __init__(self, controller: BacktrackController):
+        self.controller = controller
+
+    def collect(self) -> Iterator[Metric]:
+        hits = CounterMetricFamily("backtrack_cache_hits", "Cache lookups that found an entry", labels=["cache"])
+        misses = CounterMetricFamily("backtrack_cache_misses", "Cache lookups that found nothing", labels=["cache"])
+        ratio = GaugeMetricFamily("backtrack_cache_hit_ratio", "Hits over lookups since start", labels=["cache"])
+        entries = GaugeMetricFamily("backtrack_cache_entries", "Entries held", labels=["cache"])
+        for name, cache, size in (("track", self.controller.track_cache, len(self.controller.track_cache.entries)),
+                                  ("tile", self.controller.tile_cache, len(self.controller.tile_cache.tiles))):
+            hits.add_metric([name], cache.hits)
+            misses.add_metric([name], cache.misses)
+            ratio.add_metric([name], cache.hits / (cache.hits + cache.misses) if cache.hits + cache.misses else 0)
+            entries.add_metric([name], size)
+        yield from (hits, misses, ratio, entries)
+        yield GaugeMetricFamily("backtrack_cache_bytes", "Bytes of rendered tracks held by the track cache",
+                                value=self.controller.track_cache.size)
+
+        queue = self.controller.ingest_queue
+        yield GaugeMetricFamily("backtrack_ingest_queue_depth", "Points waiting for a group commit",
+                                value=0 if queue is None else queue.depth())
+        yield GaugeMetricFamily("backtrack_live_subscribers", "Open live track streams",
+                                value=sum(len(queues) for queues in self.controller.live_hub.subscribers.values()))
@@ -0,0 +1,13 @@
+from fastapi import Request
+
+from backtrack.config.config import AppConfig
+from backtrack.controllers.controller import BacktrackController
+
+
+# the app create_app built keeps its config and controller in app.state, routes get them with Depends
+def get_controller(request: Request) -> BacktrackController:
+    return request.app.state.controller
+
+
+def get_app_conf(request: Request) -> AppConfig:
+    return request.app.state.app_conf
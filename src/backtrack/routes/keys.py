@@ -1,16 +1,18 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 from fastapi.responses import PlainTextResponse
 
-from backtrack.controllers import controller
+from backtrack.controllers.controller import BacktrackController
+from backtrack.routes import get_controller
 
 keys_router: APIRouter = APIRouter()
 
 
 @keys_router.get("/profile/{key}", response_class=PlainTextResponse)
-async def profile(key: str, track_id: str):
+async def profile(key: str, track_id: str,
+                  controller: BacktrackController = Depends(get_controller)):
     return controller.make_profile(key, track_id)
 
 @keys_router.get("/next-sqid")
-async def get_sqid():
+async def get_sqid(controller: BacktrackController = Depends(get_controller)):
     new_id: str = await controller.get_next_squid()
     return {"key": new_id}
@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from starlette.responses import Response
+
+from backtrack.metrics import registry
+
+metrics_router: APIRouter = APIRouter()
+
+
+@metrics_router.get("/metrics")
+async def metrics() -> Response:
+    return Response(content=generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
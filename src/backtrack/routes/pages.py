@@ -1,16 +1,26 @@
 from datetime import datetime, timezone
-from typing import Optional
+from functools import cache
+from typing import Optional, TYPE_CHECKING
 
-from fastapi import Request, APIRouter
+from fastapi import Request, APIRouter, Depends
 from fastapi.responses import PlainTextResponse, HTMLResponse
-from starlette.templating import Jinja2Templates
-
-from backtrack.config import app_conf
-from backtrack.controllers import controller
+from backtrack.config.config import AppConfig
+from backtrack.controllers.controller import BacktrackController
+from backtrack.routes import get_controller, get_app_conf
 from backtrack.storage.models import LogTrackDetails
 
+if TYPE_CHECKING:
+    from starlette.templating import Jinja2Templates
+
 pages_router: APIRouter = APIRouter()
-templates = Jinja2Templates(directory=app_conf.general.template_dir)
+
+
+@cache
+def templates(template_dir: str) -> "Jinja2Templates":
+    # jinja2 is only imported once a page is rendered
+    from starlette.templating import Jinja2Templates
+
+    return Jinja2Templates(directory=template_dir)
 
 
 @pages_router.get('/robots.txt', response_class=PlainTextResponse)
@@ -20,16 +30,21 @@ def robots():
 
 
 @pages_router.get("/", response_class=HTMLResponse)
-async def home_page(request: Request, key: Optional[str] = None):
+async def home_page(request: Request, key: Optional[str] = None,
+                    controller: BacktrackController = Depends(get_controller),
+                    app_conf: AppConfig = Depends(get_app_conf)):
     new_key: str = key if key is not None else await controller.get_next_squid()
-    return templates.TemplateResponse(
+    return templates(app_conf.general.template_dir).TemplateResponse(
         request=request, name="html/home.jinja", context={"user_default": new_key,
                                                           "track_default": f"track_{datetime.now(tz=timezone.utc).strftime('%Y%m%d%H%M%S')}"}
     )
 
 
 @pages_router.get("/map.html", response_class=HTMLResponse)
-async def map_page(request: Request, key: Optional[str] = None):
+async def map_page(request: Request, key: Optional[str] = None,
+                   controller: BacktrackController = Depends(get_controller),
+                   app_conf: AppConfig = Depends(get_app_conf)):
     tracks: list[LogTrackDetails] = await controller.get_tracks(key)
-    return templates.TemplateResponse(request=request, name="html/map.jinja",
-                                      context={"tracks": tracks, "key": key, "hostname": app_conf.general.hostname})
+    return templates(app_conf.general.template_dir).TemplateResponse(
+        request=request, name="html/map.jinja",
+        context={"tracks": tracks, "key": key, "hostname": app_conf.general.hostname})
@@ -1,14 +1,64 @@
-from typing import Optional
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from pathlib import PurePath
+from typing import Optional, AsyncIterator
 
-from fastapi import Request, HTTPException, APIRouter
-from starlette.responses import Response
+from fastapi import Request, HTTPException, APIRouter, Depends, UploadFile, Query
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response, StreamingResponse
 
-from backtrack.controllers import controller
+from backtrack.controllers.cache import CacheKey, TrackVersion
+from backtrack.controllers.controller import BacktrackController
 from backtrack.controllers.TrackFormat import TrackFormat
+from backtrack.metrics import SERIALIZE_SECONDS, timed
+from backtrack.routes import get_controller
+from backtrack.storage.archive import PointArrays
+from backtrack.storage.compact_writer import write_polyline, write_binary
+from backtrack.storage.compression import accepted_encoding, compress, MIN_COMPRESS_BYTES
+from backtrack.storage.filters import BBox, PointFilter
+from backtrack.storage.geojson_writer import write_geojson
+from backtrack.storage.importers import PARSERS, parse_points
 from backtrack.storage.models import LogTrackDetails, LogItem, LogPoint, LogTrack
+from backtrack.storage.streaming import stream_geojson, stream_gpx
 
 tracks_router: APIRouter = APIRouter()
 
+# points a single /points search returns at most, every one is a model and a feature
+MAX_SEARCH_POINTS: int = 100000
+
+
+@dataclass
+class PointQuery:
+    bbox: Optional[str] = None
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+
+    def point_filter(self, since: Optional[datetime] = None) -> PointFilter:
+        try:
+            bbox: Optional[BBox] = None if self.bbox is None else BBox.parse(self.bbox)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return PointFilter(since=since, start=None if self.start is None else as_utc(self.start),
+                           end=None if self.end is None else as_utc(self.end), bbox=bbox)
+
+
+@dataclass
+class TrackQuery(PointQuery):
+    stream: bool = False
+    since: Optional[datetime] = None
+    tolerance: Optional[float] = None
+    zoom: Optional[float] = None
+
+    def simplified(self) -> bool:
+        return self.tolerance is not None or self.zoom is not None
+
+    def variant(self) -> str:
+        # everything but stream changes the rendered track
+        return f"{self.since}|{self.tolerance}|{self.zoom}|{self.bbox}|{self.start}|{self.end}"
+
 
 @tracks_router.post("/log")
 async def print_log(request: Request):
@@ -17,7 +67,7 @@ async def print_log(request: Request):
 
 
 @tracks_router.post("/track")
-async def store_log(log_item: LogItem):
+async def store_log(log_item: LogItem, controller: BacktrackController = Depends(get_controller)):
     # print(log_item)
     track: LogTrackDetails = LogTrackDetails.from_item(log_item)
     point: LogPoint = LogPoint.from_item(log_item)
@@ -27,8 +77,37 @@ async def store_log(log_item: LogItem):
     await controller.store_log(track, point)  # print(f"point for {log_item.default_track_id()} saved")
 
 
+@tracks_router.post("/track/batch")
+async def store_logs(log_items: list[LogItem], controller: BacktrackController = Depends(get_controller)):
+    # resent points are skipped, only the new ones are counted
+    stored: int = await controller.store_logs([(LogTrackDetails.from_item(i), LogPoint.from_item(i))
+                                               for i in log_items])
+    return {"stored": stored}
+
+
+@tracks_router.post("/{key}/track/{track_id}/import")
+async def import_track(key: str, track_id: str, file: UploadFile, fmt: Optional[str] = None,
+                       controller: BacktrackController = Depends(get_controller)):
+    # GPSLogger's local gpx/csv logs, or geojson points, format from ?fmt= or the file extension
+    import_fmt: str = (fmt or PurePath(file.filename or "").suffix.lstrip(".")).lower()
+    if import_fmt not in PARSERS:
+        raise HTTPException(status_code=400,
+                            detail=f"unsupported import format {import_fmt!r}, expected one of {', '.join(PARSERS)}")
+    try:
+        parsed, stored = await controller.import_points(key, track_id, parse_points(import_fmt, file.file, track_id))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"parsed": parsed, "stored": stored}
+
+
 @tracks_router.get("/tracks")
-async def get_tracks(key: str):
+async def get_tracks(key: str, stats: bool = False, controller: BacktrackController = Depends(get_controller)):
+    if stats:
+        summaries = await controller.get_track_summaries(key)
+        if not summaries:
+            raise HTTPException(status_code=404, detail=f"{key} not found")
+        return [s.stats() for s in summaries]
+
     tracks = await controller.get_tracks(key)
     if not tracks:
         raise HTTPException(status_code=404, detail=f"{key} not found")
@@ -36,20 +115,216 @@ async def get_tracks(key: str):
 
 
 @tracks_router.get("/track")
-async def get_track_query(key: str, track_id: str, fmt: str = "json"):
-    return await get_track(key, track_id, fmt)
+async def get_track_query(request: Request, key: str, track_id: str, fmt: str = "json",
+                          query: TrackQuery = Depends(), controller: BacktrackController = Depends(get_controller)):
+    return await get_track(request, controller, key, track_id, fmt, query)
+
+
+@tracks_router.get("/{key}/track/{track_id}/live")
+async def live_track(request: Request, key: str, track_id: str,
+                     controller: BacktrackController = Depends(get_controller)) -> StreamingResponse:
+    if await controller.get_track_details(key, track_id) is None:
+        raise HTTPException(status_code=404, detail=f"{key} {track_id} not found")
+
+    return StreamingResponse(live_events(request, controller, track_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def live_events(request: Request, controller: BacktrackController, track_id: str, keepalive: float = 15):
+    queue: asyncio.Queue[Optional[str]] = controller.live_hub.subscribe(track_id)
+    try:
+        yield "retry: 5000\n\n"
+        while not await request.is_disconnected():
+            try:
+                feature: Optional[str] = await asyncio.wait_for(queue.get(), keepalive)
+                if feature is None:
+                    # dropped for falling behind, the client refetches the track and reconnects
+                    yield "event: reset\ndata: {}\n\n"
+                    return
+                yield f"event: point\ndata: {feature}\n\n"
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+    finally:
+        controller.live_hub.unsubscribe(track_id, queue)
 
 
 @tracks_router.get("/{key}/track/{track_id}/{fmt}")
-async def get_track_path(key: str, track_id: str, fmt: str) -> Response:
-    return await get_track(key, track_id, fmt)
+async def get_track_path(request: Request, key: str, track_id: str, fmt: str,
+                         query: TrackQuery = Depends(),
+                         controller: BacktrackController = Depends(get_controller)) -> Response:
+    return await get_track(request, controller, key, track_id, fmt, query)
 
 
-async def get_track(key: str, track_id: str, fmt: str) -> Response:
+async def get_track(request: Request, controller: BacktrackController, key: str, track_id: str, fmt: str,
+                    query: TrackQuery) -> Response:
     track_fmt: TrackFormat = TrackFormat[fmt]
-    track: Optional[LogTrack] = controller.get_track(key, track_id)
-    if not track:
+    since: Optional[datetime] = None if query.since is None else as_utc(query.since)
+    point_filter: PointFilter = query.point_filter(since)
+
+    # streamed tracks are sent as they are
+    encoding: Optional[str] = accepted_encoding(request.headers.get("accept-encoding"))
+    if query.stream and not query.simplified() and not track_fmt.compact():
+        encoding = None
+    headers: dict[str, str] = {"Vary": "Accept-Encoding"}
+    cache_key: Optional[CacheKey] = None
+    version: Optional[TrackVersion] = await controller.get_track_version(track_id)
+    if version is not None:
+        headers = cache_headers(key, track_id, track_fmt, version, query.variant(), encoding)
+        if not_modified(request, headers["ETag"], version, since):
+            return Response(status_code=304, headers=headers)
+
+        cache_key = (key, track_id, track_fmt.value, version, query.variant())
+        if encoding is not None:
+            cached_encoded: Optional[bytes] = controller.track_cache.get(encoded_key(cache_key, encoding))
+            if cached_encoded is not None:
+                return Response(content=cached_encoded, media_type=track_fmt.content_type(),
+                                headers={**headers, "Content-Encoding": encoding})
+        cached: Optional[bytes] = controller.track_cache.get(cache_key)
+        if cached is not None:
+            return await track_response(controller, cached, track_fmt, cache_key, encoding, headers)
+
+    # simplified tracks are small, they are always rendered in one piece
+    if query.stream and not query.simplified() and not track_fmt.compact():
+        return await stream_track(controller, key, track_id, track_fmt, point_filter, headers)
+
+    if track_fmt.compact():
+        payload: bytes = await render_compact(controller, key, track_id, track_fmt, query, point_filter)
+        if cache_key is not None:
+            controller.track_cache.put(cache_key, payload)
+        return await track_response(controller, payload, track_fmt, cache_key, encoding, headers)
+
+    # serializing a long track is CPU bound, keep it off the event loop
+    track_str: str
+    if not query.simplified() and track_fmt in (TrackFormat.geojson, TrackFormat.json):
+        found = await controller.get_track_coordinates(key, track_id, point_filter)
+        if found is None:
+            raise HTTPException(status_code=404, detail=f"{key} {track_id} not found")
+        track_str = await run_in_threadpool(timed, SERIALIZE_SECONDS.labels(track_fmt.value), write_geojson, *found)
+    else:
+        track: Optional[LogTrack]
+        if query.simplified():
+            track = await controller.get_simplified_track(key, track_id, query.tolerance, query.zoom, point_filter)
+        else:
+            track = await controller.get_track(key, track_id, point_filter)
+        if not track:
+            raise HTTPException(status_code=404, detail=f"{key} {track_id} not found")
+        track_str = await run_in_threadpool(timed, SERIALIZE_SECONDS.labels(track_fmt.value),
+                                            track.get_track_fmt_string, track_fmt)
+    payload: bytes = track_str.encode("utf-8")
+    if cache_key is not None:
+        controller.track_cache.put(cache_key, payload)
+    return await track_response(controller, payload, track_fmt, cache_key, encoding, headers)
+
+
+async def render_compact(controller: BacktrackController, key: str, track_id: str, track_fmt: TrackFormat,
+                         query: TrackQuery, point_filter: PointFilter) -> bytes:
+    arrays: PointArrays
+    if query.simplified():
+        track: Optional[LogTrack] = await controller.get_simplified_track(key, track_id, query.tolerance, query.zoom,
+                                                                          point_filter)
+        if not track:
+            raise HTTPException(status_code=404, detail=f"{key} {track_id} not found")
+        arrays = PointArrays.from_points(track.points)
+    else:
+        found: Optional[tuple[LogTrackDetails, PointArrays]] = await controller.get_track_points(key, track_id,
+                                                                                                point_filter)
+        if found is None:
+            raise HTTPException(status_code=404, detail=f"{key} {track_id} not found")
+        arrays = found[1]
+    if track_fmt == TrackFormat.polyline:
+        polyline: str = await run_in_threadpool(timed, SERIALIZE_SECONDS.labels(track_fmt.value), write_polyline,
+                                                arrays)
+        return polyline.encode("ascii")
+    return await run_in_threadpool(timed, SERIALIZE_SECONDS.labels(track_fmt.value), write_binary, arrays)
+
+
+async def track_response(controller: BacktrackController, payload: bytes, track_fmt: TrackFormat,
+                         cache_key: Optional[CacheKey], encoding: Optional[str], headers: dict[str, str]) -> Response:
+    # the encoded bytes are cached next to the plain ones, so each encoding of a track version is compressed once
+    if encoding is None or len(payload) < MIN_COMPRESS_BYTES:
+        return Response(content=payload, media_type=track_fmt.content_type(), headers=headers)
+    encoded: bytes = await run_in_threadpool(compress, payload, encoding)
+    if cache_key is not None:
+        controller.track_cache.put(encoded_key(cache_key, encoding), encoded)
+    return Response(content=encoded, media_type=track_fmt.content_type(),
+                    headers={**headers, "Content-Encoding": encoding})
+
+
+def encoded_key(cache_key: CacheKey, encoding: str) -> CacheKey:
+    key, track_id, fmt, version, variant = cache_key
+    return key, track_id, f"{fmt}+{encoding}", version, variant
+
+
+async def stream_track(controller: BacktrackController, key: str, track_id: str, track_fmt: TrackFormat,
+                       point_filter: PointFilter, headers: dict[str, str]) -> StreamingResponse:
+    details: Optional[LogTrackDetails] = await controller.get_track_details(key, track_id)
+    if details is None:
         raise HTTPException(status_code=404, detail=f"{key} {track_id} not found")
 
-    track_str = track.get_track_fmt_string(track_fmt)
-    return Response(content=track_str, media_type=track_fmt.content_type())
+    chunks: AsyncIterator[str]
+    if track_fmt == TrackFormat.gpx:
+        chunks = stream_gpx(details, controller.stream_points(track_id, point_filter))
+    else:
+        chunks = stream_geojson(details, controller.stream_coordinates(track_id, point_filter),
+                                await controller.get_latest_point(track_id, point_filter))
+    return StreamingResponse(chunks, media_type=track_fmt.content_type(), headers=headers)
+
+
+@tracks_router.get("/{key}/points")
+async def search_points(key: str, query: PointQuery = Depends(),
+                        limit: int = Query(10000, ge=1, le=MAX_SEARCH_POINTS),
+                        controller: BacktrackController = Depends(get_controller)) -> Response:
+    import geojson
+
+    from backtrack.storage.encoders import DateTimeGeojsonEncoder
+
+    points: list[LogPoint] = await controller.search_points(key, query.point_filter(), limit)
+    collection = geojson.FeatureCollection([p.geojson_feature() for p in points])
+    return Response(content=geojson.dumps(collection, cls=DateTimeGeojsonEncoder), media_type="application/json")
+
+
+@tracks_router.get("/{key}/tiles/{z}/{x}/{y}.mvt")
+async def get_tile(key: str, z: int, x: int, y: int,
+                   controller: BacktrackController = Depends(get_controller)) -> Response:
+    if not 0 <= z <= 24 or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        raise HTTPException(status_code=404, detail=f"no tile {z}/{x}/{y}")
+    tile: bytes = await controller.get_tile(key, z, x, y)
+    return Response(content=tile, media_type="application/vnd.mapbox-vector-tile")
+
+
+def as_utc(ts: datetime) -> datetime:
+    return ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+
+
+def cache_headers(key: str, track_id: str, track_fmt: TrackFormat, version: TrackVersion, variant: str,
+                  encoding: Optional[str] = None) -> dict[str, str]:
+    # late, imported and removed points don't move the latest ts, the write version covers them
+    tag: str = (f"{key}/{track_id}/{track_fmt.value}/{version.latest.isoformat()}/{version.version}/"
+                f"{version.changed.isoformat()}/{variant}/{encoding}")
+    latest: datetime = version.latest
+    return {
+        "ETag": f'"{hashlib.md5(tag.encode()).hexdigest()}"',
+        "Last-Modified": format_datetime(version.changed, usegmt=True),
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+        # pass back as ?since= to only fetch newer points
+        "X-Backtrack-Cursor": latest.isoformat(),
+    }
+
+
+def not_modified(request: Request, etag: str, version: TrackVersion, since: Optional[datetime]) -> bool:
+    if since is not None and version.latest <= since:
+        return True
+
+    if_none_match: Optional[str] = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]
+
+    if_modified_since: Optional[str] = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return version.changed.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+
+    return False
@@ -1,10 +1,36 @@
-from sqlalchemy import Engine, create_engine
+from sqlalchemy import make_url, URL, event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
 
-sqlite_file_name = "database.db"
-sqlite_url = f"sqlite:///{sqlite_file_name}"
+from backtrack.config.config import DatabaseConfig, WriterConfig
+from backtrack.metrics import instrument_engine
+from backtrack.storage.dialects import ASYNC_DRIVERS, insert_for
+
+
+def create_engine(database_conf: DatabaseConfig, writer_conf: WriterConfig) -> AsyncEngine:
+    database_url: URL = make_url(database_conf.url)
+    insert_for(database_url.get_backend_name())
+    if database_url.drivername in ASYNC_DRIVERS:
+        database_url = database_url.set(
+            drivername=f"{database_url.drivername}+{ASYNC_DRIVERS[database_url.drivername]}")
+
+    engine: AsyncEngine = create_async_engine(database_url, pool_size=database_conf.pool_size,
+                                              max_overflow=database_conf.max_overflow,
+                                              pool_timeout=database_conf.pool_timeout,
+                                              pool_pre_ping=database_conf.pool_pre_ping)
+    instrument_engine(engine.sync_engine, database_conf.slow_query_ms)
+
+    if engine.dialect.name == "sqlite":
+        sqlite_pragmas: dict[str, object] = dict(database_conf.sqlite_pragmas)
+        if writer_conf.enabled:
+            # HTTP workers only read, every write goes through the writer process
+            sqlite_pragmas["query_only"] = "on"
+
+        @event.listens_for(engine.sync_engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in sqlite_pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
+
+    return engine
 
-connect_args = {"check_same_thread": True}
-engine: Engine = create_engine(sqlite_url, echo=True, future=True, connect_args=connect_args)
-async_sqlite_url = f"sqlite+aiosqlite:///{sqlite_file_name}"
-async_engine: AsyncEngine = create_async_engine(async_sqlite_url, echo=True, future=True)
@@ -0,0 +1,144 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+from backtrack.storage.filters import PointFilter, db_ts
+from backtrack.storage.models import LogPoint, LogPointArchive
+
+# lat/lon are stored as int32 in 1e-7 degree steps, about a centimeter
+COORD_SCALE: float = 1e7
+# timestamps are an int32 millisecond delta from the previous point, chunk start_ts is the base
+MAX_DELTA_MS: int = np.iinfo(np.int32).max
+EXTRA_FIELDS: tuple[str, ...] = ("altitude", "speed_kph", "direction", "distance", "battery", "accuracy")
+
+
+@dataclass
+class PointArrays:
+    """Column arrays of a track's points in ascending ts order, extras are NaN where missing."""
+    ts: np.ndarray
+    lat: np.ndarray
+    lon: np.ndarray
+    extras: dict[str, np.ndarray] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    @staticmethod
+    def empty() -> "PointArrays":
+        return PointArrays(np.empty(0, dtype="datetime64[ms]"), np.empty(0), np.empty(0))
+
+    @staticmethod
+    def from_points(points: list[LogPoint]) -> "PointArrays":
+        points = sorted(points, key=lambda p: p.ts)
+        return PointArrays(np.array([db_ts(p.ts) for p in points], dtype="datetime64[ms]"),
+                           np.array([p.lat for p in points], dtype=np.float64),
+                           np.array([p.lon for p in points], dtype=np.float64),
+                           {name: np.array([getattr(p, name) for p in points], dtype=np.float64)
+                            for name in EXTRA_FIELDS})
+
+    @staticmethod
+    def concat(parts: list["PointArrays"]) -> "PointArrays":
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return PointArrays.empty()
+        extras: dict[str, np.ndarray] = {}
+        for name in set(name for p in parts for name in p.extras):
+            extras[name] = np.concatenate([p.extras.get(name, np.full(len(p), np.nan)) for p in parts])
+        return PointArrays(np.concatenate([p.ts for p in parts]), np.concatenate([p.lat for p in parts]),
+                           np.concatenate([p.lon for p in parts]), extras)
+
+    def take(self, index: np.ndarray) -> "PointArrays":
+        return PointArrays(self.ts[index], self.lat[index], self.lon[index],
+                           {name: values[index] for name, values in self.extras.items()})
+
+    def ordered(self) -> "PointArrays":
+        return self.take(np.argsort(self.ts, kind="stable"))
+
+    def deduplicated(self) -> "PointArrays":
+        # of ordered arrays, the first point of each timestamp wins like on insert
+        if not len(self):
+            return self
+        return self.take(np.concatenate([[True], np.diff(self.ts) != np.timedelta64(0)]))
+
+    def matching(self, point_filter: PointFilter) -> np.ndarray:
+        mask: np.ndarray = np.ones(len(self), dtype=bool)
+        if point_filter.since is not None:
+            mask &= self.ts > np.datetime64(db_ts(point_filter.since), "ms")
+        if point_filter.start is not None:
+            mask &= self.ts >= np.datetime64(db_ts(point_filter.start), "ms")
+        if point_filter.end is not None:
+            mask &= self.ts <= np.datetime64(db_ts(point_filter.end), "ms")
+        if point_filter.bbox is not None:
+            box = point_filter.bbox
+            mask &= (self.lon >= box.min_lon) & (self.lon <= box.max_lon)
+            mask &= (self.lat >= box.min_lat) & (self.lat <= box.max_lat)
+        return mask
+
+    def lonlat(self) -> np.ndarray:
+        return np.column_stack([self.lon, self.lat])
+
+    def coordinate_rows(self) -> list[tuple[datetime, float, float, Optional[float]]]:
+        """(ts, lon, lat, altitude) tuples newest first."""
+        altitude: np.ndarray = self.extras.get("altitude", np.full(len(self), np.nan))
+        return list(zip(self.ts[::-1].astype("datetime64[us]").astype(object).tolist(), self.lon[::-1].tolist(),
+                        self.lat[::-1].tolist(), [None if np.isnan(v) else v for v in altitude[::-1].tolist()]))
+
+    def to_points(self, track_id: str) -> list[LogPoint]:
+        """LogPoints newest first, the order the stored points are read in."""
+        ts: list[datetime] = self.ts[::-1].astype("datetime64[us]").astype(object).tolist()
+        columns: dict[str, list[Optional[float]]] = {
+            name: [None if np.isnan(v) else v for v in values[::-1].tolist()]
+            for name, values in self.extras.items()}
+        return [LogPoint(track_id=track_id, ts=t, lat=lat, lon=lon,
+                         **{name: values[i] for name, values in columns.items()})
+                for i, (t, lat, lon) in enumerate(zip(ts, self.lat[::-1].tolist(), self.lon[::-1].tolist()))]
+
+
+def pack(track_id: str, arrays: PointArrays, chunk_size: int, first_chunk: int = 0) -> list[LogPointArchive]:
+    """Split ascending point arrays into archive chunks of at most chunk_size points."""
+    ms: np.ndarray = arrays.ts.astype("datetime64[ms]").astype(np.int64)
+    # a gap too large for an int32 delta starts a new chunk
+    breaks: list[int] = [int(i) + 1 for i in np.nonzero(np.diff(ms) > MAX_DELTA_MS)[0]]
+    bounds: list[int] = sorted(set(range(0, len(ms), chunk_size)) | set(breaks)) + [len(ms)]
+
+    chunks: list[LogPointArchive] = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        part: PointArrays = arrays.take(slice(start, end))
+        extras: dict[str, Optional[bytes]] = {}
+        for name in EXTRA_FIELDS:
+            values: Optional[np.ndarray] = part.extras.get(name)
+            all_missing: bool = values is None or bool(np.isnan(values).all())
+            extras[name] = None if all_missing else values.astype("<f8").tobytes()
+        chunks.append(LogPointArchive(
+            track_id=track_id, chunk=first_chunk + len(chunks), count=end - start,
+            start_ts=part.ts[0].astype("datetime64[us]").astype(datetime),
+            end_ts=part.ts[-1].astype("datetime64[us]").astype(datetime),
+            min_lat=float(part.lat.min()), max_lat=float(part.lat.max()),
+            min_lon=float(part.lon.min()), max_lon=float(part.lon.max()),
+            ts=np.diff(ms[start:end], prepend=ms[start]).astype("<i4").tobytes(),
+            lat=np.rint(part.lat * COORD_SCALE).astype("<i4").tobytes(),
+            lon=np.rint(part.lon * COORD_SCALE).astype("<i4").tobytes(),
+            **extras))
+    return chunks
+
+
+def to_ms(ts: datetime) -> datetime:
+    # an archived point's ts, truncated like pack does
+    return ts.replace(microsecond=ts.microsecond // 1000 * 1000)
+
+
+def unpack(chunk: LogPointArchive, extras: bool = True) -> PointArrays:
+    # np.frombuffer reads the blobs in place, only the decoded columns are new arrays
+    base: np.datetime64 = np.datetime64(db_ts(chunk.start_ts), "ms")
+    ts: np.ndarray = base + np.cumsum(np.frombuffer(memoryview(chunk.ts), dtype="<i4"), dtype=np.int64)
+    lat: np.ndarray = np.frombuffer(memoryview(chunk.lat), dtype="<i4") / COORD_SCALE
+    lon: np.ndarray = np.frombuffer(memoryview(chunk.lon), dtype="<i4") / COORD_SCALE
+    columns: dict[str, np.ndarray] = {}
+    if extras:
+        for name in EXTRA_FIELDS:
+            blob: Optional[bytes] = getattr(chunk, name)
+            columns[name] = np.full(chunk.count, np.nan) if blob is None else np.frombuffer(memoryview(blob),
+                                                                                              dtype="<f8")
+    return PointArrays(ts, lat, lon, columns)
@@ -0,0 +1,49 @@
+"""
+The compact track formats, both written oldest point first from ascending PointArrays.
+
+polyline: Google's encoded polyline of lat/lon at 1e-5 degrees, as read by Leaflet, Mapbox and Google Maps.
+
+binary: little-endian, a header then one column of int deltas from the previous point each for ts, lat and lon.
+    header  4s magic b"BTRK", uint16 version, uint16 width of a ts delta in bytes (4, or 8 after a gap of 24 days),
+            uint32 point count, int64 first ts in unix ms, int32 first lat and lon in 1e-7 degrees
+    columns ts delta ms int32/int64[count - 1], lat delta int32[count - 1], lon delta int32[count - 1]
+"""
+import struct
+
+import numpy as np
+
+from backtrack.storage.archive import PointArrays, COORD_SCALE, MAX_DELTA_MS
+
+POLYLINE_SCALE: float = 1e5
+# zigzag encoded polyline deltas stay below 2 ** 35
+POLYLINE_SHIFTS: np.ndarray = np.arange(7, dtype=np.uint64) * 5
+
+BINARY_MAGIC: bytes = b"BTRK"
+BINARY_VERSION: int = 1
+BINARY_HEADER: struct.Struct = struct.Struct("<4sHHIqii")
+
+
+def write_polyline(arrays: PointArrays) -> str:
+    values: np.ndarray = np.round(np.column_stack([arrays.lat, arrays.lon]) * POLYLINE_SCALE).astype(np.int64)
+    deltas: np.ndarray = np.diff(values, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    zigzag: np.ndarray = np.where(deltas < 0, ~(deltas << 1), deltas << 1).astype(np.uint64)
+    # 5 bit groups low first, every group but a value's last has the 0x20 continuation bit
+    shifted: np.ndarray = zigzag[:, None] >> POLYLINE_SHIFTS
+    codes: np.ndarray = (shifted & 0x1f) + np.where(shifted >= 0x20, 0x20, 0).astype(np.uint64) + 63
+    used: np.ndarray = shifted > 0
+    used[:, 0] = True
+    return codes[used].astype(np.uint8).tobytes().decode("ascii")
+
+
+def write_binary(arrays: PointArrays) -> bytes:
+    if not len(arrays):
+        return BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, 4, 0, 0, 0, 0)
+    ms: np.ndarray = arrays.ts.astype("datetime64[ms]").astype(np.int64)
+    lat: np.ndarray = np.round(arrays.lat * COORD_SCALE).astype(np.int64)
+    lon: np.ndarray = np.round(arrays.lon * COORD_SCALE).astype(np.int64)
+    ts_delta: np.ndarray = np.diff(ms)
+    ts_width: int = 4 if not len(ts_delta) or ts_delta.max() <= MAX_DELTA_MS else 8
+    header: bytes = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, ts_width, len(arrays), int(ms[0]), int(lat[0]),
+                                       int(lon[0]))
+    return b"".join([header, ts_delta.astype(f"<i{ts_width}").tobytes(), np.diff(lat).astype("<i4").tobytes(),
+                     np.diff(lon).astype("<i4").tobytes()])
@@ -0,0 +1,49 @@
+import gzip
+from functools import cache
+from importlib.util import find_spec
+from typing import Optional
+
+# below this the encoding saves less than it costs
+MIN_COMPRESS_BYTES: int = 1024
+GZIP_LEVEL: int = 6
+# compressed tracks are cached, a slower quality than per response brotli is paid back by the next follower
+BROTLI_QUALITY: int = 6
+
+
+@cache
+def brotli_installed() -> bool:
+    return find_spec("brotli") is not None
+
+
+def accepted_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """br or gzip, whichever the Accept-Encoding header prefers with brotli winning ties, None for identity."""
+    if not accept_encoding:
+        return None
+    weights: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        weight: float = 1.0
+        for param in params.split(";"):
+            param_name, _, value = param.partition("=")
+            if param_name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.strip().lower()] = weight
+    offered: list[str] = ["br", "gzip"] if brotli_installed() else ["gzip"]
+    best: Optional[str] = None
+    for encoding in offered:
+        weight: float = weights.get(encoding, weights.get("*", 0.0))
+        if weight > 0 and (best is None or weight > weights.get(best, weights.get("*", 0.0))):
+            best = encoding
+    return best
+
+
+def compress(payload: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        import brotli
+
+        return brotli.compress(payload, quality=BROTLI_QUALITY)
+    # no mtime so the same track compresses to the same bytes
+    return gzip.compress(payload, GZIP_LEVEL, mtime=0)
@@ -1,7 +1,73 @@
+from sqlalchemy import inspect, text, Connection
+from sqlalchemy.ext.asyncio import AsyncEngine
 from sqlmodel import SQLModel
 
-from backtrack.storage import engine
+# keyed on logpoint's implicit rowid, which a VACUUM may renumber, so rebuild_spatial_index has to follow every
+# VACUUM of a sqlite database, python -m backtrack.maintenance reindex runs it
+RTREE_FILL: str = "INSERT INTO logpoint_rtree SELECT rowid, lon, lon, lat, lat FROM logpoint"
+RTREE_DDL: list[str] = [
+    "CREATE VIRTUAL TABLE logpoint_rtree USING rtree(id, min_lon, max_lon, min_lat, max_lat)",
+    RTREE_FILL,
+]
 
+RTREE_TRIGGERS: list[str] = [
+    """CREATE TRIGGER IF NOT EXISTS logpoint_rtree_insert AFTER INSERT ON logpoint BEGIN
+        INSERT INTO logpoint_rtree VALUES (new.rowid, new.lon, new.lon, new.lat, new.lat);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS logpoint_rtree_update AFTER UPDATE OF lat, lon ON logpoint BEGIN
+        UPDATE logpoint_rtree SET min_lon = new.lon, max_lon = new.lon, min_lat = new.lat, max_lat = new.lat
+        WHERE id = new.rowid;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS logpoint_rtree_delete AFTER DELETE ON logpoint BEGIN
+        DELETE FROM logpoint_rtree WHERE id = old.rowid;
+    END""",
+]
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+
+# postgis keeps a generated point per row instead, storage.filters queries it with &&
+POSTGIS_DDL: list[str] = [
+    "CREATE EXTENSION IF NOT EXISTS postgis",
+    """ALTER TABLE logpoint ADD COLUMN IF NOT EXISTS geom geometry(Point, 4326)
+        GENERATED ALWAYS AS (ST_SetSRID(ST_MakePoint(lon, lat), 4326)) STORED""",
+    "CREATE INDEX IF NOT EXISTS logpoint_geom_idx ON logpoint USING GIST (geom)",
+]
+
+
+# columns added to tables databases may have been created without, create_all only adds missing tables
+ADDED_COLUMNS: dict[str, dict[str, str]] = {
+    "logtracksummary": {"version": "INTEGER NOT NULL DEFAULT 0", "changed_at": "TIMESTAMP WITH TIME ZONE"},
+}
+
+
+async def create_db_and_tables(async_engine: AsyncEngine):
+    async with async_engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+        await conn.run_sync(add_missing_columns)
+        await conn.run_sync(create_spatial_index)
+
+
+def add_missing_columns(conn: Connection):
+    for table, columns in ADDED_COLUMNS.items():
+        existing: set[str] = {column["name"] for column in inspect(conn).get_columns(table)}
+        for name, ddl in columns.items():
+            if name not in existing:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+
+
+def create_spatial_index(conn: Connection):
+    if conn.dialect.name == "postgresql":
+        for ddl in POSTGIS_DDL:
+            conn.execute(text(ddl))
+        return
+
+    if not inspect(conn).has_table("logpoint_rtree"):
+        for ddl in RTREE_DDL:
+            conn.execute(text(ddl))
+    for ddl in RTREE_TRIGGERS:
+        conn.execute(text(ddl))
+
+
+def rebuild_spatial_index(conn: Connection) -> int:
+    """Refill sqlite's R*Tree from the current logpoint rowids, returns the points indexed."""
+    conn.execute(text("DELETE FROM logpoint_rtree"))
+    return conn.execute(text(RTREE_FILL)).rowcount
@@ -0,0 +1,35 @@
+import math
+
+import numpy as np
+
+from backtrack.storage.archive import PointArrays
+from backtrack.storage.summary import EARTH_RADIUS_M
+
+
+def decimate_mask(arrays: PointArrays, interval_s: float, distance_m: float) -> np.ndarray:
+    """
+    Of ascending point arrays, keep a point once interval_s has passed or distance_m was covered since the last
+    kept one, either is off at 0. The first and last points are always kept.
+    """
+    n: int = len(arrays)
+    keep: np.ndarray = np.ones(n, dtype=bool)
+    if n <= 2 or (interval_s <= 0 and distance_m <= 0):
+        return keep
+    seconds: list[float] = ((arrays.ts - arrays.ts[0]) / np.timedelta64(1, "s")).tolist()
+    # a greedy walk, plain floats and math keep the haversine per point cheap
+    lat: list[float] = np.radians(arrays.lat).tolist()
+    lon: list[float] = np.radians(arrays.lon).tolist()
+    max_a: float = math.sin(min(distance_m / EARTH_RADIUS_M / 2, math.pi / 2)) ** 2
+    last: int = 0
+    for i in range(1, n - 1):
+        if interval_s > 0 and seconds[i] - seconds[last] >= interval_s:
+            last = i
+            continue
+        if distance_m > 0:
+            a: float = (math.sin((lat[i] - lat[last]) / 2) ** 2 +
+                        math.cos(lat[last]) * math.cos(lat[i]) * math.sin((lon[i] - lon[last]) / 2) ** 2)
+            if a >= max_a:
+                last = i
+                continue
+        keep[i] = False
+    return keep
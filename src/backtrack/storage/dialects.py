@@ -0,0 +1,18 @@
+from typing import Callable
+
+from sqlalchemy.sql.dml import Insert
+
+# the backends we run on are the ones sadel upserts on, both inserts support on_conflict_do_nothing and excluded.
+from xcb_sadel.base import INSERTS
+
+# async drivers for urls that don't name one
+ASYNC_DRIVERS: dict[str, str] = {
+    "postgresql": "asyncpg",
+    "sqlite": "aiosqlite",
+}
+
+
+def insert_for(dialect: str) -> Callable[..., Insert]:
+    if dialect not in INSERTS:
+        raise ValueError(f"unsupported database {dialect}, expected one of {', '.join(INSERTS)}")
+    return INSERTS[dialect]
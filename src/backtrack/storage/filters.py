@@ -0,0 +1,82 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import table, column, literal_column, select, func
+
+from backtrack.storage.models import LogPoint, LogPointArchive
+
+# sqlite R*Tree over logpoint rowids, kept in sync by the triggers in storage.db
+logpoint_rtree = table("logpoint_rtree", column("id"), column("min_lon"), column("max_lon"), column("min_lat"),
+                       column("max_lat"))
+
+
+def db_ts(ts: datetime) -> datetime:
+    # sqlite DateTime drops the offset and stores the naive wall time, which is read back as UTC
+    return ts.replace(tzinfo=None)
+
+
+@dataclass
+class BBox:
+    min_lon: float
+    min_lat: float
+    max_lon: float
+    max_lat: float
+
+    @staticmethod
+    def parse(bbox: str) -> "BBox":
+        values: list[float] = [float(v) for v in bbox.split(",")]
+        if len(values) != 4:
+            raise ValueError(f"bbox needs min_lon,min_lat,max_lon,max_lat, got {bbox}")
+        box: BBox = BBox(*values)
+        if box.min_lon > box.max_lon or box.min_lat > box.max_lat:
+            raise ValueError(f"bbox minimums must not exceed maximums, got {bbox}")
+        return box
+
+
+@dataclass
+class PointFilter:
+    since: Optional[datetime] = None
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    bbox: Optional[BBox] = None
+
+    def empty(self) -> bool:
+        return self.since is None and self.start is None and self.end is None and self.bbox is None
+
+    def apply(self, stmt, dialect: str = "sqlite"):
+        # time bounds are a range scan on the (track_id, ts) primary key
+        if self.since is not None:
+            stmt = stmt.where(LogPoint.ts > db_ts(self.since))
+        if self.start is not None:
+            stmt = stmt.where(LogPoint.ts >= db_ts(self.start))
+        if self.end is not None:
+            stmt = stmt.where(LogPoint.ts <= db_ts(self.end))
+        if self.bbox is not None:
+            box: BBox = self.bbox
+            if dialect == "postgresql":
+                envelope = func.ST_MakeEnvelope(box.min_lon, box.min_lat, box.max_lon, box.max_lat, 4326)
+                stmt = stmt.where(literal_column("logpoint.geom").op("&&")(envelope))
+            else:
+                in_box = select(logpoint_rtree.c.id).where(
+                    logpoint_rtree.c.min_lon <= box.max_lon, logpoint_rtree.c.max_lon >= box.min_lon,
+                    logpoint_rtree.c.min_lat <= box.max_lat, logpoint_rtree.c.max_lat >= box.min_lat)
+                stmt = stmt.where(literal_column("logpoint.rowid").in_(in_box))
+            # the rtree stores rounded 32 bit floats and postgis bounding boxes are float4, recheck exactly
+            stmt = (stmt.where(LogPoint.lon.between(box.min_lon, box.max_lon))
+                    .where(LogPoint.lat.between(box.min_lat, box.max_lat)))
+        return stmt
+
+    def apply_archive(self, stmt):
+        # chunk level pruning only, storage.archive rechecks every point
+        if self.since is not None:
+            stmt = stmt.where(LogPointArchive.end_ts >= db_ts(self.since))
+        if self.start is not None:
+            stmt = stmt.where(LogPointArchive.end_ts >= db_ts(self.start))
+        if self.end is not None:
+            stmt = stmt.where(LogPointArchive.start_ts <= db_ts(self.end))
+        if self.bbox is not None:
+            box: BBox = self.bbox
+            stmt = stmt.where(LogPointArchive.min_lon <= box.max_lon, LogPointArchive.max_lon >= box.min_lon,
+                              LogPointArchive.min_lat <= box.max_lat, LogPointArchive.max_lat >= box.min_lat)
+        return stmt
@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+from typing import Iterable, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from backtrack.storage.models import LogTrackDetails, LogPoint
+
+# the geojson library rounds every coordinate to 6 places with round(), floats print as their repr()
+GEOJSON_PRECISION: int = 6
+COLLECTION_OPEN: str = ('{"type": "FeatureCollection", "features": [{"type": "Feature", '
+                        '"geometry": {"type": "LineString", "coordinates": [')
+
+Coordinates = tuple[float, float, Optional[float]]
+
+
+def geojson_coordinates(lon: float, lat: float, altitude: Optional[float]) -> str:
+    if altitude is None:
+        return f"[{round(lon, GEOJSON_PRECISION)!r}, {round(lat, GEOJSON_PRECISION)!r}]"
+    return (f"[{round(lon, GEOJSON_PRECISION)!r}, {round(lat, GEOJSON_PRECISION)!r}, "
+            f"{round(altitude, GEOJSON_PRECISION)!r}]")
+
+
+def geojson_line_close(details: LogTrackDetails) -> str:
+    import geojson
+
+    from backtrack.storage.encoders import DateTimeGeojsonEncoder
+
+    # geojson.dumps and not json.dumps, non-ASCII properties are escaped or not just like the library does it
+    return f']}}, "properties": {geojson.dumps(details.model_dump(), cls=DateTimeGeojsonEncoder)}}}'
+
+
+def geojson_feature(point: LogPoint) -> str:
+    # the geojson library is only imported once a feature is written
+    import geojson
+
+    from backtrack.storage.encoders import DateTimeGeojsonEncoder
+
+    return geojson.dumps(point.geojson_feature(), cls=DateTimeGeojsonEncoder)
+
+
+def geojson_latest_feature(latest: LogPoint) -> str:
+    return f", {geojson_feature(latest)}"
+
+
+def write_geojson(details: LogTrackDetails, coordinates: Iterable[Coordinates], latest: Optional[LogPoint]) -> str:
+    """
+    Byte compatible with geojson.dumps(LogTrack.get_geojson_track()), from (lon, lat, altitude) rows newest first.
+    Only the latest point, shown as its own feature, needs a model.
+    """
+    line: str = ", ".join([geojson_coordinates(lon, lat, altitude) for lon, lat, altitude in coordinates])
+    return (COLLECTION_OPEN + line + geojson_line_close(details) +
+            ("" if latest is None else geojson_latest_feature(latest)) + "]}")
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Iterable, Optional, TYPE_CHECKING
+from xml.sax.saxutils import escape
+
+if TYPE_CHECKING:
+    from backtrack.storage.models import LogTrackDetails, LogPoint
+
+# byte compatible with gpxpy's GPX.to_xml() for the documents LogTrack.get_gpx_track builds
+GPX_HEADER: str = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<gpx xmlns="http://www.topografix.com/GPX/1/1" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    'xsi:schemaLocation="http://www.topografix.com/GPX/1/1 http://www.topografix.com/GPX/1/1/gpx.xsd" '
+    'version="1.1" creator="gpx.py -- https://github.com/tkrajina/gpxpy">\n'
+)
+GPX_FOOTER: str = "    </trkseg>\n  </trk>\n</gpx>"
+
+
+def gpx_float(value: float) -> str:
+    # gpxpy.utils.make_str without the isinstance check, GPX 1.1 forbids scientific notation
+    text: str = repr(value)
+    return text if "e" not in text else format(value, ".10f").rstrip("0").rstrip(".")
+
+
+def gpx_time(ts: datetime) -> str:
+    # stored points are naive UTC, points that were never stored keep their offset, which ts_tz() ignores
+    return (ts.isoformat() if ts.tzinfo is None else ts.replace(tzinfo=None).isoformat()) + "Z"
+
+
+def gpx_point(tag: str, p: LogPoint, indent: str, description: Optional[str] = None,
+              name: Optional[str] = None) -> str:
+    """One <wpt>/<trkpt>, `name` is the already escaped track_id when the caller writes many points of a track."""
+    altitude, speed, direction, distance, battery, accuracy = (p.altitude, p.speed_kph, p.direction, p.distance,
+                                                               p.battery, p.accuracy)
+    # repr() of a float never needs attribute escaping
+    attrs: str = ((f' speed="{speed!r}"' if speed is not None else "") +
+                  (f' direction="{direction!r}"' if direction is not None else "") +
+                  (f' distance="{distance!r}"' if distance is not None else "") +
+                  (f' battery="{battery!r}"' if battery is not None else "") +
+                  (f' accuracy="{accuracy!r}"' if accuracy is not None else ""))
+    ele: str = "" if altitude is None else f"{indent}  <ele>{gpx_float(altitude)}</ele>\n"
+    desc: str = "" if description is None else f"{indent}  <desc>{escape(description)}</desc>\n"
+    return (f'{indent}<{tag} lat="{gpx_float(p.lat)}" lon="{gpx_float(p.lon)}">\n{ele}'
+            f"{indent}  <time>{gpx_time(p.ts)}</time>\n"
+            f"{indent}  <name>{escape(p.track_id) if name is None else name}</name>\n{desc}"
+            f"{indent}  <extensions>\n{indent}    <backtrack{attrs}></backtrack>\n{indent}  </extensions>\n"
+            f"{indent}</{tag}>\n")
+
+
+def gpx_track_open(details: LogTrackDetails) -> str:
+    track_attrs: str = ' src="backtrack"'
+    if details.start_time_tz() is not None:
+        track_attrs += f' start_time="{details.start_time_tz().isoformat(timespec="seconds")}"'
+    return (f"  <trk>\n    <name>{escape(details.track_id)}</name>\n"
+            f"    <extensions>\n      <backtrack{track_attrs}></backtrack>\n    </extensions>\n"
+            f"    <trkseg>\n")
+
+
+def write_gpx(details: LogTrackDetails, points: Iterable[LogPoint]) -> str:
+    """The GPX document of a track, newest point first and repeated as the "Latest Point" waypoint."""
+    parts: list[str] = [GPX_HEADER]
+    started: bool = False
+    name: str = escape(details.track_id)
+    for p in points:
+        if not started:
+            started = True
+            parts.append(gpx_point("wpt", p, "  ", description="Latest Point"))
+            parts.append(gpx_track_open(details))
+        parts.append(gpx_point("trkpt", p, "      ", name=name))
+    if not started:
+        parts.append(gpx_track_open(details))
+    parts.append(GPX_FOOTER)
+    return "".join(parts)
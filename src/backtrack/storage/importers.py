@@ -0,0 +1,121 @@
+import csv
+import io
+from datetime import datetime, timezone
+from typing import BinaryIO, Callable, Iterator, Optional
+
+# GPSLogger writes speed in m/s, LogPoint keeps km/h
+MS_TO_KPH: float = 3.6
+
+PointRow = dict[str, object]
+
+
+def parse_ts(text: str) -> datetime:
+    ts: datetime = datetime.fromisoformat(text.strip())
+    return ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts
+
+
+def optional_float(value: Optional[object]) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    return float(value)
+
+
+def point_row(track_id: str, ts: datetime, lat: float, lon: float, altitude: Optional[float] = None,
+              speed_kph: Optional[float] = None, direction: Optional[float] = None, distance: Optional[float] = None,
+              battery: Optional[float] = None, accuracy: Optional[float] = None) -> PointRow:
+    # every row has every column, executemany binds them all
+    return {"track_id": track_id, "ts": ts, "lat": lat, "lon": lon, "altitude": altitude, "speed_kph": speed_kph,
+            "direction": direction, "distance": distance, "battery": battery, "accuracy": accuracy}
+
+
+def parse_gpx(fi: BinaryIO, track_id: str) -> Iterator[PointRow]:
+    """<trkpt>s of GPX 1.0/1.1, GPSLogger's <speed>/<course> or the backtrack extension of our own exports."""
+    import lxml.etree as mod_etree
+
+    for _, el in mod_etree.iterparse(fi, events=("end",), tag="{*}trkpt", huge_tree=True):
+        children: dict[str, str] = {mod_etree.QName(child).localname: child.text for child in el
+                                    if isinstance(child.tag, str)}
+        ext: dict[str, str] = {}
+        for backtrack in el.iterfind("{*}extensions/{*}backtrack"):
+            ext = dict(backtrack.attrib)
+        if children.get("time"):
+            speed: Optional[float] = optional_float(ext.get("speed"))
+            if speed is None and children.get("speed"):
+                speed = float(children["speed"]) * MS_TO_KPH
+            yield point_row(track_id, parse_ts(children["time"]), float(el.get("lat")), float(el.get("lon")),
+                            altitude=optional_float(children.get("ele")), speed_kph=speed,
+                            direction=optional_float(ext.get("direction", children.get("course"))),
+                            distance=optional_float(ext.get("distance")), battery=optional_float(ext.get("battery")),
+                            accuracy=optional_float(ext.get("accuracy")))
+
+        # drop parsed points so memory stays flat for any file size
+        el.clear(keep_tail=True)
+        while el.getprevious() is not None:
+            del el.getparent()[0]
+
+
+def parse_csv(fi: BinaryIO, track_id: str) -> Iterator[PointRow]:
+    """GPSLogger's plain text log: time,lat,lon,elevation,accuracy,bearing,speed,...,battery,...,distance,..."""
+    text: io.TextIOWrapper = io.TextIOWrapper(fi, encoding="utf-8-sig", newline="")
+    try:
+        reader = csv.reader(text)
+        header: list[str] = next(reader, [])
+        if not {"time", "lat", "lon"} <= set(header):
+            raise ValueError(f"csv needs time, lat and lon columns, got {','.join(header)}")
+        # missing optional columns read from an always empty trailing cell
+        time_i, lat_i, lon_i, ele_i, acc_i, bearing_i, speed_i, battery_i, dist_i = (
+            header.index(name) if name in header else len(header)
+            for name in ("time", "lat", "lon", "elevation", "accuracy", "bearing", "speed", "battery", "distance"))
+        for row in reader:
+            row.extend([""] * (len(header) + 1 - len(row)))
+            if not row[time_i] or not row[lat_i] or not row[lon_i]:
+                continue
+            speed: Optional[float] = optional_float(row[speed_i])
+            yield point_row(track_id, parse_ts(row[time_i]), float(row[lat_i]), float(row[lon_i]),
+                            altitude=optional_float(row[ele_i]),
+                            speed_kph=None if speed is None else speed * MS_TO_KPH,
+                            direction=optional_float(row[bearing_i]), distance=optional_float(row[dist_i]),
+                            battery=optional_float(row[battery_i]), accuracy=optional_float(row[acc_i]))
+    finally:
+        # leave the upload's file open for its owner
+        text.detach()
+
+
+def parse_geojson(fi: BinaryIO, track_id: str) -> Iterator[PointRow]:
+    """Timed Point features of a FeatureCollection, as written by /{key}/points and the live feed."""
+    import ijson
+
+    for feature in ijson.items(fi, "features.item", use_float=True):
+        geometry: dict = feature.get("geometry") or {}
+        props: dict = feature.get("properties") or {}
+        if geometry.get("type") != "Point" or not props.get("time"):
+            continue
+        coordinates: list[float] = geometry["coordinates"]
+        yield point_row(track_id, parse_ts(props["time"]), float(coordinates[1]), float(coordinates[0]),
+                        altitude=optional_float(coordinates[2]) if len(coordinates) > 2 else None,
+                        speed_kph=optional_float(props.get("speed")),
+                        direction=optional_float(props.get("direction")),
+                        distance=optional_float(props.get("distance")),
+                        battery=optional_float(props.get("battery")),
+                        accuracy=optional_float(props.get("accuracy")))
+
+
+PARSERS: dict[str, Callable[[BinaryIO, str], Iterator[PointRow]]] = {
+    "gpx": parse_gpx,
+    "csv": parse_csv,
+    "txt": parse_csv,
+    "geojson": parse_geojson,
+    "json": parse_geojson,
+}
+
+
+def parse_points(fmt: str, fi: BinaryIO, track_id: str) -> Iterator[PointRow]:
+    """Point rows of an uploaded file in one of the PARSERS formats, every parse failure surfaces as a ValueError."""
+    # the parser libraries are only imported once a file of their format is uploaded
+    import ijson
+    import lxml.etree as mod_etree
+
+    try:
+        yield from PARSERS[fmt](fi, track_id)
+    except (mod_etree.XMLSyntaxError, ijson.JSONError, csv.Error, KeyError, TypeError) as e:
+        raise ValueError(f"invalid {fmt} file: {e}") from e
@@ -1,15 +1,38 @@
 import uuid
 from datetime import datetime, timezone
-from typing import Optional, Any
+from typing import Optional, Any, TYPE_CHECKING
 
-import geojson
-import lxml.etree as mod_etree
-from geojson import LineString, Feature, FeatureCollection, Point
-from gpxpy.gpx import GPX, GPXTrackPoint, GPXTrackSegment, GPXTrack, GPXWaypoint
-from sqlmodel import SQLModel, Field, Column, DateTime
+import numpy as np
+from sqlalchemy import TypeDecorator
+from sqlmodel import SQLModel, Field, Column, DateTime, LargeBinary, func
 
 from backtrack.controllers.TrackFormat import TrackFormat
-from backtrack.storage.encoders import DateTimeGeojsonEncoder
+from backtrack.storage.geojson_writer import write_geojson
+from backtrack.storage.gpx_writer import write_gpx
+from backtrack.storage.simplify import simplify_mask
+
+if TYPE_CHECKING:
+    from geojson import Feature, FeatureCollection
+    from gpxpy.gpx import GPX
+
+
+class StoredDateTime(TypeDecorator):
+    """
+    Timestamps read back as naive UTC wall time on every backend, the way sqlite keeps them.
+    Like sqlite, an offset is dropped rather than converted.
+    """
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value: Optional[datetime], dialect) -> Optional[datetime]:
+        if value is None or dialect.name == "sqlite":
+            return value
+        return value.replace(tzinfo=timezone.utc)
+
+    def process_result_value(self, value: Optional[datetime], dialect) -> Optional[datetime]:
+        if value is None or dialect.name == "sqlite":
+            return value
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
 
 
 class LogItem(SQLModel, table=False):
@@ -36,6 +59,12 @@ class LogItem(SQLModel, table=False):
     accuracy: Optional[float] = Field(default=None)
 
 
+class LogKey(SQLModel, table=True):
+    key: str = Field(primary_key=True)
+    created: Optional[datetime] = Field(default=None, sa_column=Column(StoredDateTime(), nullable=False,
+                                                                      server_default=func.now()))
+
+
 class LogTrackDetails(SQLModel, table=True):
     # https://stackoverflow.com/questions/78054752/fastapi-sqlmodel-pydantic-not-serializing-datetime
     class Config:
@@ -45,7 +74,7 @@ class LogTrackDetails(SQLModel, table=True):
     key: str = Field(default=None, primary_key=True)
     description: Optional[str] = Field(default=None)
     android_id: Optional[str] = Field(default=None)
-    start_time: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True), nullable=True))
+    start_time: Optional[datetime] = Field(default=None, sa_column=Column(StoredDateTime(), nullable=True))
     profile: Optional[str] = Field(default=None)
 
     def start_time_tz(self) -> Optional[datetime]:
@@ -64,7 +93,7 @@ class LogPoint(SQLModel, table=True):
         validate_assignment = True
 
     track_id: str = Field(default_factory=uuid.uuid4, primary_key=True, foreign_key="logtrackdetails.track_id")
-    ts: datetime = Field(default=None, sa_column=Column(DateTime(timezone=True), nullable=False, primary_key=True))
+    ts: datetime = Field(default=None, sa_column=Column(StoredDateTime(), nullable=False, primary_key=True))
     lat: float
     lon: float
     altitude: Optional[float] = Field(default=None)
@@ -83,6 +112,40 @@ class LogPoint(SQLModel, table=True):
             ret = (self.lon, self.lat, self.altitude)
         return ret
 
+    def geojson_feature(self) -> "Feature":
+        from geojson import Feature, Point
+
+        props: dict[str, Any] = {
+            "track_id": self.track_id,
+            "time": self.ts_tz(),
+        }
+        if self.speed_kph is not None:
+            props["speed"] = self.speed_kph
+        if self.direction is not None:
+            props["direction"] = self.direction
+        if self.distance is not None:
+            props["distance"] = self.distance
+        if self.battery is not None:
+            props["battery"] = self.battery
+        if self.accuracy is not None:
+            props["accuracy"] = self.accuracy
+
+        return Feature(geometry=Point(self.xyz()), properties=props)
+
+    def gpx_extension_attrs(self) -> dict[str, str]:
+        attrs: dict[str, str] = {}
+        if self.speed_kph is not None:
+            attrs["speed"] = str(self.speed_kph)
+        if self.direction is not None:
+            attrs["direction"] = str(self.direction)
+        if self.distance is not None:
+            attrs["distance"] = str(self.distance)
+        if self.battery is not None:
+            attrs["battery"] = str(self.battery)
+        if self.accuracy is not None:
+            attrs["accuracy"] = str(self.accuracy)
+        return attrs
+
     @staticmethod
     def from_item(item: LogItem) -> "LogPoint":
         return LogPoint(track_id=item.track_id, ts=item.ts, lat=item.lat, lon=item.lon,
@@ -92,41 +155,97 @@ class LogPoint(SQLModel, table=True):
                         accuracy=item.accuracy)
 
 
+class LogPointArchive(SQLModel, table=True):
+    # a chunk of a finished track's points, packed by storage.archive
+    track_id: str = Field(primary_key=True, foreign_key="logtrackdetails.track_id")
+    chunk: int = Field(primary_key=True)
+    count: int
+    start_ts: datetime = Field(sa_column=Column(StoredDateTime(), nullable=False))
+    end_ts: datetime = Field(sa_column=Column(StoredDateTime(), nullable=False))
+    min_lat: float
+    max_lat: float
+    min_lon: float
+    max_lon: float
+
+    ts: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    lat: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    lon: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    altitude: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary, nullable=True))
+    speed_kph: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary, nullable=True))
+    direction: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary, nullable=True))
+    distance: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary, nullable=True))
+    battery: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary, nullable=True))
+    accuracy: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary, nullable=True))
+
+
+class LogTrackSummary(SQLModel, table=True):
+    # running aggregates of a track, kept by storage.summary as points are stored
+    track_id: str = Field(primary_key=True, foreign_key="logtrackdetails.track_id")
+    point_count: int = Field(default=0)
+    distance_m: float = Field(default=0)
+    first_ts: Optional[datetime] = Field(default=None, sa_column=Column(StoredDateTime(), nullable=True))
+    last_ts: Optional[datetime] = Field(default=None, sa_column=Column(StoredDateTime(), nullable=True))
+    # the latest point, the next leg of the distance starts here
+    last_lat: Optional[float] = Field(default=None)
+    last_lon: Optional[float] = Field(default=None)
+    min_lat: Optional[float] = Field(default=None)
+    max_lat: Optional[float] = Field(default=None)
+    min_lon: Optional[float] = Field(default=None)
+    max_lon: Optional[float] = Field(default=None)
+    # bumped by every write to the track, stored, imported, archived or removed points, with the time of it
+    version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    changed_at: Optional[datetime] = Field(default=None, sa_column=Column(StoredDateTime(), nullable=True))
+
+    def changed(self) -> None:
+        self.version += 1
+        self.changed_at = datetime.now(tz=timezone.utc).replace(tzinfo=None)
+
+    def stats(self) -> dict[str, Any]:
+        empty: bool = self.last_ts is None
+        return {
+            "track_id": self.track_id,
+            "point_count": self.point_count,
+            "distance_m": self.distance_m,
+            "duration_s": None if empty else (self.last_ts - self.first_ts).total_seconds(),
+            "first_ts": None if empty else self.first_ts.replace(tzinfo=timezone.utc),
+            "last_ts": None if empty else self.last_ts.replace(tzinfo=timezone.utc),
+            "bbox": None if empty else [self.min_lon, self.min_lat, self.max_lon, self.max_lat],
+        }
+
+
+class LogTrackMaintenance(SQLModel, table=True):
+    # how far controllers.maintenance got through a track, points up to decimated_until are thinned already
+    track_id: str = Field(primary_key=True, foreign_key="logtrackdetails.track_id")
+    decimated_until: Optional[datetime] = Field(default=None, sa_column=Column(StoredDateTime(), nullable=True))
+
+
 class LogTrack(SQLModel, table=False):
     details: LogTrackDetails
     points: list[LogPoint]
 
-    def get_geojson_track(self, first_point: bool = True) -> Optional[FeatureCollection]:
+    def simplify(self, tolerance: float) -> "LogTrack":
+        if len(self.points) <= 2:
+            return self
+        keep: np.ndarray = simplify_mask(np.array([(p.lon, p.lat) for p in self.points]), tolerance)
+        return LogTrack(details=self.details, points=[p for p, k in zip(self.points, keep) if k])
+
+    def get_geojson_track(self, first_point: bool = True) -> Optional["FeatureCollection"]:
+        from geojson import LineString, Feature, FeatureCollection
 
         point_set = [p.xyz() for p in self.points]
         line: LineString = LineString(point_set)
         l_feature = Feature(geometry=line, properties=self.details.model_dump())
         features: list[Feature] = [l_feature]
-        if first_point:
-            fp = self.points[0]
-            point = Point(fp.xyz())
-            props: dict[str, Any] = {
-                "track_id": fp.track_id,
-                "time": fp.ts_tz(),
-            }
-            if fp.speed_kph is not None:
-                props["speed"] = fp.speed_kph
-            if fp.direction is not None:
-                props["direction"] = fp.direction
-            if fp.distance is not None:
-                props["distance"] = fp.distance
-            if fp.battery is not None:
-                props["battery"] = fp.battery
-            if fp.accuracy is not None:
-                props["accuracy"] = fp.accuracy
-
-            p_feature: Feature = Feature(geometry=point, properties=props)
-            features.append(p_feature)
+        if first_point and self.points:
+            features.append(self.points[0].geojson_feature())
 
         collection: FeatureCollection = FeatureCollection(features)
         return collection
 
-    def get_gpx_track(self) -> Optional[GPX]:
+    def get_gpx_track(self) -> Optional["GPX"]:
+        import lxml.etree as mod_etree
+        from gpxpy.gpx import GPX, GPXTrackPoint, GPXTrackSegment, GPXTrack, GPXWaypoint
+
         namespace = "backtrack"
 
         gpx = GPX()
@@ -151,16 +270,7 @@ class LogTrack(SQLModel, table=False):
             gpx_point = GPXTrackPoint(latitude=p.lat, longitude=p.lon, elevation=p.altitude, time=p.ts_tz(),
                                       speed=p.speed_kph, name=p.track_id)
             point_root = mod_etree.Element(f'{namespace}')
-            if p.speed_kph is not None:
-                point_root.attrib["speed"] = str(p.speed_kph)
-            if p.direction is not None:
-                point_root.attrib["direction"] = str(p.direction)
-            if p.distance is not None:
-                point_root.attrib["distance"] = str(p.distance)
-            if p.battery is not None:
-                point_root.attrib["battery"] = str(p.battery)
-            if p.accuracy is not None:
-                point_root.attrib["accuracy"] = str(p.accuracy)
+            point_root.attrib.update(p.gpx_extension_attrs())
 
             gpx_point.extensions.append(point_root)
             gpx_segment.points.append(gpx_point)
@@ -175,6 +285,7 @@ class LogTrack(SQLModel, table=False):
 
     def get_track_fmt_string(self, fmt: TrackFormat) -> str:
         if fmt == TrackFormat.geojson or fmt == TrackFormat.json:
-            return geojson.dumps(self.get_geojson_track(), cls=DateTimeGeojsonEncoder)
+            return write_geojson(self.details, [(p.lon, p.lat, p.altitude) for p in self.points],
+                                 self.points[0] if self.points else None)
         elif fmt == TrackFormat.gpx:
-            return self.get_gpx_track().to_xml()
+            return write_gpx(self.details, self.points)
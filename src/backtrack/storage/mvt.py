@@ -0,0 +1,139 @@
+import math
+from typing import Any
+
+import numpy as np
+
+EXTENT: int = 4096
+BUFFER: int = 64
+MAX_LAT: float = 85.0511287798
+
+# protobuf wire types
+VARINT: int = 0
+LENGTH: int = 2
+
+# vector tile geometry commands and types
+MOVE_TO: int = 1
+LINE_TO: int = 2
+LINESTRING: int = 2
+
+
+def tile_bounds(z: int, x: int, y: int, buffer: float = 0) -> tuple[float, float, float, float]:
+    """(min_lon, min_lat, max_lon, max_lat) of a tile, grown by `buffer` tile fractions on every side."""
+    n: int = 2 ** z
+
+    def lat(ty: float) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return ((x - buffer) / n * 360 - 180, max(lat(y + 1 + buffer), -MAX_LAT),
+            (x + 1 + buffer) / n * 360 - 180, min(lat(y - buffer), MAX_LAT))
+
+
+def to_tile_units(lonlat: np.ndarray, z: int) -> np.ndarray:
+    """Web mercator position of lon/lat pairs in whole tiles at zoom z."""
+    n: int = 2 ** z
+    lat: np.ndarray = np.radians(np.clip(lonlat[:, 1], -MAX_LAT, MAX_LAT))
+    return np.column_stack([(lonlat[:, 0] + 180) / 360 * n, (1 - np.arcsinh(np.tan(lat)) / math.pi) / 2 * n])
+
+
+def tile_ranges(bounds: tuple[float, float, float, float], z: int, buffer: float = 0) -> tuple[range, range]:
+    """x and y ranges of the tiles whose buffered extent overlaps lon/lat bounds."""
+    corners: np.ndarray = to_tile_units(np.array([[bounds[0], bounds[3]], [bounds[2], bounds[1]]]), z)
+    n: int = 2 ** z
+    x0, y0 = (max(math.floor(c - buffer), 0) for c in corners[0])
+    x1, y1 = (min(math.floor(c + buffer), n - 1) for c in corners[1])
+    return range(x0, x1 + 1), range(y0, y1 + 1)
+
+
+def clip_segments(a: np.ndarray, b: np.ndarray, lo: float, hi: float) -> tuple[np.ndarray, np.ndarray]:
+    """Liang-Barsky, the (t0, t1) part of each segment a + t * (b - a) inside the square lo..hi, empty where t0 > t1."""
+    d: np.ndarray = b - a
+    # per axis, then the tightest of the two
+    t0: np.ndarray = np.zeros_like(d)
+    t1: np.ndarray = np.ones_like(d)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for p, q in ((-d, a - lo), (d, hi - a)):
+            r: np.ndarray = q / p
+            parallel: np.ndarray = p == 0
+            # parallel to an edge and outside it never enters
+            t1 = np.where(parallel & (q < 0), -1.0, t1)
+            t0 = np.where(~parallel & (p < 0), np.maximum(t0, r), t0)
+            t1 = np.where(~parallel & (p > 0), np.minimum(t1, r), t1)
+    return t0.max(axis=1), t1.min(axis=1)
+
+
+def tile_lines(lonlat: np.ndarray, z: int, x: int, y: int) -> list[np.ndarray]:
+    """A lon/lat line clipped to the buffered tile, in integer tile coordinates."""
+    if len(lonlat) < 2:
+        return []
+    pixels: np.ndarray = (to_tile_units(lonlat, z) - (x, y)) * EXTENT
+    a, b = pixels[:-1], pixels[1:]
+    t0, t1 = clip_segments(a, b, -BUFFER, EXTENT + BUFFER)
+    inside: np.ndarray = t0 <= t1
+    starts: np.ndarray = a + t0[:, None] * (b - a)
+    ends: np.ndarray = a + t1[:, None] * (b - a)
+
+    # a line runs on through vertices inside the tile and breaks where the track leaves it
+    breaks: np.ndarray = inside & ~np.concatenate([[False], inside[:-1] & (t1[:-1] >= 1)])
+    lines: list[np.ndarray] = []
+    for run in np.split(np.arange(len(a)), np.nonzero(breaks)[0]):
+        run = run[inside[run]]
+        if not len(run):
+            continue
+        line: np.ndarray = np.rint(np.vstack([starts[run[:1]], ends[run]])).astype(np.int64)
+        line = line[np.concatenate([[True], np.any(np.diff(line, axis=0) != 0, axis=1)])]
+        if len(line) >= 2:
+            lines.append(line)
+    return lines
+
+
+def varint(value: int) -> bytes:
+    out: bytearray = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def field(number: int, wire_type: int, payload: Any) -> bytes:
+    if wire_type == VARINT:
+        return varint(number << 3 | VARINT) + varint(payload)
+    return varint(number << 3 | LENGTH) + varint(len(payload)) + payload
+
+
+def line_geometry(lines: list[np.ndarray]) -> list[int]:
+    commands: list[int] = []
+    cursor: np.ndarray = np.zeros(2, dtype=np.int64)
+    for line in lines:
+        deltas: np.ndarray = np.diff(np.vstack([cursor, line]), axis=0)
+        cursor = line[-1]
+        zz: list[int] = [zigzag(int(v)) for v in deltas.ravel()]
+        commands += [MOVE_TO | 1 << 3, zz[0], zz[1], LINE_TO | (len(line) - 1) << 3] + zz[2:]
+    return commands
+
+
+def encode_layer(name: str, features: list[tuple[list[np.ndarray], dict[str, str]]]) -> bytes:
+    keys: dict[str, int] = {}
+    values: dict[str, int] = {}
+    encoded: list[bytes] = []
+    for feature_id, (lines, props) in enumerate(features, start=1):
+        tags: list[int] = []
+        for k, v in props.items():
+            tags += [keys.setdefault(k, len(keys)), values.setdefault(v, len(values))]
+        geometry: bytes = b"".join(varint(c) for c in line_geometry(lines))
+        encoded.append(field(1, VARINT, feature_id) + field(2, LENGTH, b"".join(varint(t) for t in tags)) +
+                       field(3, VARINT, LINESTRING) + field(4, LENGTH, geometry))
+
+    return (field(15, VARINT, 2) + field(1, LENGTH, name.encode()) +
+            b"".join(field(2, LENGTH, f) for f in encoded) +
+            b"".join(field(3, LENGTH, k.encode()) for k in keys) +
+            b"".join(field(4, LENGTH, field(1, LENGTH, v.encode())) for v in values) +
+            field(5, VARINT, EXTENT))
+
+
+def encode_tile(layers: dict[str, list[tuple[list[np.ndarray], dict[str, str]]]]) -> bytes:
+    return b"".join(field(3, LENGTH, encode_layer(name, features)) for name, features in layers.items() if features)
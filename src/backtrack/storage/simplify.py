@@ -0,0 +1,41 @@
+import numpy as np
+
+TILE_SIZE: int = 256
+
+
+def tolerance_for_zoom(zoom: float, pixels: float = 1.0) -> float:
+    """Tolerance in degrees of roughly `pixels` screen pixels at a web mercator zoom level."""
+    return pixels * 360 / (TILE_SIZE * 2 ** zoom)
+
+
+def segment_distances(xy: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    ab: np.ndarray = b - a
+    length_sq: float = float(ab @ ab)
+    if length_sq == 0:
+        return np.hypot(*(xy - a).T)
+    t: np.ndarray = np.clip(((xy - a) @ ab) / length_sq, 0, 1)
+    return np.hypot(*(xy - (a + t[:, None] * ab)).T)
+
+
+def simplify_mask(xy: np.ndarray, tolerance: float) -> np.ndarray:
+    """Douglas-Peucker over an (n, 2) lon/lat array, returns a boolean mask of the vertices to keep."""
+    n: int = len(xy)
+    keep: np.ndarray = np.zeros(n, dtype=bool)
+    if n <= 2:
+        keep[:] = True
+        return keep
+
+    keep[0] = keep[-1] = True
+    stack: list[tuple[int, int]] = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        dists: np.ndarray = segment_distances(xy[start + 1:end], xy[start], xy[end])
+        i: int = int(np.argmax(dists))
+        if dists[i] > tolerance:
+            split: int = start + 1 + i
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return keep
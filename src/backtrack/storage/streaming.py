@@ -0,0 +1,48 @@
+from typing import AsyncIterator, Optional
+from xml.sax.saxutils import escape
+
+from backtrack.storage.geojson_writer import (COLLECTION_OPEN, geojson_coordinates, geojson_line_close,
+                                               geojson_latest_feature)
+from backtrack.storage.gpx_writer import GPX_HEADER, GPX_FOOTER, gpx_point, gpx_track_open
+from backtrack.storage.models import LogTrackDetails, LogPoint
+
+CHUNK_POINTS: int = 1000
+
+
+async def stream_geojson(details: LogTrackDetails, rows: AsyncIterator[list[tuple]],
+                         latest: Optional[LogPoint]) -> AsyncIterator[str]:
+    """The same bytes as write_geojson, from lists of (ts, lon, lat, altitude) rows newest first."""
+    yield COLLECTION_OPEN
+
+    sep: str = ""
+    async for partition in rows:
+        if partition:
+            yield sep + ", ".join([geojson_coordinates(lon, lat, altitude) for _, lon, lat, altitude in partition])
+            sep = ", "
+
+    yield geojson_line_close(details)
+    if latest is not None:
+        yield geojson_latest_feature(latest)
+    yield "]}"
+
+
+async def stream_gpx(details: LogTrackDetails, points: AsyncIterator[LogPoint]) -> AsyncIterator[str]:
+    yield GPX_HEADER
+    track_open: str = gpx_track_open(details)
+    name: str = escape(details.track_id)
+
+    chunk: list[str] = []
+    started: bool = False
+    async for p in points:
+        if not started:
+            started = True
+            chunk.append(gpx_point("wpt", p, "  ", description="Latest Point"))
+            chunk.append(track_open)
+        chunk.append(gpx_point("trkpt", p, "      ", name=name))
+        if len(chunk) >= CHUNK_POINTS:
+            yield "".join(chunk)
+            chunk = []
+    if not started:
+        chunk.append(track_open)
+    chunk.append(GPX_FOOTER)
+    yield "".join(chunk)
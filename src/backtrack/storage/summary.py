@@ -0,0 +1,67 @@
+from datetime import datetime
+from typing import Union
+
+import numpy as np
+
+from backtrack.storage.archive import PointArrays
+from backtrack.storage.filters import db_ts
+from backtrack.storage.models import LogPoint, LogTrackSummary
+
+# mean earth radius of WGS84
+EARTH_RADIUS_M: float = 6371008.8
+
+Degrees = Union[float, np.ndarray]
+
+
+def haversine_m(lat1: Degrees, lon1: Degrees, lat2: Degrees, lon2: Degrees) -> Degrees:
+    lat1, lon1, lat2, lon2 = np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+def summarize(track_id: str, arrays: PointArrays) -> LogTrackSummary:
+    """The summary of a whole track from its ascending point arrays."""
+    if not len(arrays):
+        return LogTrackSummary(track_id=track_id)
+    ts: list[datetime] = arrays.ts[[0, -1]].astype("datetime64[us]").astype(object).tolist()
+    return LogTrackSummary(track_id=track_id, point_count=len(arrays),
+                           distance_m=float(haversine_m(arrays.lat[:-1], arrays.lon[:-1],
+                                                        arrays.lat[1:], arrays.lon[1:]).sum()),
+                           first_ts=ts[0], last_ts=ts[-1],
+                           last_lat=float(arrays.lat[-1]), last_lon=float(arrays.lon[-1]),
+                           min_lat=float(arrays.lat.min()), max_lat=float(arrays.lat.max()),
+                           min_lon=float(arrays.lon.min()), max_lon=float(arrays.lon.max()))
+
+
+def appends(summary: LogTrackSummary, points: list[LogPoint]) -> bool:
+    """True when every new point is later than the summary's last point, so it can be extended in place."""
+    return summary.last_ts is None or all(db_ts(p.ts) > db_ts(summary.last_ts) for p in points)
+
+
+def extend(summary: LogTrackSummary, points: list[LogPoint]) -> None:
+    """Fold points that all come after summary.last_ts into the running aggregates."""
+    for p in sorted(points, key=lambda p: db_ts(p.ts)):
+        if summary.last_ts is None:
+            summary.first_ts = db_ts(p.ts)
+            summary.min_lat = summary.max_lat = p.lat
+            summary.min_lon = summary.max_lon = p.lon
+        elif db_ts(p.ts) == db_ts(summary.last_ts):
+            # a duplicate within the batch, the insert skips it too
+            continue
+        else:
+            summary.distance_m += float(haversine_m(summary.last_lat, summary.last_lon, p.lat, p.lon))
+            summary.min_lat, summary.max_lat = min(summary.min_lat, p.lat), max(summary.max_lat, p.lat)
+            summary.min_lon, summary.max_lon = min(summary.min_lon, p.lon), max(summary.max_lon, p.lon)
+        summary.point_count += 1
+        summary.last_ts, summary.last_lat, summary.last_lon = db_ts(p.ts), p.lat, p.lon
+
+
+def insert_late(summary: LogTrackSummary, point: LogPoint, before: tuple[float, float],
+                after: tuple[float, float]) -> None:
+    """Fold in a point older than summary.last_ts, stored between the (lat, lon) points before and after it."""
+    summary.distance_m += float(haversine_m(before[0], before[1], point.lat, point.lon)
+                                + haversine_m(point.lat, point.lon, after[0], after[1])
+                                - haversine_m(before[0], before[1], after[0], after[1]))
+    summary.min_lat, summary.max_lat = min(summary.min_lat, point.lat), max(summary.max_lat, point.lat)
+    summary.min_lon, summary.max_lon = min(summary.min_lon, point.lon), max(summary.max_lon, point.lon)
+    summary.point_count += 1
@@ -0,0 +1,46 @@
+"""
+The single writer process of a multi-worker deployment, run from src/ next to the HTTP workers:
+    python -m backtrack.writer
+    fastapi run backtrack/main.py --workers 4
+with writer.enabled set in the config, see entrypoint.sh.
+"""
+import asyncio
+import logging
+import signal
+
+from backtrack.basic_log import log, set_log_level
+from backtrack.config import load_config
+from backtrack.config.config import AppConfig
+from backtrack.controllers import create_controller
+from backtrack.controllers.controller import BacktrackController
+from backtrack.controllers.writer import WriterServer
+from backtrack.storage.db import create_db_and_tables
+
+
+async def serve(app_conf: AppConfig) -> None:
+    # this process is the writer the workers forward to, it writes directly and always group commits
+    app_conf.writer.enabled = False
+    app_conf.ingest.batched = True
+    set_log_level(app_conf.general.log_level)
+    controller: BacktrackController = create_controller(app_conf)
+
+    await create_db_and_tables(controller.async_engine)
+    await controller.start()
+    server: WriterServer = WriterServer(controller, app_conf.writer.socket_path)
+    await server.start()
+    log(f"writer listening on {app_conf.writer.socket_path}", logging.INFO, source="writer")
+
+    stopping: asyncio.Event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+    await stopping.wait()
+
+    # stop taking writes, then flush what is queued
+    await server.stop()
+    await controller.stop()
+    await controller.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve(load_config()))
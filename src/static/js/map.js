@@ -1,6 +1,8 @@
 const trackLayerIdPrefix = 'tracks-'
 const pointLayerIdPrefix = 'point-'
 let layerSourceMap = {};
+let liveSources = {};
+const liveTrackPattern = /\/track\/[^\/]+\/(json|geojson|gpx)$/;
 const layerTypeColorPropMap = {
     "circle": "circle-color", "line": "line-color"
 }
@@ -27,10 +29,30 @@ async function init() {
         layerSelector(map);
     });
 
+    if (typeof backtrackKey === "string" && backtrackKey !== "") {
+        addKeyTiles(backtrackKey);
+    }
+
     await loadSearchParams()
     await zoomToSources();
 }
 
+function addKeyTiles(key) {
+    // every track of the key as vector tiles, only the visible tiles are loaded
+    let sourceName = "tiles-" + key;
+    map.addSource(sourceName, {
+        'type': 'vector',
+        'tiles': [window.location.origin + "/" + encodeURIComponent(key) + "/tiles/{z}/{x}/{y}.mvt"],
+        'minzoom': 0,
+        'maxzoom': 16
+    });
+    map.addLayer({
+        'id': sourceName, 'type': 'line', 'source': sourceName, 'source-layer': 'tracks', 'paint': {
+            'line-color': '#888888', 'line-width': 3, 'line-opacity': 0.6
+        }
+    });
+}
+
 async function loadSearchParams() {
     const urlParams = new URLSearchParams(window.location.search);
     let ps = []
@@ -102,6 +124,56 @@ async function trackFromUrl(url, sourceName, color) {
 
     await addSourceLayer(sourceName, blobUrl, color)
     await zoomToSources()
+    followTrack(url, sourceName)
+}
+
+function followTrack(url, sourceName) {
+    // backtrack tracks push new points over server-sent events, append them instead of refetching
+    let trackUrl = new URL(url, window.location.href);
+    if (!liveTrackPattern.test(trackUrl.pathname) || typeof liveSources[sourceName] !== "undefined") {
+        return;
+    }
+    let liveUrl = trackUrl.origin + trackUrl.pathname.replace(liveTrackPattern, (m) => m.replace(/[^\/]+$/, "live"));
+    let events = new EventSource(liveUrl);
+    events.addEventListener("point", async (e) => {
+        await appendPoint(sourceName, JSON.parse(e.data));
+    });
+    // sent when this follower fell behind and missed points, the stream ends and reconnects after refetching
+    events.addEventListener("reset", async () => {
+        await reloadSource(url, sourceName);
+    });
+    liveSources[sourceName] = events;
+}
+
+async function reloadSource(url, sourceName) {
+    let src = map.getSource(sourceName);
+    if (typeof src === "undefined") {
+        return;
+    }
+    let r = await fetch(url)
+    let content = await r.text()
+    const inputBlob = new Blob([content], {type: 'text/plain'});
+    src.setData(guessInputType(url) + URL.createObjectURL(inputBlob));
+}
+
+async function appendPoint(sourceName, pointFeature) {
+    let src = map.getSource(sourceName);
+    if (typeof src === "undefined") {
+        return;
+    }
+    let data = await src.getData();
+    for (let i = 0; i < data.features.length; i++) {
+        let geom = data.features[i].geometry;
+        // tracks are ordered newest first
+        if (geom.type === "LineString") {
+            geom.coordinates.unshift(pointFeature.geometry.coordinates);
+        } else if (geom.type === "MultiLineString") {
+            geom.coordinates[0].unshift(pointFeature.geometry.coordinates);
+        } else if (geom.type === "Point") {
+            data.features[i] = pointFeature;
+        }
+    }
+    src.setData(data);
 }
 
 async function addSourceLayer(sourceName, blobUrl, color) {
@@ -203,6 +275,10 @@ async function removeTrack(evt) {
     let src_arr = Array.from(new Set(Object.values(layerSourceMap)));
     if (!src_arr.includes(sourceId)) {
         map.removeSource(sourceId);
+        if (typeof liveSources[sourceId] !== "undefined") {
+            liveSources[sourceId].close();
+            delete liveSources[sourceId];
+        }
     }
 
     let elmId = "cbx_" + layerId;
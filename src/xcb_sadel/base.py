@@ -1,14 +1,28 @@
 # pyright: reportUnknownVariableType=false
 from __future__ import annotations
 
+import sqlite3
 from datetime import datetime
-from typing import Any, ClassVar
+from typing import Any, Callable, ClassVar
 
 import sqlalchemy as sa
 from pydantic import ConfigDict
-from sqlalchemy.dialects.postgresql import Insert, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.sql.dml import Insert
 from sqlmodel import Field, SQLModel
 
+# dialect specific insert constructs, both support ON CONFLICT and `excluded.`
+INSERTS: dict[str, Callable[..., Insert]] = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+# bound parameters allowed in one statement, SQLite raised its limit from 999 in 3.32
+MAX_BIND_PARAMS: dict[str, int] = {
+    "postgresql": 32767,
+    "sqlite": 32766 if sqlite3.sqlite_version_info >= (3, 32) else 999,
+}
+
 
 class Sadel(SQLModel):
     """Base class for SQL models."""
@@ -49,30 +63,88 @@ class Sadel(SQLModel):
     @classmethod
     async def upsert(cls, item: Sadel, session: sa.orm.Session):
         """upserts a single item"""
-        stmt = cls._get_upsert_statement(item)
+        stmt = cls._get_upsert_statement(item, cls._get_dialect_name(session))
         await session.execute(stmt)
         await session.commit()
 
     @classmethod
-    async def batch_upsert(cls, items: list[Sadel], session: sa.orm.Session):
-        """Batch upserts a list of items."""
-        for item in items:
-            stmt = cls._get_upsert_statement(item)
+    async def batch_upsert(
+        cls, items: list[Sadel], session: sa.orm.Session, chunk_size: int | None = None
+    ):
+        """Batch upserts a list of items with multi-row INSERT ... ON CONFLICT statements.
+
+        Without a chunk_size, each statement holds as many rows as the bind parameter limit allows.
+        """
+        if not items:
+            return
+
+        dialect_name = cls._get_dialect_name(session)
+        records = cls._get_unique_records([cls._get_record_to_insert(item) for item in items])
+        if chunk_size is None:
+            chunk_size = cls._get_chunk_size(records[0], dialect_name)
+
+        for start in range(0, len(records), chunk_size):
+            stmt = cls._get_batch_upsert_statement(
+                records[start : start + chunk_size], dialect_name
+            )
             await session.execute(stmt)
         await session.commit()
 
+    @staticmethod
+    def _get_dialect_name(session: sa.orm.Session) -> str:
+        """Returns the name of the dialect the session is bound to, if it supports upserts."""
+        dialect_name = session.get_bind().dialect.name
+        if dialect_name not in INSERTS:
+            raise ValueError(f"Upserts are not supported for the {dialect_name} dialect.")
+        return dialect_name
+
     @classmethod
-    def _get_upsert_statement(cls, item: Sadel) -> Insert:
-        """Returns an UPSERT statement for a single item."""
-        if not cls._upsert_index_elements:
-            raise ValueError("No upsert index elements specified for the model.")
+    def _get_chunk_size(cls, record: dict[str, Any], dialect_name: str) -> int:
+        """Returns how many rows fit in one statement, SQL expressions take no bind parameter."""
+        params_per_row = sum(
+            1 for value in record.values() if not isinstance(value, sa.ColumnElement)
+        )
+        return max(MAX_BIND_PARAMS[dialect_name] // max(params_per_row, 1), 1)
 
+    @classmethod
+    def _get_record_to_insert(cls, item: Sadel) -> dict[str, Any]:
+        """Returns the column values to insert for a single item."""
         to_insert = item.model_dump()
         to_insert["created_on"] = (
             sa.func.now()
         )  # set manually, because on_conflict_do_update doesn't trigger default oninsert
-        to_update = cls._get_record_to_update(to_insert)
-        stmt = insert(cls).values(to_insert)
+        return to_insert
+
+    @classmethod
+    def _get_unique_records(cls, records: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """Returns the last record for each conflict key, a statement can't update the same row twice."""
+        if not cls._upsert_index_elements:
+            return records
+        keys = sorted(cls._upsert_index_elements)
+        unique: dict[tuple[Any, ...], dict[str, Any]] = {}
+        for record in records:
+            unique[tuple(record[key] for key in keys)] = record
+        return list(unique.values())
+
+    @classmethod
+    def _get_upsert_statement(cls, item: Sadel, dialect_name: str = "postgresql") -> Insert:
+        """Returns an UPSERT statement for a single item."""
+        return cls._get_batch_upsert_statement([cls._get_record_to_insert(item)], dialect_name)
+
+    @classmethod
+    def _get_batch_upsert_statement(
+        cls, records: list[dict[str, Any]], dialect_name: str
+    ) -> Insert:
+        """Returns a multi-row UPSERT statement, conflicting rows take the new values."""
+        if not cls._upsert_index_elements:
+            raise ValueError("No upsert index elements specified for the model.")
+
+        stmt = INSERTS[dialect_name](cls).values(records)
+        # columns set from SQL expressions (modified_on) keep them, the rest come from the row
+        to_update = {
+            field: value if isinstance(value, sa.ColumnElement) else stmt.excluded[field]
+            for field, value in cls._get_record_to_update(records[0]).items()
+        }
         return stmt.on_conflict_do_update(
             index_elements=cls._upsert_index_elements,
             set_=to_update,
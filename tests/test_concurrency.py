@@ -0,0 +1,57 @@
+import asyncio
+import statistics
+import time
+
+import httpx
+from fastapi.testclient import TestClient
+
+from conftest import log_item
+
+EXPORT_POINTS: int = 50_000
+IDLE_POSTS: int = 20
+
+
+def csv_upload(n: int) -> dict:
+    lines: list[str] = ["time,lat,lon"] + [
+        f"{log_item('big', i)['ts'].replace('+00:00', 'Z')},{45 + 1e-5 * i:.7f},{-121 + 1e-5 * i:.7f}"
+        for i in range(n)]
+    return {"file": ("big.csv", "\n".join(lines).encode())}
+
+
+async def post_point(http: httpx.AsyncClient, i: int) -> float:
+    start: float = time.perf_counter()
+    response: httpx.Response = await http.post("/track", json=log_item("live", i))
+    assert response.status_code == 200
+    return time.perf_counter() - start
+
+
+async def export(http: httpx.AsyncClient, params: dict) -> int:
+    size: int = 0
+    async with http.stream("GET", "/k/track/big/json", params=params) as response:
+        async for part in response.aiter_bytes():
+            size += len(part)
+    return size
+
+
+async def measure(app) -> tuple[list[float], list[float], list[int]]:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+        idle: list[float] = [await post_point(http, i) for i in range(IDLE_POSTS)]
+        # two streamed exports of the whole track, points are posted for as long as they run
+        exports: list[asyncio.Task] = [asyncio.create_task(export(http, {"stream": True})) for _ in range(2)]
+        loaded: list[float] = []
+        while not all(task.done() for task in exports):
+            loaded.append(await post_point(http, IDLE_POSTS + len(loaded)))
+        sizes: list[int] = [task.result() for task in exports]
+    return idle, loaded, sizes
+
+
+def test_ingest_latency_flat_during_exports(client: TestClient):
+    assert client.post("/k/track/big/import", params={"fmt": "csv"},
+                       files=csv_upload(EXPORT_POINTS)).json()["stored"] == EXPORT_POINTS
+
+    idle, loaded, sizes = client.portal.call(measure, client.app)
+    assert sizes[0] == sizes[1] > EXPORT_POINTS * 20
+    assert len(loaded) >= 5
+    # reading and writing the exports shares the event loop with ingest, a long track mustn't hold it
+    assert statistics.median(loaded) <= max(5 * statistics.median(idle), 0.1)
+    assert max(loaded) < 0.5
@@ -0,0 +1,58 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Optional
+
+import geojson
+import pytest
+
+from backtrack.storage.encoders import DateTimeGeojsonEncoder
+from backtrack.storage.geojson_writer import write_geojson
+from backtrack.storage.models import LogTrack, LogTrackDetails, LogPoint
+from backtrack.storage.streaming import stream_geojson
+
+START: datetime = datetime(2024, 1, 1, 9, tzinfo=timezone.utc)
+
+
+def make_track(n: int, track_id: str = "bench", description: Optional[str] = None) -> LogTrack:
+    details: LogTrackDetails = LogTrackDetails(track_id=track_id, key="k", description=description, start_time=START,
+                                               profile="default")
+    # newest first, like the controller returns them
+    points: list[LogPoint] = [
+        LogPoint(track_id=track_id, ts=START + timedelta(seconds=n - i, milliseconds=i % 1000), lat=45 + i * 1e-5,
+                 lon=-121 + i * 1e-5, altitude=100 + i % 50 if i % 7 else None, speed_kph=i % 90 * 1.5, battery=80.0)
+        for i in range(n)]
+    return LogTrack(details=details, points=points)
+
+
+def expected(track: LogTrack) -> str:
+    return geojson.dumps(track.get_geojson_track(), cls=DateTimeGeojsonEncoder)
+
+
+async def streamed(track: LogTrack, partition: int = 1000) -> str:
+    async def rows() -> AsyncIterator[list[tuple]]:
+        for start in range(0, len(track.points), partition):
+            yield [(p.ts, p.lon, p.lat, p.altitude) for p in track.points[start:start + partition]]
+
+    latest: Optional[LogPoint] = track.points[0] if track.points else None
+    return "".join([part async for part in stream_geojson(track.details, rows(), latest)])
+
+
+TRACKS: dict[str, LogTrack] = {
+    "empty": make_track(0),
+    "one": make_track(1),
+    "long": make_track(2500),
+    "non-ascii": make_track(20, track_id="Zürich–Genève 🚲", description="Col du Pillon, 1546 m, «montée»"),
+}
+
+
+@pytest.mark.parametrize("name", TRACKS)
+def test_writer_matches_geojson(name: str):
+    track: LogTrack = TRACKS[name]
+    assert write_geojson(track.details, [(p.lon, p.lat, p.altitude) for p in track.points],
+                         track.points[0] if track.points else None) == expected(track)
+
+
+@pytest.mark.parametrize("name", TRACKS)
+def test_stream_matches_writer(name: str):
+    track: LogTrack = TRACKS[name]
+    assert asyncio.run(streamed(track)) == expected(track)
@@ -0,0 +1,27 @@
+from fastapi.testclient import TestClient
+from sqlalchemy import func
+from sqlmodel import select
+
+from backtrack.controllers.controller import BacktrackController
+from backtrack.storage.models import LogKey
+from conftest import log_item
+
+
+def key_count(client: TestClient, controller: BacktrackController) -> int:
+    async def count() -> int:
+        async with controller.async_engine.connect() as conn:
+            return (await conn.execute(select(func.count()).select_from(LogKey))).scalar()
+
+    return client.portal.call(count)
+
+
+def test_reserved_keys_stored_on_first_point(client: TestClient, controller: BacktrackController):
+    for _ in range(3):
+        assert client.get("/").status_code == 200
+    keys: list[str] = [client.portal.call(controller.get_next_squid) for _ in range(50)]
+    assert len(set(keys)) == 50
+    assert key_count(client, controller) == 0
+
+    client.post("/track", json=log_item("a", 0, key=keys[0]))
+    assert key_count(client, controller) == 1
+    assert keys[0] not in [client.portal.call(controller.get_next_squid) for _ in range(50)]
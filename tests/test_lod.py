@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backtrack.config.config import AppConfig, LodConfig
+from backtrack.controllers.controller import BacktrackController
+from backtrack.controllers.lod import TrackLod
+from conftest import log_item
+
+
+@pytest.fixture
+def app_conf(app_conf: AppConfig) -> AppConfig:
+    app_conf.lod = LodConfig(enabled=True)
+    return app_conf
+
+
+def test_concurrent_builds_load_once(client: TestClient, controller: BacktrackController,
+                                     monkeypatch: pytest.MonkeyPatch):
+    client.post("/track/batch", json=[log_item("a", i) for i in range(20)])
+    loads: list[str] = []
+    get_track_arrays = controller.get_track_arrays
+
+    async def counted(track_id: str):
+        loads.append(track_id)
+        await asyncio.sleep(0.05)
+        return await get_track_arrays(track_id)
+
+    monkeypatch.setattr(controller, "get_track_arrays", counted)
+
+    async def cold_requests() -> list[TrackLod]:
+        return list(await asyncio.gather(*[controller.get_track_lod("a") for _ in range(4)]))
+
+    lods: list[TrackLod] = client.portal.call(cold_requests)
+    assert loads == ["a"]
+    assert all(lod is lods[0] for lod in lods)
+    assert not controller.lod.builds and not controller.lod.building
+
+
+def test_failed_build_stops_buffering(client: TestClient, controller: BacktrackController,
+                                      monkeypatch: pytest.MonkeyPatch):
+    client.post("/track/batch", json=[log_item("a", i) for i in range(20)])
+
+    async def failing(track_id: str):
+        raise OSError("database went away")
+
+    monkeypatch.setattr(controller, "get_track_arrays", failing)
+    with pytest.raises(OSError):
+        client.portal.call(controller.get_track_lod, "a")
+    assert not controller.lod.builds and not controller.lod.building
+
+    # later points aren't buffered for a build that's gone, and the next request builds again
+    client.post("/track", json=log_item("a", 20))
+    assert "a" not in controller.lod.building
+    monkeypatch.undo()
+    assert len(client.portal.call(controller.get_track_lod, "a").ts) == 21
@@ -0,0 +1,79 @@
+from typing import Callable, Optional
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backtrack.config.config import AppConfig, MaintenanceConfig
+from backtrack.controllers.controller import BacktrackController
+from backtrack.metrics import registry
+from conftest import log_item
+
+
+@pytest.fixture
+def app_conf(app_conf: AppConfig) -> AppConfig:
+    app_conf.maintenance = MaintenanceConfig(decimate_after_days=1, decimate_interval_s=60)
+    return app_conf
+
+
+def sample(name: str, **labels: str) -> float:
+    value: Optional[float] = registry.get_sample_value(name, labels)
+    return value or 0.0
+
+
+def deltas(samples: list[tuple]) -> Callable[[], list[float]]:
+    """Snapshot the given (name, labels) samples, the returned function gives how much each moved since."""
+    before: list[float] = [sample(name, **labels) for name, labels in samples]
+    return lambda: [sample(name, **labels) - start for (name, labels), start in zip(samples, before)]
+
+
+def test_point_counters(client: TestClient, controller: BacktrackController):
+    moved = deltas([("backtrack_points_stored_total", {"source": "log"}),
+                    ("backtrack_points_stored_total", {"source": "import"}),
+                    ("backtrack_points_duplicate_total", {"source": "recent"}),
+                    ("backtrack_points_duplicate_total", {"source": "database"}),
+                    ("backtrack_points_removed_total", {"job": "decimate"})])
+
+    client.post("/track/batch", json=[log_item("a", i) for i in range(60)])
+    client.post("/track", json=log_item("a", 60))
+    assert moved() == [61, 0, 0, 0, 0]
+
+    # caught by the recently stored points, then once they're forgotten by the insert
+    client.post("/track/batch", json=[log_item("a", i) for i in range(55, 61)])
+    controller.recent.forget("a")
+    client.post("/track/batch", json=[log_item("a", i) for i in range(58, 61)])
+    assert moved() == [61, 0, 6, 3, 0]
+
+    lines: list[str] = ["time,lat,lon"] + [f"{log_item('b', i)['ts'].replace('+00:00', 'Z')},45,-121"
+                                           for i in range(10)]
+    client.post("/k/track/b/import", params={"fmt": "csv"}, files={"file": ("b.csv", "\n".join(lines).encode())})
+    assert moved() == [61, 10, 6, 3, 0]
+
+    removed: int = client.portal.call(controller.run_maintenance, ["decimate"])["decimate"]
+    assert removed > 0
+    assert moved() == [61, 10, 6, 3, removed]
+
+
+def test_request_and_cache_metrics(client: TestClient, controller: BacktrackController):
+    client.post("/track/batch", json=[log_item("a", i) for i in range(5)])
+    route: dict[str, str] = {"method": "GET", "route": "/{key}/track/{track_id}/{fmt}", "status": "200"}
+    moved = deltas([("backtrack_request_seconds_count", route),
+                    ("backtrack_cache_hits_total", {"cache": "track"}),
+                    ("backtrack_cache_misses_total", {"cache": "track"}),
+                    ("backtrack_serialize_seconds_count", {"format": "geojson"})])
+
+    identity: dict[str, str] = {"Accept-Encoding": "identity"}
+    for _ in range(3):
+        assert client.get("/k/track/a/geojson", headers=identity).status_code == 200
+    # rendered once, then served from the cache
+    assert moved() == [3, 2, 1, 1]
+    assert sample("backtrack_cache_entries", cache="track") == 1
+    assert sample("backtrack_cache_bytes") > 0
+
+    client.post("/track", json=log_item("a", 5))
+    client.get("/k/track/a/geojson", headers=identity)
+    assert moved() == [4, 2, 2, 2]
+
+    text: str = client.get("/metrics").text
+    assert 'backtrack_request_seconds_count{method="GET",route="/{key}/track/{track_id}/{fmt}",status="200"}' in text
+    assert "backtrack_ingest_queue_depth 0.0" in text
+    assert 'backtrack_db_query_seconds_count{operation="INSERT"}' in text
@@ -0,0 +1,41 @@
+import asyncio
+from typing import ClassVar
+
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlmodel import Field, select
+
+from backtrack.config.config import DatabaseConfig, WriterConfig
+from backtrack.storage import create_engine
+from xcb_sadel.base import Sadel
+
+
+class SadelItem(Sadel, table=True):
+    name: str = Field(primary_key=True)
+    value: int
+
+    _upsert_index_elements: ClassVar[set[str]] = {"name"}
+
+
+async def upsert_and_read(url: str, batches: list[list[SadelItem]], chunk_size: int) -> dict[str, int]:
+    engine: AsyncEngine = create_engine(DatabaseConfig(url=url), WriterConfig())
+    async with engine.begin() as conn:
+        await conn.run_sync(SadelItem.metadata.create_all, tables=[SadelItem.__table__])
+    async with AsyncSession(engine) as session:
+        for batch in batches:
+            await SadelItem.batch_upsert(batch, session, chunk_size)
+        rows = (await session.execute(select(SadelItem.name, SadelItem.value))).all()
+    await engine.dispose()
+    return dict(rows)
+
+
+def test_batch_upsert_duplicate_keys(database_url: str):
+    # one chunk holding the same key twice, postgresql refuses to update a row twice in one statement,
+    # the last one wins like a loop of single upserts
+    batches: list[list[SadelItem]] = [
+        [SadelItem(name="a", value=1), SadelItem(name="b", value=1)],
+        [SadelItem(name="a", value=2), SadelItem(name="c", value=1), SadelItem(name="a", value=3),
+         SadelItem(name="b", value=2)],
+    ]
+    assert asyncio.run(upsert_and_read(database_url, batches, chunk_size=10)) == {"a": 3, "b": 2, "c": 1}
+    unique: list[dict] = SadelItem._get_unique_records([SadelItem._get_record_to_insert(i) for i in batches[1]])
+    assert [(record["name"], record["value"]) for record in unique] == [("a", 3), ("c", 1), ("b", 2)]
@@ -0,0 +1,63 @@
+"""
+The cold start budget of benchmarks/startup.py as a test: import time of backtrack.main under -X importtime and the
+time until the lifespan startup finished, each in a fresh interpreter, and no lazily imported library at startup.
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+from statistics import median
+
+from conftest import SRC
+
+# medians of RUNS fresh interpreters, in milliseconds
+IMPORT_BUDGET_MS: float = 750
+READY_BUDGET_MS: float = 2000
+RUNS: int = 3
+# only imported by the requests that need them, see create_app
+LAZY: tuple[str, ...] = ("gpxpy", "lxml", "geojson", "ijson", "jinja2")
+
+STARTUP: str = """
+import asyncio, json, sys, time
+
+start = time.perf_counter()
+from backtrack.main import create_app
+imported = time.perf_counter()
+from backtrack.config.config import AppConfig, GeneralConfig, DatabaseConfig, WriterConfig
+
+app = create_app(app_conf=AppConfig(general=GeneralConfig(static_dir=sys.argv[1], template_dir=sys.argv[2],
+                                                          hostname="localhost", log_level="warning"),
+                                    database=DatabaseConfig(url=sys.argv[3]),
+                                    writer=WriterConfig(socket_path=sys.argv[4])))
+
+
+async def ready():
+    async with app.router.lifespan_context(app):
+        return time.perf_counter()
+
+print(json.dumps({"ready_s": asyncio.run(ready()) - start, "modules": sorted(sys.modules)}))
+"""
+
+# -X importtime lines: self us | cumulative us | indented package
+IMPORT_TIME: re.Pattern = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+def start(tmp_path: Path, run: int) -> tuple[float, float, set[str]]:
+    """Cumulative import time of backtrack.main and the time until ready in ms, and the top level modules loaded."""
+    args: list[str] = [str(SRC / "static"), str(SRC / "templates"), f"sqlite:///{tmp_path / f'startup{run}.db'}",
+                       str(tmp_path / "writer.sock")]
+    done = subprocess.run([sys.executable, "-X", "importtime", "-c", STARTUP, *args], capture_output=True, text=True,
+                          check=True, env=dict(os.environ, PYTHONPATH=str(SRC)))
+    imported: int = next(int(match.group(2)) for match in IMPORT_TIME.finditer(done.stderr)
+                         if not match.group(3) and match.group(4) == "backtrack.main")
+    result: dict = json.loads(done.stdout.splitlines()[-1])
+    return imported / 1000, result["ready_s"] * 1000, {module.split(".")[0] for module in result["modules"]}
+
+
+def test_startup_budget(tmp_path: Path):
+    runs: list[tuple[float, float, set[str]]] = [start(tmp_path, run) for run in range(RUNS)]
+    assert median(imported for imported, _, _ in runs) <= IMPORT_BUDGET_MS
+    assert median(ready for _, ready, _ in runs) <= READY_BUDGET_MS
+    assert [name for name in LAZY if name in runs[0][2]] == []
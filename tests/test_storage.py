@@ -0,0 +1,81 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import START, log_item
+
+
+def csv_upload(rows: range) -> dict:
+    lines: list[str] = ["time,lat,lon"] + [
+        f"{log_item('i', i)['ts'].replace('+00:00', 'Z')},{45 + 0.001 * i},{-121 + 0.001 * i}" for i in rows]
+    return {"file": ("track.csv", "\n".join(lines).encode())}
+
+
+def test_stored_points_read_back(client: TestClient):
+    assert client.post("/track/batch", json=[log_item("a", i) for i in range(5)]).json() == {"stored": 5}
+    assert client.post("/track/batch", json=[log_item("a", i) for i in range(3, 8)]).json() == {"stored": 3}
+
+    track: dict = client.get("/k/track/a/json").json()
+    line: list[list[float]] = track["features"][0]["geometry"]["coordinates"]
+    # newest first
+    assert len(line) == 8
+    assert line[0] == [round(-121 + 0.007, 6), round(45 + 0.007, 6)]
+    assert client.get("/tracks", params={"key": "k"}).json() == ["a"]
+
+
+def test_import_counts_new_rows(client: TestClient):
+    assert client.post("/k/track/i/import", params={"fmt": "csv"}, files=csv_upload(range(10))).json() == {
+        "parsed": 10, "stored": 10}
+    assert client.post("/k/track/i/import", params={"fmt": "csv"}, files=csv_upload(range(5, 15))).json() == {
+        "parsed": 10, "stored": 5}
+
+    stats: dict = client.get("/tracks", params={"key": "k", "stats": True}).json()[0]
+    assert stats["point_count"] == 15
+    assert stats["first_ts"] == START.isoformat()
+
+
+def test_bbox_query(client: TestClient):
+    client.post("/track/batch", json=[log_item("a", i) for i in range(20)])
+
+    found: dict = client.get("/k/points", params={"bbox": "-120.9955,45.0045,-120.9875,45.0125"}).json()
+    assert sorted(round(f["geometry"]["coordinates"][1], 6) for f in found["features"]) == [
+        round(45 + 0.001 * i, 6) for i in range(5, 13)]
+
+
+def test_streamed_export_matches_buffered(client: TestClient, controller):
+    client.post("/track/batch", json=[log_item("a", i) for i in range(0, 60, 2)])
+    assert client.portal.call(controller.archiver.archive_track, "a") == 30
+    # newer points and late ones between the archived ones, read back merged
+    client.post("/track/batch", json=[log_item("a", i) for i in [61, 62, 63, 7, 31, 45]])
+
+    for params in [{}, {"bbox": "-120.99,45.0,-120.9,45.1"}, {"start": log_item("a", 20)["ts"]}]:
+        streamed: bytes = client.get("/k/track/a/json", params={**params, "stream": True}).content
+        buffered: bytes = client.get("/k/track/a/json", params=params).content
+        assert streamed == buffered
+
+
+def test_bbox_query_after_vacuum(client: TestClient, controller):
+    if controller.dialect != "sqlite":
+        pytest.skip("the R*Tree is sqlite's")
+    client.post("/track/batch", json=[log_item("a", i) for i in range(20)])
+    client.post("/track/batch", json=[{**log_item("b", i), "lon": -120.9 + 0.001 * i} for i in range(20)])
+
+    async def vacuum():
+        # what a VACUUM may do, b's points take the rowids a's had, the R*Tree keeps pointing at the old ones
+        async with controller.async_engine.begin() as conn:
+            await conn.exec_driver_sql("DELETE FROM logpoint WHERE track_id = 'a'")
+            await conn.exec_driver_sql("UPDATE logpoint SET rowid = rowid - 20")
+
+    client.portal.call(vacuum)
+    bbox: dict = {"bbox": "-120.8955,45.0045,-120.8875,45.0125"}
+    assert client.get("/k/points", params=bbox).json()["features"] == []
+    assert client.portal.call(controller.run_maintenance, ["reindex"]) == {"reindex": 20}
+    found: dict = client.get("/k/points", params=bbox).json()
+    assert sorted((f["properties"]["track_id"], round(f["geometry"]["coordinates"][1], 6))
+                  for f in found["features"]) == [("b", round(45 + 0.001 * i, 6)) for i in range(5, 13)]
+
+
+def test_search_limit(client: TestClient):
+    client.post("/track/batch", json=[log_item("a", i) for i in range(20)])
+    assert len(client.get("/k/points", params={"limit": 3}).json()["features"]) == 3
+    for limit in [0, -1, 10 ** 9]:
+        assert client.get("/k/points", params={"limit": limit}).status_code == 422
@@ -0,0 +1,71 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from backtrack.config.config import AppConfig, MaintenanceConfig
+from backtrack.controllers.controller import BacktrackController
+from backtrack.storage.summary import summarize
+from conftest import log_item
+
+
+@pytest.fixture
+def app_conf(app_conf: AppConfig) -> AppConfig:
+    # one point a minute is kept of what's older than a day, every test track is
+    app_conf.maintenance = MaintenanceConfig(decimate_after_days=1, decimate_interval_s=60)
+    return app_conf
+
+
+def track_stats(client: TestClient, track_id: str) -> dict:
+    return {s["track_id"]: s for s in client.get("/tracks", params={"key": "k", "stats": True}).json()}[track_id]
+
+
+def assert_summary_matches(client: TestClient, controller: BacktrackController, track_id: str) -> dict:
+    """The incrementally kept summary against one computed from every point of the track."""
+    stats: dict = track_stats(client, track_id)
+    full: dict = summarize(track_id, client.portal.call(controller.get_track_arrays, track_id)).stats()
+    assert stats["point_count"] == full["point_count"]
+    assert stats["distance_m"] == pytest.approx(full["distance_m"], rel=1e-9)
+    assert stats["duration_s"] == full["duration_s"]
+    assert stats["first_ts"] == full["first_ts"].isoformat()
+    assert stats["last_ts"] == full["last_ts"].isoformat()
+    assert stats["bbox"] == pytest.approx(full["bbox"])
+    return stats
+
+
+def test_summary_after_out_of_order_points(client: TestClient, controller: BacktrackController):
+    client.post("/track/batch", json=[log_item("a", i) for i in range(0, 40, 2)])
+    # late points between stored ones, one at a time and batched, with resends mixed in
+    for i in [7, 13, 29]:
+        client.post("/track", json=log_item("a", i))
+    client.post("/track/batch", json=[log_item("a", i) for i in [1, 3, 5, 20, 21, 21, 39]])
+    client.post("/track", json=log_item("a", -4))
+
+    stats: dict = assert_summary_matches(client, controller, "a")
+    assert stats["point_count"] == 29
+    assert stats["first_ts"] == log_item("a", -4)["ts"]
+    assert stats["last_ts"] == log_item("a", 39)["ts"]
+
+
+def test_summary_after_removed_points(client: TestClient, controller: BacktrackController):
+    client.post("/track/batch", json=[log_item("a", i) for i in range(60)])
+    removed: int = client.portal.call(controller.run_maintenance, ["decimate"])["decimate"]
+    assert removed > 0
+
+    stats: dict = assert_summary_matches(client, controller, "a")
+    assert stats["point_count"] == 60 - removed
+    # late points between the ones decimation kept, and newer ones, fold into the rebuilt summary
+    client.post("/track/batch", json=[log_item("a", i + 0.5) for i in [3, 17, 44]])
+    client.post("/track/batch", json=[log_item("a", i) for i in range(60, 66)])
+    stats = assert_summary_matches(client, controller, "a")
+    assert stats["point_count"] == 60 - removed + 9
+
+
+def test_summary_after_import_and_archive(client: TestClient, controller: BacktrackController):
+    client.post("/track/batch", json=[log_item("a", i) for i in range(10, 30)])
+    assert client.portal.call(controller.archiver.archive_track, "a") == 20
+    lines: list[str] = ["time,lat,lon"] + [f"{log_item('a', i)['ts'].replace('+00:00', 'Z')},{45 + 0.001 * i},"
+                                           f"{-121 + 0.001 * i}" for i in range(0, 15)]
+    client.post("/k/track/a/import", params={"fmt": "csv"}, files={"file": ("a.csv", "\n".join(lines).encode())})
+    client.post("/track", json=log_item("a", 30))
+
+    stats: dict = assert_summary_matches(client, controller, "a")
+    assert stats["point_count"] == 31
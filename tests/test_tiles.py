@@ -0,0 +1,47 @@
+import math
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from backtrack.storage.mvt import tile_lines, to_tile_units, BUFFER, EXTENT
+from conftest import log_item
+
+Z: int = 16
+
+
+def test_segment_crossing_tile(client: TestClient):
+    # two points about 3 km apart, the tiles between them have no vertex in them
+    points: list[dict] = [log_item("a", 0), {**log_item("a", 1), "lon": -120.96}]
+    client.post("/track/batch", json=points)
+    (x0, y), (x1, _) = (map(math.floor, xy) for xy in
+                        to_tile_units(np.array([[p["lon"], p["lat"]] for p in points]), Z))
+    assert x1 - x0 > 2
+
+    lonlat: np.ndarray = np.array([[p["lon"], p["lat"]] for p in points])
+    for x in range(x0, x1 + 1):
+        tile = client.get(f"/k/tiles/{Z}/{x}/{y}.mvt")
+        assert tile.status_code == 200
+        assert len(tile.content) > 0
+        lines: list[np.ndarray] = tile_lines(lonlat, Z, x, y)
+        assert len(lines) == 1
+        # clipped to the buffered tile, not the whole segment
+        assert lines[0].min() >= -BUFFER and lines[0].max() <= EXTENT + BUFFER
+    assert client.get(f"/k/tiles/{Z}/{x1 + 1}/{y}.mvt").content == b""
+    assert client.get(f"/k/tiles/{Z}/{x0}/{y + 2}.mvt").content == b""
+
+
+def test_tile_lines_break_outside_tile():
+    # out of the tile and back in again is two lines
+    n: int = 2 ** Z
+
+    def lon(tx: float) -> float:
+        return tx / n * 360 - 180
+
+    def lat(ty: float) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    lonlat: np.ndarray = np.array([[lon(10.25), lat(10.5)], [lon(12.5), lat(10.5)], [lon(12.5), lat(10.75)],
+                                   [lon(10.5), lat(10.75)]])
+    lines: list[np.ndarray] = tile_lines(lonlat, Z, 10, 10)
+    assert [line.tolist() for line in lines] == [[[1024, 2048], [EXTENT + BUFFER, 2048]],
+                                                 [[EXTENT + BUFFER, 3072], [2048, 3072]]]
@@ -0,0 +1,111 @@
+import time
+from dataclasses import replace
+from typing import Callable, Iterator
+
+import pytest
+from anyio.from_thread import BlockingPortal, start_blocking_portal
+from fastapi.testclient import TestClient
+
+from backtrack.config.config import AppConfig
+from backtrack.controllers import create_controller
+from backtrack.controllers.controller import BacktrackController
+from backtrack.controllers.writer import WriterClient, WriterError, WriterServer
+from backtrack.main import create_app
+from backtrack.storage.db import create_db_and_tables
+from conftest import log_item
+
+
+class Writer:
+    """The writer process's controller and socket, served from a thread of its own like backtrack.writer.serve."""
+
+    def __init__(self, portal: BlockingPortal, app_conf: AppConfig):
+        self.portal = portal
+        self.app_conf = replace(app_conf, writer=replace(app_conf.writer, enabled=False),
+                                ingest=replace(app_conf.ingest, batched=True, batch_latency_ms=10))
+        self.controller: BacktrackController = create_controller(self.app_conf)
+        self.server: WriterServer = WriterServer(self.controller, app_conf.writer.socket_path)
+
+    def start(self) -> None:
+        self.portal.call(create_db_and_tables, self.controller.async_engine)
+        self.portal.call(self.controller.start)
+        self.portal.call(self.server.start)
+
+    def stop(self) -> None:
+        self.portal.call(self.server.stop)
+        self.portal.call(self.controller.stop)
+
+
+@pytest.fixture
+def writer(app_conf: AppConfig) -> Iterator[Writer]:
+    with start_blocking_portal() as portal:
+        writer: Writer = Writer(portal, app_conf)
+        writer.start()
+        yield writer
+        if writer.server.server is not None:
+            writer.stop()
+        portal.call(writer.controller.async_engine.dispose)
+
+
+@pytest.fixture
+def worker(writer: Writer, app_conf: AppConfig) -> Iterator[TestClient]:
+    app_conf.writer.enabled = True
+    app_conf.writer.connect_timeout_s = 0.5
+    with TestClient(create_app(app_conf=app_conf)) as test_client:
+        yield test_client
+
+
+def eventually(check: Callable[[], bool], timeout: float = 5) -> None:
+    deadline: float = time.monotonic() + timeout
+    while not check():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+
+def point_count(client: TestClient, track_id: str) -> int:
+    return {s["track_id"]: s["point_count"]
+            for s in client.get("/tracks", params={"key": "k", "stats": True}).json()}.get(track_id, 0)
+
+
+def test_writes_round_trip(writer: Writer, worker: TestClient):
+    controller: BacktrackController = worker.app.state.controller
+    assert worker.post("/track/batch", json=[log_item("a", i) for i in range(10)]).json() == {"stored": 10}
+    # the writer's stored event reached the worker before the reply did, the resend is dropped there
+    assert worker.post("/track/batch", json=[log_item("a", i) for i in range(10)]).json() == {"stored": 0}
+    assert "a" in controller.recent.tracks
+
+    # single points are group committed by the writer
+    for i in range(10, 15):
+        worker.post("/track", json=log_item("a", i))
+    eventually(lambda: point_count(worker, "a") == 15)
+
+    lines: list[str] = ["time,lat,lon"] + [f"{log_item('b', i)['ts'].replace('+00:00', 'Z')},45,-121"
+                                           for i in range(20)]
+    assert worker.post("/k/track/b/import", params={"fmt": "csv"},
+                       files={"file": ("b.csv", "\n".join(lines).encode())}).json() == {"parsed": 20, "stored": 20}
+    assert point_count(worker, "b") == 20
+    coordinates: list = worker.get("/k/track/a/json").json()["features"][0]["geometry"]["coordinates"]
+    assert len(coordinates) == 15
+
+
+def test_writer_errors(writer: Writer, worker: TestClient):
+    client: WriterClient = worker.app.state.controller.writer
+    # a failed call is answered with its error, the connection stays usable
+    with pytest.raises(WriterError, match="unknown writer op"):
+        worker.portal.call(client.call, "bogus")
+    with pytest.raises(WriterError, match="validation error"):
+        worker.portal.call(lambda: client.call("logs", logs=[[{"key": "k"}, {"track_id": "a"}]]))
+    assert worker.post("/track/batch", json=[log_item("a", 0)]).json() == {"stored": 1}
+
+    # without a writer, writes fail once the connect timeout is up
+    writer.stop()
+    with pytest.raises(WriterError):
+        worker.post("/track/batch", json=[log_item("a", 1)])
+    with pytest.raises(WriterError, match="no writer listening"):
+        worker.post("/track/batch", json=[log_item("a", 2)])
+
+    # and go through again on a writer restart, reconnecting resets the worker's caches
+    writer.server = WriterServer(writer.controller, writer.app_conf.writer.socket_path)
+    writer.portal.call(writer.controller.start)
+    writer.portal.call(writer.server.start)
+    assert worker.post("/track/batch", json=[log_item("a", i) for i in range(3)]).json() == {"stored": 2}
+    assert point_count(worker, "a") == 3